@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Offline microbenchmarks for the agent's non-LLM hot path.
+
+Measures ops/sec and peak allocation per call of output parsing, whole and
+streamed in small chunks, compile checks, warm-worker execution and JSON-RPC
+serialization over a synthetic corpus of model outputs, and compares them with
+a stored baseline.
+
+    python benchmarks/bench_agent.py                  # compare with baseline.json
+    python benchmarks/bench_agent.py --save-baseline  # record a new baseline
+    python benchmarks/bench_agent.py --filter clean --threshold 0.3
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "aython" / "agent" / "app"))
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+DEFAULT_THRESHOLD = 0.25
+# Peak allocations below this many bytes are too small to compare meaningfully.
+ALLOCATION_SLACK = 1024
+STREAM_CHUNK = 16
+RPC_CASES = ("plain", "huge_fenced")
+EXECUTION_CASES = {
+    "assign": "x = 1",
+    "print_10k": "print('x' * 10000)",
+    "traceback": "raise ValueError('boom')",
+}
+
+
+def _function(i: int) -> str:
+    return (
+        f"def handler_{i}(items, factor={i}):\n"
+        f"    \"\"\"Scale and filter item {i}.\"\"\"\n"
+        f"    result = []\n"
+        f"    for item in items:\n"
+        f"        if item % {i % 7 + 2} == 0:\n"
+        f"            result.append(item * factor)\n"
+        f"    return result\n"
+    )
+
+
+def corpus() -> dict:
+    """Synthetic model outputs, keyed by shape."""
+    small = _function(1)
+    huge = "\n".join(_function(i) for i in range(2000))
+    markdown = f"Here is the code:\n\n```python\n{small}```\n\nIt filters and scales items."
+    nested = (
+        "````markdown\n```python\n"
+        + small
+        + "```\n````\n"
+        + "```python\n"
+        + small.replace("result = []", "result = []  # see ```notes```")
+        + "```"
+    )
+    return {
+        "plain": small,
+        "fenced": f"```python\n{small}```",
+        "markdown": markdown,
+        "nested_fences": nested,
+        "json": json.dumps({"code_snippet": small}),
+        "json_fenced": "```json\n" + json.dumps({"code_snippet": f"```python\n{small}```"}) + "\n```",
+        "syntax_error": small.replace("def handler_1(items", "def handler_1(items,,"),
+        "huge_fenced": f"```python\n{huge}\n```",
+        "huge_json": json.dumps({"code_snippet": huge}),
+    }
+
+
+def _measure(fn, min_time: float, repeat: int):
+    """Return (ops_per_sec, relative, peak_bytes) of calling ``fn``.
+
+    Each of ``repeat`` rounds times about ``min_time`` seconds of ``fn`` right
+    after a shorter round of the calibration workload. ops/sec is the best round;
+    ``relative`` is the median of the per-round speed ratios to the calibration;
+    comparing it instead of ops/sec keeps a busy, throttled or different machine
+    from reading as a regression, so baselines carry over. As in timeit, the
+    garbage collector is off while timing. Peak allocation is measured on one
+    extra call.
+    """
+    gc.collect()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        number = _loops(fn, min_time)
+        reference_number = _loops(_calibration, min_time / 2)
+        best, ratios = float("inf"), []
+        for _ in range(repeat):
+            reference = reference_number / _time(_calibration, reference_number)
+            elapsed = _time(fn, number)
+            best = min(best, elapsed)
+            ratios.append(number / elapsed / reference)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return number / best, statistics.median(ratios), peak
+
+
+def _time(fn, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return time.perf_counter() - start
+
+
+def _loops(fn, min_time: float) -> int:
+    """How many calls of ``fn`` take about ``min_time`` seconds."""
+    fn()
+    number = 1
+    while True:
+        elapsed = _time(fn, number)
+        if elapsed >= min_time / 4 or number >= 1 << 20:
+            break
+        number *= 4
+    return max(1, int(number * (min_time / max(elapsed, 1e-9))))
+
+
+def _calibration():
+    text = "def f(x):\n    return x * 2\n" * 20
+    return sum(len(line.strip()) for line in text.splitlines()) + len(json.dumps({"code": text}))
+
+
+def _parsing_benchmarks(outputs: dict) -> dict:
+    from aython_agent import check_code, clean_model_output
+    from code_extractor import CodeExtractor
+
+    silent = io.StringIO()
+
+    def checked(text):
+        # check_code prints failures; keep the report readable.
+        silent.seek(0)
+        silent.truncate()
+        with contextlib.redirect_stdout(silent):
+            return check_code(text)
+
+    def streamed(text):
+        # Token-sized chunks, as the streaming path feeds them.
+        extractor = CodeExtractor()
+        for i in range(0, len(text), STREAM_CHUNK):
+            extractor.feed(text[i:i + STREAM_CHUNK])
+        return extractor.close()
+
+    benchmarks = {}
+    for name, text in outputs.items():
+        benchmarks[f"extract_streamed[{name}]"] = lambda t=text: streamed(t)
+        benchmarks[f"clean_model_output[{name}]"] = lambda t=text: clean_model_output(t)
+        benchmarks[f"check_code[{name}]"] = lambda t=clean_model_output(text): checked(t)
+    return benchmarks
+
+
+@contextlib.contextmanager
+def _execution_benchmarks():
+    from aython_agent import AythonAgent
+    from worker_pool import WorkerPool
+
+    # No recycling, so the occasional interpreter respawn does not show up as noise.
+    pool = WorkerPool(size=1, max_runs=sys.maxsize)
+    pool.warm()
+    agent = AythonAgent("gpt-4o-mini", worker_pool=pool)
+    try:
+        yield {
+            f"execute_code[{name}]": lambda code=code: agent.execute_code(code)
+            for name, code in EXECUTION_CASES.items()
+        }
+    finally:
+        pool.close()
+
+
+@contextlib.contextmanager
+def _rpc_benchmarks(outputs: dict):
+    from jsonrpcserver import async_dispatch
+    from aython_agent import ExecutionResult
+    import main
+
+    loop = asyncio.new_event_loop()
+    try:
+        benchmarks = {}
+        for name in RPC_CASES:
+            result = {
+                "code_snippet": outputs[name],
+                "execution_result": ExecutionResult(exit_code=0, stdout="ok\n" * 100, stderr=""),
+                "debug_log": "",
+                "cache_hit": False,
+                "timings": {"generate_ms": 1200.0, "execute_ms": 3.5},
+                "error": None,
+            }
+
+            async def generate_and_run(result=result):
+                return main._to_rpc(main._generate_response(result))
+
+            request = json.dumps({"jsonrpc": "2.0", "method": "generate_and_run", "params": {}, "id": 1})
+            methods = {"generate_and_run": generate_and_run}
+            benchmarks[f"rpc_response[{name}]"] = (
+                lambda m=methods: loop.run_until_complete(async_dispatch(request, methods=m))
+            )
+        yield benchmarks
+    finally:
+        loop.close()
+
+
+def run(name_filter: str = "", min_time: float = 0.2, repeat: int = 5, execution: bool = True) -> dict:
+    """Run the suite and return ``{name: {"ops_per_sec", "relative", "peak_bytes"}}``.
+
+    ``relative`` is ops/sec as a multiple of the calibration workload's.
+    """
+    outputs = corpus()
+    results = {}
+    with contextlib.ExitStack() as stack:
+        benchmarks = dict(_parsing_benchmarks(outputs))
+        if any(name_filter in f"rpc_response[{case}]" for case in RPC_CASES):
+            benchmarks.update(stack.enter_context(_rpc_benchmarks(outputs)))
+        if execution and any(name_filter in f"execute_code[{case}]" for case in EXECUTION_CASES):
+            benchmarks.update(stack.enter_context(_execution_benchmarks()))
+        for name, fn in benchmarks.items():
+            if name_filter and name_filter not in name:
+                continue
+            ops, relative, peak = _measure(fn, min_time, repeat)
+            results[name] = {"ops_per_sec": round(ops, 1), "relative": round(relative, 6), "peak_bytes": peak}
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list:
+    """Return a description of every benchmark that regressed beyond ``threshold``."""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = current["relative"] / base["relative"] - 1
+        if change < -threshold:
+            regressions.append(f"{name}: {change:+.0%} relative ops/sec "
+                               f"({base['ops_per_sec']:.0f} -> {current['ops_per_sec']:.0f})")
+        if current["peak_bytes"] > base["peak_bytes"] * (1 + threshold) + ALLOCATION_SLACK:
+            regressions.append(f"{name}: peak allocation {base['peak_bytes']} -> {current['peak_bytes']} bytes")
+    return regressions
+
+
+def _report(results: dict, baseline: dict):
+    width = max(len(name) for name in results)
+    print(f"{'benchmark':<{width}}  {'ops/sec':>12}  {'peak KiB':>9}  {'vs baseline':>11}")
+    for name, current in results.items():
+        base = baseline.get(name)
+        delta = f"{current['relative'] / base['relative'] - 1:+.0%}" if base else "new"
+        print(f"{name:<{width}}  {current['ops_per_sec']:>12,.0f}  "
+              f"{current['peak_bytes'] / 1024:>9.1f}  {delta:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agent's non-LLM hot path")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds per measurement round")
+    parser.add_argument("--repeat", type=int, default=5, help="Measurement rounds; the best is kept")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown or allocation growth as a fraction")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--no-execution", action="store_true", help="Skip the worker execution benchmarks")
+    args = parser.parse_args()
+
+    results = run(args.filter, args.min_time, args.repeat, execution=not args.no_execution)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    _report(results, baseline)
+
+    if args.save_baseline:
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"\n💾 Baseline written to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"   {line}")
+        return 1
+    print(f"\n✅ No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
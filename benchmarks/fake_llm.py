@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an OpenAI-compatible chat completions API.
+
+Answers /v1/chat/completions (plain and streamed) with a small valid code
+snippet after a configurable latency, at a configurable token rate, failing
+a configurable fraction of requests and, like a provider's rate limit,
+answering 429 beyond a configurable number of concurrent requests. Point the
+agent at it with
+
+    OPENAI_BASE_URL=http://127.0.0.1:8800/v1 OPENAI_API_KEY=fake
+
+    python benchmarks/fake_llm.py --latency 0.8 --tokens-per-sec 60 --error-rate 0.02
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@dataclass
+class FakeLLMConfig:
+    latency: float = 0.5           # seconds before the first token
+    jitter: float = 0.0            # +/- seconds added uniformly to latency
+    tokens_per_sec: float = 0.0    # 0 sends the whole answer at once
+    error_rate: float = 0.0        # fraction of requests answered with error_status
+    error_status: int = 500
+    invalid_rate: float = 0.0      # fraction answered with code that does not compile
+    capacity: int = 0              # concurrent requests served; more get a 429 (0 = unlimited)
+    seed: int = None
+
+
+def answer_for(prompt: str, invalid: bool = False) -> str:
+    """The JSON answer the agent's prompt asks for, derived from the requirement text."""
+    match = re.search(r"does the following: (.*?)\.\s*\n", prompt, re.S)
+    requirement = (match.group(1) if match else prompt).strip().splitlines()[0][:80]
+    name = "_".join(re.findall(r"[a-z0-9]+", requirement.lower())[:4]) or "task"
+    body = "    return None" if not invalid else "    return (None"
+    code = f"def {name}():\n    \"\"\"{requirement.replace(chr(34), chr(39))}\"\"\"\n{body}\n"
+    return json.dumps({"code_snippet": code})
+
+
+def _tokens(text: str):
+    # Roughly four characters per token, like the real tokenizers.
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+
+class FakeLLM:
+    """Threaded HTTP server speaking enough of the chat completions API for agno's OpenAIChat."""
+
+    def __init__(self, config: FakeLLMConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeLLMConfig()
+        self._random = random.Random(self.config.seed)
+        self._random_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.stats = {"requests": 0, "errors": 0, "invalid": 0, "throttled": 0}
+        self._in_flight = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeLLM":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def _admit(self) -> bool:
+        """Take an in-flight slot, or count a throttled request when at capacity."""
+        with self._random_lock:
+            if self.config.capacity and self._in_flight >= self.config.capacity:
+                self.stats["requests"] += 1
+                self.stats["throttled"] += 1
+                return False
+            self._in_flight += 1
+            return True
+
+    def _release(self):
+        with self._random_lock:
+            self._in_flight -= 1
+
+    def _roll(self):
+        """Pick this request's latency and whether it errors or returns invalid code."""
+        c = self.config
+        with self._random_lock:
+            latency = max(0.0, c.latency + self._random.uniform(-c.jitter, c.jitter))
+            error = self._random.random() < c.error_rate
+            invalid = self._random.random() < c.invalid_rate
+            self.stats["requests"] += 1
+            self.stats["errors"] += error
+            self.stats["invalid"] += invalid and not error
+        return latency, error, invalid
+
+    def _handler(self):
+        llm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    return self._json(200, {"object": "list", "data": [{"id": "fake", "object": "model"}]})
+                self._json(404, {"error": {"message": "Not found"}})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    return self._json(404, {"error": {"message": "Not found"}})
+
+                if not llm._admit():
+                    return self._json(429, {
+                        "error": {"message": "Rate limit reached", "type": "rate_limit_exceeded", "code": None}
+                    })
+                try:
+                    self._complete(body)
+                finally:
+                    llm._release()
+
+            def _complete(self, body):
+                latency, error, invalid = llm._roll()
+                time.sleep(latency)
+                if error:
+                    return self._json(llm.config.error_status, {
+                        "error": {"message": "Injected failure", "type": "server_error", "code": None}
+                    })
+
+                prompt = next((m.get("content") or "" for m in reversed(body.get("messages", []))
+                               if m.get("role") == "user"), "")
+                if not isinstance(prompt, str):
+                    prompt = json.dumps(prompt)
+                content = answer_for(prompt, invalid)
+                completion_id = f"chatcmpl-fake-{next(llm._ids)}"
+                model = body.get("model", "fake")
+                if body.get("stream"):
+                    self._stream(completion_id, model, prompt, content, body)
+                else:
+                    self._pace(len(_tokens(content)))
+                    self._json(200, {
+                        "id": completion_id,
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": _usage(prompt, content),
+                    })
+
+            def _pace(self, tokens: int):
+                if llm.config.tokens_per_sec > 0:
+                    time.sleep(tokens / llm.config.tokens_per_sec)
+
+            def _stream(self, completion_id, model, prompt, content, body):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def chunk(delta, finish_reason=None, usage=None):
+                    payload = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                    }
+                    if usage is not None:
+                        payload["usage"] = usage
+                    self._chunk(f"data: {json.dumps(payload)}\n\n")
+
+                chunk({"role": "assistant", "content": ""})
+                for token in _tokens(content):
+                    self._pace(1)
+                    chunk({"content": token})
+                include_usage = (body.get("stream_options") or {}).get("include_usage")
+                chunk({}, "stop", _usage(prompt, content) if include_usage else None)
+                self._chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _chunk(self, text: str):
+                data = text.encode("utf-8")
+                self.wfile.write(f"{len(data):X}\r\n".encode("latin-1") + data + b"\r\n")
+                self.wfile.flush()
+
+            def _json(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def _usage(prompt: str, content: str) -> dict:
+    prompt_tokens, completion_tokens = len(_tokens(prompt)), len(_tokens(content))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser, prefix: str = ""):
+    """Add the FakeLLMConfig options, optionally as ``--<prefix>latency`` etc."""
+    defaults = FakeLLMConfig()
+    parser.add_argument(f"--{prefix}latency", type=float, default=defaults.latency,
+                        help="Seconds before the first token")
+    parser.add_argument(f"--{prefix}jitter", type=float, default=defaults.jitter,
+                        help="Uniform +/- seconds added to the latency")
+    parser.add_argument(f"--{prefix}tokens-per-sec", type=float, default=defaults.tokens_per_sec,
+                        help="Generation speed; 0 answers at once")
+    parser.add_argument(f"--{prefix}error-rate", type=float, default=defaults.error_rate,
+                        help="Fraction of requests that fail")
+    parser.add_argument(f"--{prefix}error-status", type=int, default=defaults.error_status,
+                        help="HTTP status of failed requests, e.g. 429 or 500")
+    parser.add_argument(f"--{prefix}invalid-rate", type=float, default=defaults.invalid_rate,
+                        help="Fraction of answers whose code does not compile")
+    parser.add_argument(f"--{prefix}capacity", type=int, default=defaults.capacity,
+                        help="Concurrent requests served before answering 429; 0 is unlimited")
+    parser.add_argument(f"--{prefix}seed", type=int, default=None, help="Random seed")
+
+
+def config_from_args(args, prefix: str = "") -> FakeLLMConfig:
+    key = prefix.replace("-", "_")
+    return FakeLLMConfig(**{
+        field: getattr(args, key + field)
+        for field in ("latency", "jitter", "tokens_per_sec", "error_rate", "error_status", "invalid_rate",
+                      "capacity", "seed")
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM for offline load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    llm = FakeLLM(config_from_args(args), args.host, args.port)
+    print(f"🤖 Fake LLM listening; use OPENAI_BASE_URL={llm.base_url} OPENAI_API_KEY=fake")
+    try:
+        llm.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
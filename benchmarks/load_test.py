@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Load generator for the agent's JSON-RPC server.
+
+Steps through growing load and reports throughput, p50/p95/p99 latency and
+an error breakdown per step. Closed-loop mode keeps N clients each sending
+its next request when the previous one answers; open-loop mode sends a fixed
+number of requests per second regardless of how fast they are answered, and
+measures latency from each request's scheduled send time.
+
+    # Self-contained: start a fake LLM and an agent server, then load them
+    python benchmarks/load_test.py --spawn --concurrency 1,4,16 --llm-latency 0.8
+    python benchmarks/load_test.py --spawn --mode open --rate 2,8,32 --llm-error-rate 0.05
+    python benchmarks/load_test.py --spawn --workers 16 --concurrency 16,64,256 --llm-latency 0.2
+
+    # Against a running server (e.g. one pointed at benchmarks/fake_llm.py)
+    python benchmarks/load_test.py --url http://localhost:4000 --concurrency 1,8,32
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+import fake_llm
+
+APP_DIR = Path(__file__).resolve().parent.parent / "src" / "aython" / "agent" / "app"
+
+
+class _Client(threading.local):
+    """One keep-alive HTTP session per thread."""
+
+    def __init__(self):
+        self.session = requests.Session()
+
+
+def _classify(response) -> str:
+    """"ok", or the kind of failure: rpc:<code>, http:<status>, timeout, connection."""
+    if response.status_code != 200:
+        return f"http:{response.status_code}"
+    try:
+        body = response.json()
+    except ValueError:
+        return "invalid-json"
+    if "error" in body:
+        return f"rpc:{body['error'].get('code')}"
+    if body.get("result", {}).get("error"):
+        return "generation"
+    return "ok"
+
+
+class LoadTest:
+    """Sends ``method`` requests with unique requirements, so the generation cache never answers."""
+
+    def __init__(self, url: str, method: str = "generate_and_run", requirements: str = "return the number {n}",
+                 params: dict = None, timeout: float = 120):
+        self.url = url
+        self.method = method
+        self.requirements = requirements
+        self.params = params or {}
+        self.timeout = timeout
+        self._client = _Client()
+        self._counter = itertools.count(1)
+
+    def call(self, method: str, params: dict, request_id: str = None):
+        headers = {"X-Request-Id": request_id} if request_id else {}
+        payload = {"jsonrpc": "2.0", "method": method, "params": params, "id": 1}
+        return self._client.session.post(self.url, json=payload, headers=headers, timeout=self.timeout)
+
+    def one(self, label: str) -> str:
+        """Send one request and return its outcome."""
+        n = next(self._counter)
+        params = dict(self.params, requirements=self.requirements.format(n=n))
+        try:
+            return _classify(self.call(self.method, params, f"load-{label}-{n}"))
+        except requests.Timeout:
+            return "timeout"
+        except requests.ConnectionError:
+            return "connection"
+
+    def closed_loop(self, clients: int, duration: float) -> list:
+        """``clients`` back-to-back callers for ``duration`` seconds; returns (latency, outcome) pairs."""
+        samples = []
+        lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def client():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                outcome = self.one(f"c{clients}")
+                with lock:
+                    samples.append((time.perf_counter() - start, outcome))
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples
+
+    def open_loop(self, rate: float, duration: float, max_inflight: int = 512) -> list:
+        """``rate`` requests per second for ``duration`` seconds; returns (latency, outcome) pairs.
+
+        Latency counts from the scheduled send time, so a backlog on our side
+        still shows up instead of silently lowering the offered load.
+        """
+        samples = []
+        lock = threading.Lock()
+
+        def send(scheduled):
+            outcome = self.one(f"r{rate:g}")
+            with lock:
+                samples.append((time.perf_counter() - scheduled, outcome))
+
+        with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+            start = time.perf_counter()
+            for i in range(max(1, int(rate * duration))):
+                scheduled = start + i / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(send, scheduled)
+        return samples
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    latencies = sorted(latency for latency, outcome in samples if outcome == "ok")
+    errors = {}
+    for _, outcome in samples:
+        if outcome != "ok":
+            errors[outcome] = errors.get(outcome, 0) + 1
+    return {
+        "requests": len(samples),
+        "ok": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "errors": dict(sorted(errors.items())),
+    }
+
+
+def run(load: LoadTest, mode: str, levels, duration: float, max_inflight: int = 512, report=None) -> list:
+    """Run one step per load level and return their summaries."""
+    results = []
+    for level in levels:
+        start = time.perf_counter()
+        if mode == "closed":
+            samples = load.closed_loop(int(level), duration)
+        else:
+            samples = load.open_loop(level, duration, max_inflight)
+        summary = dict(mode=mode, level=level, **summarize(samples, time.perf_counter() - start))
+        results.append(summary)
+        if report:
+            report(summary)
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def spawned_server(llm: fake_llm.FakeLLM, model: str, env: dict = None, startup_timeout: float = 60):
+    """Run the agent server against ``llm`` in a subprocess with throwaway state; yields its URL once ready."""
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        server_env = dict(
+            os.environ,
+            AGENT_PORT=str(port),
+            MODEL=model,
+            OPENAI_BASE_URL=llm.base_url,
+            OPENAI_API_KEY="fake",
+            GENERATION_CACHE_PATH=os.path.join(tmp, "cache.db"),
+            JOB_STORE_PATH=os.path.join(tmp, "jobs.db"),
+            **(env or {}),
+        )
+        process = subprocess.Popen([sys.executable, "main.py"], cwd=APP_DIR, env=server_env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = f"http://127.0.0.1:{port}"
+        try:
+            deadline = time.monotonic() + startup_timeout
+            while True:
+                try:
+                    readiness = requests.get(f"{url}/ready", timeout=1)
+                    if readiness.ok:
+                        break
+                    if readiness.json().get("status") == "failed":
+                        raise RuntimeError(f"agent server warm-up failed: {readiness.text}")
+                except requests.ConnectionError:
+                    pass
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("agent server did not become ready")
+                time.sleep(0.1)
+            yield url
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def _levels(text: str):
+    return [float(value) for value in text.split(",") if value.strip()]
+
+
+def _print_header():
+    print(f"{'load':<12}  {'requests':>8}  {'ok':>6}  {'ok/s':>8}  "
+          f"{'p50 ms':>9}  {'p95 ms':>9}  {'p99 ms':>9}  errors")
+
+
+def _print_step(summary: dict):
+    unit = "clients" if summary["mode"] == "closed" else "req/s"
+    errors = ", ".join(f"{kind}={count}" for kind, count in summary["errors"].items()) or "-"
+    print(f"{summary['level']:>4g} {unit:<7}  {summary['requests']:>8}  {summary['ok']:>6}  "
+          f"{summary['throughput']:>8.2f}  {summary['p50_ms']:>9.1f}  {summary['p95_ms']:>9.1f}  "
+          f"{summary['p99_ms']:>9.1f}  {errors}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the agent's JSON-RPC server")
+    parser.add_argument("--url", default="http://localhost:4000", help="Agent server URL (ignored with --spawn)")
+    parser.add_argument("--spawn", action="store_true",
+                        help="Start a fake LLM and an agent server using it, and load those")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="Closed-loop client counts, comma separated")
+    parser.add_argument("--rate", default="1,2,4,8", help="Open-loop requests per second, comma separated")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per load step")
+    parser.add_argument("--max-inflight", type=int, default=512, help="Open-loop cap on outstanding requests")
+    parser.add_argument("--workers", type=int, default=1, help="AGENT_WORKERS of the spawned server")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--method", default="generate_and_run")
+    parser.add_argument("--execution", default=None, help="Execution mode passed with each request")
+    parser.add_argument("--requirements", default="return the number {n}",
+                        help="Requirement template; {n} makes each one unique")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--json", type=Path, help="Also write the step summaries to this file")
+    fake_llm.add_arguments(parser, prefix="llm-")
+    args = parser.parse_args()
+
+    levels = _levels(args.concurrency if args.mode == "closed" else args.rate)
+    params = {"model": args.model}
+    if args.execution:
+        params["execution"] = args.execution
+
+    with contextlib.ExitStack() as stack:
+        url = args.url
+        if args.spawn:
+            llm = fake_llm.FakeLLM(fake_llm.config_from_args(args, prefix="llm-")).start()
+            stack.callback(llm.stop)
+            url = stack.enter_context(spawned_server(llm, args.model, env={"AGENT_WORKERS": str(args.workers)}))
+            print(f"🤖 Fake LLM at {llm.base_url}, agent server at {url}")
+
+        load = LoadTest(url, args.method, args.requirements, params, args.timeout)
+        init = load.call("init_agent", {"model": args.model})
+        if _classify(init) != "ok":
+            print(f"❌ init_agent failed: {init.text}")
+            return 1
+
+        print(f"🚀 {args.mode}-loop, {args.duration:g}s per step against {url}\n")
+        _print_header()
+        results = run(load, args.mode, levels, args.duration, args.max_inflight, report=_print_step)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"\n💾 Results written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -31,7 +31,7 @@ def main():
     parser = argparse.ArgumentParser(description="Run Aython tests")
     parser.add_argument(
         "--type",
-        choices=["unit", "integration", "e2e", "all", "quick"],
+        choices=["unit", "integration", "e2e", "all", "quick", "bench", "load"],
         default="quick",
         help="Type of tests to run"
     )
@@ -99,6 +99,14 @@ def main():
     elif args.type == "quick":
         cmd = base_cmd + ["tests/test_aython.py", "-m", "not (docker or e2e or integration or slow)"]
         description = "Quick Tests"
+
+    elif args.type == "bench":
+        cmd = ["python", "benchmarks/bench_agent.py"]
+        description = "Agent Microbenchmarks"
+
+    elif args.type == "load":
+        cmd = ["python", "benchmarks/load_test.py", "--spawn", "--duration", "10"]
+        description = "Load Test Against a Fake LLM"
     
     # Note: timeout would require pytest-timeout plugin
     # cmd.extend(["--timeout=300"])
@@ -0,0 +1,99 @@
+# agent/app/agent_pool.py
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+AGENT_POOL_SIZE = int(os.environ.get("AGENT_POOL_SIZE", "8"))
+
+
+class AgentPool:
+    """Bounded pool of agents for one model with checkout/return semantics.
+
+    Agents are built lazily by ``factory`` up to ``size``; once all are checked
+    out, callers wait for one to be returned. Each checkout gets an agent that
+    no other request is using, so agno run state is never shared.
+    """
+
+    def __init__(self, factory, size: int = AGENT_POOL_SIZE):
+        self.factory = factory
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._waiters = 0
+        self._lock = threading.Lock()
+        self._stats = {"checkouts": 0, "waits": 0, "wait_seconds": 0.0, "max_waiters": 0}
+
+    def prime(self):
+        """Build one agent up front so configuration errors surface immediately."""
+        with self._lock:
+            if self._created:
+                return
+            self._created += 1
+        try:
+            self._idle.put(self.factory())
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @contextmanager
+    def checkout(self, timeout: float = None):
+        """Borrow an agent for the duration of the ``with`` block."""
+        agent = self._acquire(timeout)
+        try:
+            yield agent
+        finally:
+            self._idle.put(agent)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "idle": self._idle.qsize(),
+                "in_use": self._created - self._idle.qsize(),
+                "waiters": self._waiters,
+                **self._stats,
+            }
+
+    def _acquire(self, timeout):
+        try:
+            agent = self._idle.get_nowait()
+        except queue.Empty:
+            agent = None
+
+        if agent is None:
+            with self._lock:
+                build = self._created < self.size
+                if build:
+                    self._created += 1
+            if build:
+                try:
+                    agent = self.factory()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                agent = self._wait(timeout)
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+        return agent
+
+    def _wait(self, timeout):
+        with self._lock:
+            self._waiters += 1
+            self._stats["waits"] += 1
+            self._stats["max_waiters"] = max(self._stats["max_waiters"], self._waiters)
+        start = time.monotonic()
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Timed out waiting for an idle agent")
+        finally:
+            with self._lock:
+                self._waiters -= 1
+                self._stats["wait_seconds"] += time.monotonic() - start
@@ -1,202 +1,682 @@
 # agent/app/aython_agent.py
+import importlib
 import json
-import re
+import logging
 import os
-import tempfile
-import subprocess
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from textwrap import dedent
-from pydantic import BaseModel
-from agno.agent import Agent
-from agno.models.openai import OpenAIChat
-from agno.models.google import Gemini
-from agno.tools.reasoning import ReasoningTools
+from typing import TYPE_CHECKING, Optional
+from pydantic import BaseModel, Field
+from code_extractor import CodeExtractor
+from generation_cache import GenerationCache
+from metrics import CACHE_LOOKUPS, GENERATION_ATTEMPTS, GENERATION_SUCCESSES, LLM_TOKENS, RETRIES, phase
+from rate_limiter import EXPECTED_OUTPUT_TOKENS, RateLimiter, estimate_tokens, get_limiter, is_throttle
+import tracing
+from worker_pool import WorkerPool, get_default_pool
 
+if TYPE_CHECKING:
+    from agno.agent import Agent
 
-def _strip_fences(text: str) -> str:
-    """Remove markdown fences like ```python ... ``` from text."""
-    if not text:
-        return ""
-    # remove opening fence with optional language
-    text = re.sub(r"\s*```[a-zA-Z]*\n?", "", text)
-    # remove closing or stray ```
-    text = re.sub(r"\s*```", "", text)
-    return text.strip()
+logger = logging.getLogger(__name__)
 
+SPECULATION = int(os.environ.get("AGENT_SPECULATION", "1"))
+MAX_GENERATIONS = int(os.environ.get("AGENT_MAX_GENERATIONS", "0"))
+REPAIR = os.environ.get("AGENT_REPAIR", "1") == "1"
+REPAIR_EXECUTION = os.environ.get("AGENT_REPAIR_EXECUTION", "0") == "1"
+# Calls the provider throttled are retried, after the rate limiter's backoff,
+# this many times before they count as a failed attempt.
+THROTTLE_RETRIES = int(os.environ.get("AGENT_THROTTLE_RETRIES", "4"))
+# Per-call token budgets; 0 turns either off. A prompt over budget loses the
+# end of its session context first, then of the repair feedback.
+MAX_PROMPT_TOKENS = int(os.environ.get("AGENT_MAX_PROMPT_TOKENS", "4000"))
+MAX_OUTPUT_TOKENS = int(os.environ.get("AGENT_MAX_OUTPUT_TOKENS", "2048"))
 
-def check_code(code_snippet: str) -> bool:
-    """Check if a code snippet is valid Python."""
-    cleaned = _strip_fences(code_snippet)
+# agno and the provider SDKs take seconds to import, so each provider's model
+# class is imported only when an agent first uses it.
+PROVIDERS = {
+    "gemini": ("agno.models.google", "Gemini"),
+    "gpt": ("agno.models.openai", "OpenAIChat"),
+}
+# Each model class's name for the output token cap.
+OUTPUT_LIMIT_PARAMS = {"gemini": "max_output_tokens", "gpt": "max_completion_tokens"}
+
+PROMPT = (
+    "Create a Python function that does the following: {requirements}.\n"
+    "{session}{repair}"
+    'Return ONLY valid JSON in this format, without any other text: {{"code_snippet": "<python code>"}}'
+)
+SESSION_PROMPT = (
+    "The user's session already defines the following; use these names and do not redefine them:\n"
+    "{context}\n"
+)
+REPAIR_PROMPT = "Your previous answer was:\n{failed_code}\nIt failed with:\n{error}\nFix exactly this problem.\n"
+
+
+# What the in-process provider stub answers during warm_up.
+WARM_UP_ANSWER = json.dumps({"code_snippet": "print('warm')"})
+
+_http_client = None
+_http_client_lock = threading.Lock()
+_usage_lock = threading.Lock()
+
+
+def _model_class(provider: str):
+    module, name = PROVIDERS[provider]
+    return getattr(importlib.import_module(module), name)
+
+
+def _shared_http_client():
+    """The keep-alive httpx client shared by every OpenAI model.
+
+    agno creates a new OpenAI client on every call; without a shared HTTP client
+    each of them would open fresh connections and redo the TLS handshake.
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            import httpx
+
+            _http_client = httpx.Client(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+        return _http_client
+
+
+def _model_params(provider: str, transport=None) -> dict:
+    """Provider model arguments; with ``transport``, ones that route every request to it."""
+    if provider == "gpt":
+        if transport is None:
+            # No SDK retries: the rate limiter has to see each 429 to adapt to it.
+            return {"http_client": _shared_http_client(), "max_retries": 0}
+        import httpx
+
+        return {"api_key": "warm-up", "http_client": httpx.Client(transport=transport)}
+    if transport is None:
+        return {}
+    return {"api_key": "warm-up", "client_params": {"http_options": {"client_args": {"transport": transport}}}}
+
+
+def _stub_transport():
+    """An httpx transport answering OpenAI and Gemini generation calls with WARM_UP_ANSWER."""
+    import httpx
+
+    def handle(request):
+        if request.url.path.endswith("/chat/completions"):
+            return httpx.Response(200, json={
+                "id": "warm-up",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "warm-up",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": WARM_UP_ANSWER},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            })
+        return httpx.Response(200, json={
+            "candidates": [{
+                "index": 0,
+                "content": {"role": "model", "parts": [{"text": WARM_UP_ANSWER}]},
+                "finishReason": "STOP",
+            }],
+            "usageMetadata": {"promptTokenCount": 1, "candidatesTokenCount": 1, "totalTokenCount": 2},
+        })
+
+    return httpx.MockTransport(handle)
+
+
+def compile_error(code_snippet: str) -> str:
+    """Return a description of the SyntaxError in a snippet, or "" if it compiles."""
     try:
-        compile(cleaned, "<string>", "exec")
+        compile(code_snippet, "<string>", "exec")
     except SyntaxError as e:
-        print("❌ SyntaxError in generated code:", e)
-        print("Code was:\n", cleaned)
+        line = (e.text or "").strip()
+        return f"SyntaxError: {e.msg} (line {e.lineno}): {line}" if line else f"SyntaxError: {e}"
+    return ""
+
+
+def check_code(code_snippet: str) -> bool:
+    """Check if a code snippet is valid Python."""
+    error = compile_error(code_snippet)
+    if error:
+        print("❌", error)
+        print("Code was:\n", code_snippet)
         return False
     return True
 
 
+def _content_delta(event) -> str:
+    """Return the text carried by a streamed content event, if any."""
+    from agno.run.response import RunEvent
+
+    if getattr(event, "event", None) != RunEvent.run_response_content.value:
+        return ""
+    content = getattr(event, "content", None)
+    return content if isinstance(content, str) else ""
+
+
+def _truncate(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """Cut ``text`` to about ``max_tokens``, marking the cut; ``keep_end`` keeps its end instead."""
+    limit = max(0, max_tokens) * 4
+    if len(text) <= limit:
+        return text
+    if not limit:
+        return ""
+    if keep_end:
+        return "..." + text[len(text) - limit:]
+    return text[:limit] + "..."
+
+
 def clean_model_output(raw: str) -> str:
     """Remove markdown fences and extract JSON or code snippet."""
     if not raw:
         return ""
+    extractor = CodeExtractor()
+    extractor.feed(raw)
+    return extractor.close()
 
-    text = raw.strip()
-    text = _strip_fences(text)
 
-    # try to parse JSON first
-    try:
-        parsed = json.loads(text)
-        if isinstance(parsed, dict) and "code_snippet" in parsed:
-            return _strip_fences(parsed["code_snippet"])
-    except Exception:
-        pass
+class ExecutionResult(BaseModel):
+    """A model to hold execution results."""
+    exit_code: int
+    stdout: str
+    stderr: str
+
 
-    return text
+class TokenUsage(BaseModel):
+    """Tokens one request spent over all of its model calls."""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    calls: int = 0
+    # True when a call's counts were estimated because the provider reported none.
+    estimated: bool = False
+
+    def add(self, prompt_tokens: int, completion_tokens: int, estimated: bool = False):
+        with _usage_lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.calls += 1
+            self.estimated = self.estimated or estimated
 
 
 class CodeResult(BaseModel):
     """A model to hold the generated code snippet."""
     code_snippet: str
     debug_log: str = ""
-
-
-class ExecutionResult(BaseModel):
-    """A model to hold execution results."""
-    exit_code: int
-    stdout: str
-    stderr: str
+    cache_hit: bool = False
+    # Set when the snippet was already run while checking it (repair_execution).
+    execution: Optional[ExecutionResult] = None
+    usage: TokenUsage = Field(default_factory=TokenUsage)
 
 
 class AythonAgent:
-    def __init__(self, model_str: str, debug: bool = False):
+    def __init__(self, model_str: str, debug: bool = False, cache: GenerationCache = None,
+                 worker_pool: WorkerPool = None, speculation: int = SPECULATION,
+                 max_generations: int = MAX_GENERATIONS, repair: bool = REPAIR,
+                 repair_execution: bool = REPAIR_EXECUTION, limiter: RateLimiter = None,
+                 max_prompt_tokens: int = MAX_PROMPT_TOKENS, max_output_tokens: int = MAX_OUTPUT_TOKENS):
         if "gemini" in model_str.lower():
             if not model_str.startswith("models/"):
                 model_str = f"models/{model_str}"
-            model = Gemini(id=model_str)
+            self.provider = "gemini"
         elif "gpt" in model_str.lower():
-            model = OpenAIChat(id=model_str)
+            self.provider = "gpt"
         else:
             raise ValueError(
                 f"Unsupported model name '{model_str}'. Use Gemini or GPT."
             )
+        self._model_cls = _model_class(self.provider)
 
+        self.model_id = model_str
         self.debug = debug
-        self.agent = Agent(
+        self.cache = cache
+        self.worker_pool = worker_pool or get_default_pool()
+        # Shared by every agent of this model in the process.
+        self.limiter = limiter or get_limiter(self.provider, self.model_id)
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_output_tokens = max_output_tokens
+        self.agent = self._build_agent()
+        self.retries = 3
+        # Speculative mode: run this many candidate generations at once, capped
+        # at max_generations LLM calls per request (0 means retries * speculation).
+        self.speculation = max(1, speculation)
+        self.max_generations = max_generations or self.retries * self.speculation
+        # Repair mode: feed the compile error (and, with repair_execution, the failed
+        # run's exit code and stderr) back into the next attempt.
+        self.repair = repair
+        self.repair_execution = repair_execution
+        self.throttle_retries = THROTTLE_RETRIES
+        self._spare_agents = queue.SimpleQueue()
+        self.stats = {
+            "attempts": 0, "successes": 0,
+            "speculative_runs": 0, "candidates": 0, "cancelled": 0, "round_trips_saved": 0,
+        }
+
+    @property
+    def attempts_per_success(self) -> float:
+        """This agent's ratio; see ``model_attempts_per_success`` for the whole model's."""
+        return self.stats["attempts"] / self.stats["successes"] if self.stats["successes"] else 0.0
+
+    @property
+    def model_attempts_per_success(self) -> float:
+        """Attempts per success over every agent of this model in the process."""
+        successes = GENERATION_SUCCESSES.value(model=self.model_id)
+        return GENERATION_ATTEMPTS.value(model=self.model_id) / successes if successes else 0.0
+
+    def _build_agent(self, transport=None) -> "Agent":
+        from agno.agent import Agent
+        from agno.tools.reasoning import ReasoningTools
+
+        params = _model_params(self.provider, transport)
+        if self.max_output_tokens:
+            params[OUTPUT_LIMIT_PARAMS[self.provider]] = self.max_output_tokens
+        return Agent(
             name="MCP GitHub Agent",
             instructions=dedent("""
                 You are a Python coding agent. You know how to write Python code.
             """),
-            model=model,
+            model=self._model_cls(id=self.model_id, **params),
             tools=[ReasoningTools()],
         )
-        self.retries = 3
+
+    def warm_up(self) -> float:
+        """Run one generation against an in-process stub of the provider, then execute it.
+
+        Loads the provider SDK and agno's run path and starts an execution worker,
+        so the first real request pays for none of them. Returns the seconds taken.
+        """
+        start = time.perf_counter()
+        response = self._build_agent(_stub_transport()).run("Reply with a code_snippet.", stream=False)
+        code = clean_model_output(response.content)
+        if not code or compile_error(code):
+            raise RuntimeError(f"Warm-up got an unusable response: {response.content!r}")
+        exit_code, _, stderr = self.worker_pool.run(code, timeout=10)
+        if exit_code:
+            raise RuntimeError(f"Warm-up execution failed: {stderr}")
+        return time.perf_counter() - start
 
     def code(self, user_requirements: str, current_context: str = "") -> CodeResult:
         """Generate Python code based on user requirements."""
-        logs = []
+        if self.speculation > 1:
+            return self._code_speculative(user_requirements, current_context)
+        for event, value in self._generate(user_requirements, current_context, stream=False):
+            if event == "result":
+                return value
+
+    def code_stream(self, user_requirements: str, current_context: str = ""):
+        """Generate code while streaming model output.
+
+        Yields ``("attempt", n)`` when an attempt starts, ``("token", text)`` for each
+        content delta, ``("code", text)`` as the code inside the deltas is extracted,
+        and finally ``("result", CodeResult)`` once check_code passed or the retries
+        ran out.
+        """
+        yield from self._generate(user_requirements, current_context, stream=True)
 
+    def _instructions(self, user_requirements: str, current_context: str = "",
+                      failed_code: str = "", error: str = "") -> str:
+        if not (self.repair and error):
+            failed_code, error = "", ""
+        if self.max_prompt_tokens:
+            spare = self.max_prompt_tokens - estimate_tokens(
+                PROMPT.format(requirements=user_requirements, session="", repair=""), SESSION_PROMPT, REPAIR_PROMPT
+            )
+            if estimate_tokens(failed_code, error) > spare:
+                failed_code = _truncate(failed_code, spare // 2)
+                # The end of an error, with the exception itself, says the most.
+                error = _truncate(error, spare - estimate_tokens(failed_code), keep_end=True)
+            current_context = _truncate(current_context, spare - estimate_tokens(failed_code, error))
+        session = SESSION_PROMPT.format(context=current_context) if current_context else ""
+        repair = REPAIR_PROMPT.format(failed_code=failed_code, error=error) if error else ""
+        return PROMPT.format(requirements=user_requirements, session=session, repair=repair)
+
+    def _cached(self, user_requirements: str, current_context: str):
+        if self.cache is None:
+            return None
+        # The cache only saves model calls: if it fails, generate as on a miss.
         try:
-            for attempt in range(1, self.retries + 1):
-                instructions = f"""
-                Create a Python function that does the following: {user_requirements}.
-                Return ONLY valid JSON in this format without any extra text, comments, or explanation:
-                {{
-                  "code_snippet": "<your python code here>"
-                }}
-                """
+            cached = self.cache.get(self.model_id, user_requirements, current_context)
+        except Exception as e:
+            logger.warning("generation cache lookup failed: %s", e)
+            CACHE_LOOKUPS.inc(model=self.model_id, result="error")
+            return None
+        CACHE_LOOKUPS.inc(model=self.model_id, result="miss" if cached is None else "hit")
+        if cached is None:
+            return None
+        return CodeResult(code_snippet=cached, debug_log="[Cache] hit", cache_hit=True)
+
+    def _accept(self, user_requirements: str, current_context: str, code_snippet: str, logs,
+                usage: TokenUsage, execution: ExecutionResult = None) -> CodeResult:
+        self.stats["successes"] += 1
+        GENERATION_SUCCESSES.inc(model=self.model_id)
+        logs.append(f"[Stats] {self.model_attempts_per_success:.2f} attempts per success for {self.model_id}")
+        if self.cache is not None:
+            try:
+                self.cache.put(self.model_id, user_requirements, current_context, code_snippet)
+            except Exception as e:
+                logger.warning("generation cache store failed: %s", e)
+                logs.append(f"[Cache] store failed: {e}")
+        return CodeResult(code_snippet=code_snippet, debug_log="\n".join(logs), execution=execution, usage=usage)
 
-                logs.append(f"[Attempt {attempt}] Instructions:\n{instructions}")
+    @contextmanager
+    def _llm_call(self, instructions: str, **attrs):
+        """Wait for the rate limiter, then time the model call as the llm phase."""
+        expected_output = min(EXPECTED_OUTPUT_TOKENS, self.max_output_tokens or EXPECTED_OUTPUT_TOKENS)
+        with self.limiter.slot(estimate_tokens(instructions) + expected_output) as permit:
+            with phase("llm", self.model_id, **attrs):
+                yield permit
 
-                try:
-                    response = self.agent.run(
+    def _count_tokens(self, usage: TokenUsage, instructions: str, content, metrics) -> int:
+        """Add one call's tokens to ``usage``, estimating them if the provider reported none; returns their sum."""
+        metrics = metrics if isinstance(metrics, dict) else {}
+        prompt_tokens = sum(metrics.get("input_tokens") or [])
+        completion_tokens = sum(metrics.get("output_tokens") or [])
+        estimated = not (prompt_tokens or completion_tokens)
+        if estimated:
+            prompt_tokens = estimate_tokens(instructions)
+            completion_tokens = estimate_tokens(str(content or ""))
+        LLM_TOKENS.inc(prompt_tokens, model=self.model_id, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, model=self.model_id, kind="completion")
+        if usage is not None:
+            usage.add(prompt_tokens, completion_tokens, estimated)
+        return prompt_tokens + completion_tokens
+
+    def _run_model(self, agent: "Agent", instructions: str, usage: TokenUsage = None, **attrs):
+        for retry in range(self.throttle_retries + 1):
+            try:
+                with self._llm_call(instructions, **attrs) as permit:
+                    response = agent.run(
                         instructions,
                         stream=False,
                         show_full_reasoning=True,
                         stream_intermediate_steps=True,
                     )
-                    logs.append(f"[Attempt {attempt}] Raw response: {repr(response.content)}")
+                    permit.tokens = self._count_tokens(usage, instructions, response.content, response.metrics)
+                return response.content
+            except Exception as e:
+                if not is_throttle(e) or retry == self.throttle_retries:
+                    raise
+
+    def _stream_model(self, instructions: str, extractor: CodeExtractor, usage: TokenUsage = None, **attrs):
+        """Stream one model call as ``token`` and ``code`` events; returns the whole response."""
+        for retry in range(self.throttle_retries + 1):
+            chunks = []
+            try:
+                with self._llm_call(instructions, **attrs) as permit:
+                    for event in self.agent.run(
+                        instructions,
+                        stream=True,
+                        show_full_reasoning=True,
+                        stream_intermediate_steps=True,
+                    ):
+                        text = _content_delta(event)
+                        if text:
+                            chunks.append(text)
+                            yield "token", text
+                            code = extractor.feed(text)
+                            if code:
+                                yield "code", code
+                    content = "".join(chunks)
+                    run_response = getattr(self.agent, "run_response", None)
+                    permit.tokens = self._count_tokens(
+                        usage, instructions, content, getattr(run_response, "metrics", None)
+                    )
+                return content
+            except Exception as e:
+                # Output already streamed cannot be taken back, so only unanswered calls are retried.
+                if chunks or not is_throttle(e) or retry == self.throttle_retries:
+                    raise
+
+    def _check_candidate(self, label: str, content, logs, extractor: CodeExtractor = None):
+        """Clean one model response and compile it.
+
+        ``extractor`` is one the streamed response was already fed to, which only
+        has the end of the response left to read. Returns ``(code, error)``;
+        ``error`` is "" when the code is usable.
+        """
+        # Try extracting code
+        raw_output = getattr(content, "code_snippet", None)
+        if not raw_output:
+            raw_output = str(content) if content else ""
+        with phase("clean", self.model_id) as clean:
+            cleaned = extractor.close() if extractor else clean_model_output(raw_output)
+            if not cleaned:
+                clean.outcome = "empty"
+
+        logs.append(f"{label} Cleaned code:\n{cleaned}")
+
+        if not cleaned:
+            logs.append(f"{label} check_code failed: no code in response")
+            return "", "The response did not contain a code_snippet."
+        with phase("check", self.model_id) as check:
+            error = compile_error(cleaned)
+            if error:
+                check.outcome = "error"
+        if error:
+            logs.append(f"{label} check_code failed: {error}")
+            return cleaned, error
+        logs.append(f"{label} check_code passed")
+        return cleaned, ""
+
+    def _execution_error(self, label: str, code_snippet: str, logs):
+        """Run a compiled snippet for repair_execution; return (result, error)."""
+        execution = self.execute_code(code_snippet)
+        if execution.exit_code == 0:
+            return execution, ""
+        logs.append(f"{label} execution failed with exit code {execution.exit_code}")
+        stderr = execution.stderr[-2000:]
+        return execution, f"Running it exited with code {execution.exit_code}:\n{stderr}"
+
+    def _generate(self, user_requirements: str, current_context: str, stream: bool):
+        logs = []
+        usage = TokenUsage()
+
+        cached = self._cached(user_requirements, current_context)
+        if cached is not None:
+            yield "result", cached
+            return
+
+        failed_code, error = "", ""
+        try:
+            for attempt in range(1, self.retries + 1):
+                label = f"[Attempt {attempt}]"
+                instructions = self._instructions(user_requirements, current_context, failed_code, error)
+                self.stats["attempts"] += 1
+                GENERATION_ATTEMPTS.inc(model=self.model_id)
+
+                logs.append(f"{label} Instructions:\n{instructions}")
+                if attempt > 1:
+                    RETRIES.inc(model=self.model_id)
+                yield "attempt", attempt
+
+                extractor = None
+                try:
+                    if stream:
+                        extractor = CodeExtractor()
+                        content = yield from self._stream_model(instructions, extractor, usage, attempt=attempt)
+                    else:
+                        content = self._run_model(self.agent, instructions, usage, attempt=attempt)
+                    logs.append(f"{label} Raw response: {repr(content)}")
                 except Exception as e:
-                    logs.append(f"[Attempt {attempt}] Agent.run() raised: {e}")
+                    logs.append(f"{label} Agent.run() raised: {e}")
+                    continue
+
+                code_snippet, error = self._check_candidate(label, content, logs, extractor)
+                if error:
+                    failed_code = code_snippet
                     continue
 
-                # Try extracting code
-                raw_output = getattr(response.content, "code_snippet", None)
-                if not raw_output:
-                    raw_output = str(response.content) if response.content else ""
-                cleaned = clean_model_output(raw_output)
+                execution = None
+                if self.repair_execution:
+                    execution, error = self._execution_error(label, code_snippet, logs)
+                    if error and attempt < self.retries:
+                        failed_code = code_snippet
+                        continue
+                yield "result", self._accept(user_requirements, current_context, code_snippet, logs, usage, execution)
+                return
+
+            logs.append("All retries exhausted → returning empty code snippet.")
+            yield "result", CodeResult(code_snippet="", debug_log="\n".join(logs), usage=usage)
+
+        except Exception as e:
+            logs.append(f"Unexpected error during code generation: {e}")
+            yield "result", CodeResult(code_snippet="", debug_log="\n".join(logs), usage=usage)
+
+    def _code_speculative(self, user_requirements: str, current_context: str) -> CodeResult:
+        """Race ``speculation`` candidates per round and keep the first that compiles.
+
+        Candidates still pending when a winner arrives are cancelled; ones already
+        talking to the provider finish in the background and are discarded.
+        """
+        logs = []
+        usage = TokenUsage()
+
+        cached = self._cached(user_requirements, current_context)
+        if cached is not None:
+            return cached
 
-                logs.append(f"[Attempt {attempt}] Cleaned code:\n{cleaned}")
+        self.stats["speculative_runs"] += 1
+        instructions = self._instructions(user_requirements, current_context)
+        budget = self.max_generations
+        executor = ThreadPoolExecutor(max_workers=self.speculation)
+        try:
+            for round_no in range(1, self.retries + 1):
+                k = min(self.speculation, budget)
+                if k <= 0:
+                    logs.append("Generation budget exhausted.")
+                    break
+                budget -= k
+                if round_no > 1:
+                    RETRIES.inc(k, model=self.model_id)
+                self.stats["candidates"] += k
+                self.stats["attempts"] += k
+                GENERATION_ATTEMPTS.inc(k, model=self.model_id)
+                logs.append(f"[Round {round_no}] Starting {k} candidates. Instructions:\n{instructions}")
 
-                if cleaned and check_code(cleaned):
-                    logs.append(f"[Attempt {attempt}] check_code passed")
-                    return CodeResult(code_snippet=_strip_fences(cleaned), debug_log="\n".join(logs))
-                else:
-                    logs.append(f"[Attempt {attempt}] check_code failed")
+                futures = [
+                    executor.submit(
+                        tracing.bind(self._run_candidate), f"[Round {round_no}.{i}]", instructions, logs, usage
+                    )
+                    for i in range(1, k + 1)
+                ]
+                failed = 0
+                for future in as_completed(futures):
+                    outcome = future.result()
+                    if outcome is None or outcome[1]:
+                        failed += 1
+                        if outcome is not None:
+                            # The next round repairs the most recent failure.
+                            instructions = self._instructions(user_requirements, current_context, *outcome)
+                        continue
+                    code_snippet = outcome[0]
+                    self.stats["cancelled"] += sum(f.cancel() for f in futures)
+                    if failed:
+                        self.stats["round_trips_saved"] += 1
+                        logs.append(
+                            f"[Speculation] Won after {failed} failed candidate(s), saving a round trip "
+                            f"({self.stats['round_trips_saved']}/{self.stats['speculative_runs']} requests so far)"
+                        )
+                    return self._accept(user_requirements, current_context, code_snippet, logs, usage)
 
             logs.append("All retries exhausted → returning empty code snippet.")
-            return CodeResult(code_snippet="", debug_log="\n".join(logs))
+            return CodeResult(code_snippet="", debug_log="\n".join(logs), usage=usage)
 
         except Exception as e:
             logs.append(f"Unexpected error during code generation: {e}")
-            return CodeResult(code_snippet="", debug_log="\n".join(logs))
+            return CodeResult(code_snippet="", debug_log="\n".join(logs), usage=usage)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
-    def execute_code(self, code: str, timeout: int = 10) -> ExecutionResult:
-        """Execute Python code and return the results."""
-        # Save code to temp file
-        with tempfile.NamedTemporaryFile("w", delete=False, suffix=".py") as f:
-            f.write(code)
-            tmp_path = f.name
+    def _run_candidate(self, label: str, instructions: str, logs, usage: TokenUsage = None):
+        # Each candidate runs on its own agno Agent; agents are reused once their run ends.
+        try:
+            agent = self._spare_agents.get_nowait()
+        except queue.Empty:
+            agent = self._build_agent()
+        try:
+            content = self._run_model(agent, instructions, usage, candidate=label)
+            logs.append(f"{label} Raw response: {repr(content)}")
+        except Exception as e:
+            logs.append(f"{label} Agent.run() raised: {e}")
+            return None
+        finally:
+            self._spare_agents.put(agent)
+        return self._check_candidate(label, content, logs)
 
+    def execute_code(self, code: str, timeout: int = 10) -> ExecutionResult:
+        """Execute Python code on a warm worker and return the results."""
         try:
-            # Run python with a timeout and capture output
-            proc = subprocess.run(
-                ["python", tmp_path],
-                capture_output=True,
-                text=True,
-                timeout=timeout
-            )
-            return ExecutionResult(
-                exit_code=proc.returncode,
-                stdout=proc.stdout,
-                stderr=proc.stderr
-            )
-        except subprocess.TimeoutExpired:
-            return ExecutionResult(
-                exit_code=-1,
-                stdout="",
-                stderr="Execution timed out"
-            )
+            with phase("execute", self.model_id) as execute:
+                exit_code, stdout, stderr = self.worker_pool.run(code, timeout=timeout)
+                if exit_code:
+                    execute.outcome = "timeout" if stderr == "Execution timed out" else "error"
+            return ExecutionResult(exit_code=exit_code, stdout=stdout, stderr=stderr)
         except Exception as e:
             return ExecutionResult(
                 exit_code=-1,
                 stdout="",
                 stderr=f"Execution failed: {e}"
             )
-        finally:
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
 
-    def generate_and_execute(self, user_requirements: str, current_context: str = "") -> dict:
-        """Generate Python code and execute it, returning both code and execution results."""
-        # Generate code
+    def generate_and_execute(self, user_requirements: str, current_context: str = "",
+                             execute: bool = True) -> dict:
+        """Generate Python code and execute it, returning both code and execution results.
+
+        With ``execute=False`` the agent-side run is skipped and ``execution_result`` is None.
+        """
+        start = time.perf_counter()
         code_result = self.code(user_requirements, current_context)
-        
+        return self.execute_generated(code_result, execute, time.perf_counter() - start)
+
+    def generate_and_execute_stream(self, user_requirements: str, current_context: str = "",
+                                    execute: bool = True):
+        """Streaming variant of ``generate_and_execute``.
+
+        Yields the ``code_stream`` progress events, then ``("result", dict)`` with the
+        same shape ``generate_and_execute`` returns.
+        """
+        start = time.perf_counter()
+        code_result = None
+        for event, value in self.code_stream(user_requirements, current_context):
+            if event == "result":
+                code_result = value
+            else:
+                yield event, value
+        yield "result", self.execute_generated(code_result, execute, time.perf_counter() - start)
+
+    def execute_generated(self, code_result: CodeResult, execute: bool, generate_seconds: float) -> dict:
+        """Run generated code, unless ``execute`` is False, and build the ``generate_and_execute`` result.
+
+        Only the worker pool is used, so this is safe on an agent another request has checked out.
+        """
+        timings = {"generate_ms": round(generate_seconds * 1000, 1), "execute_ms": None}
         if not code_result.code_snippet.strip():
             return {
                 "code_snippet": "",
                 "execution_result": None,
                 "debug_log": code_result.debug_log,
+                "cache_hit": False,
+                "timings": timings,
+                "usage": code_result.usage.model_dump(),
                 "error": "No code generated"
             }
-        
-        # Execute the code
-        execution_result = self.execute_code(code_result.code_snippet)
-        
+
+        # Execute the code, unless repair_execution already ran it
+        execution_result = code_result.execution
+        if execute and execution_result is None:
+            start = time.perf_counter()
+            execution_result = self.execute_code(code_result.code_snippet)
+            timings["execute_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
         return {
             "code_snippet": code_result.code_snippet,
-            "execution_result": execution_result,
+            "execution_result": execution_result if execute else None,
             "debug_log": code_result.debug_log,
+            "cache_hit": code_result.cache_hit,
+            "timings": timings,
+            "usage": code_result.usage.model_dump(),
             "error": None
         }
@@ -0,0 +1,275 @@
+# agent/app/code_extractor.py
+import json
+import re
+
+# An opening fence line: up to three spaces of indentation, three or more
+# backticks and an optional info string (the language). A one-line fence,
+# ```python x = 1```, has its body after the language and closes on the line.
+_OPEN_FENCE = re.compile(
+    r"^ {0,3}(`{3,})(?:[^`\n]*$|(?:[A-Za-z][\w+.-]*[ \t]+)?(?P<body>[^\n]*?)[ \t]*\1`*[ \t]*$)", re.M
+)
+# Inside a fence, a run of backticks ends it when it ends a line, even when
+# the model glued it to the last line of code. (Spelled ```+ so the regex
+# engine can scan for the literal prefix.)
+_CLOSE_FENCE = re.compile(r"(```+)[ \t]*$", re.M)
+_TRAILING_BACKTICKS = re.compile(r"`+[ \t]*\Z")
+_KEY = re.compile(r'"code_snippet"\s*:\s*"')
+_STRING_BODY = re.compile(r'(?:[^"\\]+|\\(?:u[0-9a-fA-F]{4}|[^u]))*')
+_HIGH_SURROGATE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}\Z")
+_ESCAPE = re.compile(r"\\(?:u[0-9a-fA-F]{4}|.)", re.S)
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class CodeExtractor:
+    """Single-pass extraction of the code in a model response, fed in chunks.
+
+    Understands the shapes models answer in: bare code, prose around
+    ```-fenced blocks (fence bodies are kept, prose is dropped, longer fences
+    may nest shorter ones), and ``{"code_snippet": "..."}`` objects, fenced or
+    not, whose string may itself be fenced. Backticks inside code are left
+    alone unless they form a fence line.
+
+    ``feed`` returns the code that became certain with that chunk, so a
+    response can be shown as code while it streams; ``close`` returns the
+    whole snippet. Every character is examined a bounded number of times.
+    Bare code is only certain once the response ends, since a later fence
+    would turn it into prose, so ``feed`` does not return it. A fence body
+    that starts with ``{`` is read as a ``code_snippet`` object, so when it
+    is plain code it is returned in one piece as the fence closes.
+    """
+
+    def __init__(self, prose: bool = True, json_allowed: bool = True):
+        # prose: text outside fences may be commentary rather than code.
+        self._prose = prose
+        self._json_allowed = json_allowed
+        self._mode = "detect"
+        self._buffer = ""
+        self._parts = []       # code read directly, in "code" mode
+        self._blocks = []      # finished fence bodies and JSON strings
+        self._tentative = []   # bare text that is the code unless a fence shows up
+        self._raw = None       # the JSON response so far, in case it has no code_snippet
+        self._child = None     # extractor for the open fence body or JSON string
+        self._fence = 0        # backticks in the open fence
+        self._at_line_start = True
+        self._committed = False
+        self._closed = False
+
+    @property
+    def snippet(self) -> str:
+        """The code extracted so far, including bare code that is not certain yet."""
+        if not self._committed:
+            pending = self._buffer if self._mode == "text" else ""
+            return ("".join(self._tentative) + pending).strip()
+        pieces = list(self._blocks)
+        if self._child is not None:
+            pieces.append(self._child.snippet)
+        if self._parts:
+            pieces.append("".join(self._parts).strip())
+        return "\n".join(piece for piece in pieces if piece)
+
+    def feed(self, chunk: str) -> str:
+        """Consume the next piece of the response and return newly extracted code."""
+        if not chunk or self._closed:
+            return ""
+        if self._raw is not None:
+            self._raw.append(chunk)
+        self._buffer += chunk
+        return self._advance(final=False)
+
+    def close(self) -> str:
+        """Consume the end of the response and return the extracted code."""
+        self._finish()
+        return self.snippet
+
+    def _finish(self) -> str:
+        if self._closed:
+            return ""
+        self._closed = True
+        delta = self._advance(final=True)
+        if self._mode in ("json", "string"):
+            # No complete code_snippet string: read the response as plain text.
+            fallback = CodeExtractor(self._prose, json_allowed=False)
+            fallback.feed("".join(self._raw))
+            self._blocks, self._child, self._committed = [fallback.close()], None, True
+            if self._mode == "json":
+                # Nothing was returned yet, so the whole fallback is new.
+                delta += self._blocks[0]
+        elif self._mode == "fence":
+            delta += self._end_child()
+        return delta
+
+    def _end_child(self) -> str:
+        delta = self._child._finish()
+        self._blocks.append(self._child.snippet)
+        self._child = None
+        return delta
+
+    def _advance(self, final: bool) -> str:
+        """Run the state machine over the buffer until it needs more input."""
+        emitted = []
+        handler = getattr(self, "_on_" + self._mode)
+        while self._buffer and handler(emitted, final):
+            handler = getattr(self, "_on_" + self._mode)
+        return "".join(emitted)
+
+    # Each state handler consumes from the buffer and returns True to keep going.
+
+    def _on_detect(self, emitted, final) -> bool:
+        start = len(self._buffer) - len(self._buffer.lstrip())
+        if start == len(self._buffer):
+            if final:
+                self._buffer = ""
+            return False
+        first = self._buffer[start]
+        if first == "{" and self._json_allowed:
+            self._mode = "json"
+            self._raw = [self._buffer]
+            return True
+        if first == "`":
+            end = self._buffer.find("\n", start)
+            if end < 0 and not final:
+                return False
+            line_start = self._buffer.rfind("\n", 0, start) + 1
+            match = _OPEN_FENCE.match(self._buffer, line_start, len(self._buffer) if end < 0 else end)
+            if match:
+                self._open_fence(match)
+                return True
+        if self._prose:
+            self._mode = "text"
+        else:
+            self._mode, self._committed = "code", True
+        return True
+
+    def _on_code(self, emitted, final) -> bool:
+        self._parts.append(self._buffer)
+        emitted.append(self._buffer)
+        self._buffer = ""
+        return False
+
+    def _on_done(self, emitted, final) -> bool:
+        self._buffer = ""
+        return False
+
+    def _on_text(self, emitted, final) -> bool:
+        # Tentative bare code, or commentary once a fence has been seen.
+        match = self._search(_OPEN_FENCE, final, lambda m: True)
+        if match is None:
+            cut = self._safe_end(final)
+            if not self._committed:
+                self._tentative.append(self._buffer[:cut])
+            self._buffer = self._buffer[cut:]
+            return False
+        self._open_fence(match)
+        return True
+
+    def _open_fence(self, match):
+        end = self._buffer.find("\n", match.end())
+        self._fence = len(match.group(1))
+        self._child = CodeExtractor(prose=False)
+        if match.group("body") is not None:
+            # Read a one-line fence as its body followed by a closing fence line.
+            self._buffer = match.group("body") + "\n" + match.group(1) + self._buffer[match.end():]
+        else:
+            self._buffer = "" if end < 0 else self._buffer[end + 1:]
+        self._mode = "fence"
+        self._tentative = []
+        self._committed = True
+        self._at_line_start = True
+
+    def _on_fence(self, emitted, final) -> bool:
+        match = self._search(_CLOSE_FENCE, final, lambda m: len(m.group(1)) >= self._fence, anywhere=True)
+        if match is None:
+            # Hold back trailing backticks: the rest of the line may show they close the fence.
+            tail = None if final else _TRAILING_BACKTICKS.search(self._buffer)
+            cut = len(self._buffer) if tail is None else tail.start()
+            emitted.append(self._child.feed(self._buffer[:cut]))
+            self._buffer = self._buffer[cut:]
+            return False
+        emitted.append(self._child.feed(self._buffer[:match.start()]))
+        emitted.append(self._end_child())
+        end = self._buffer.find("\n", match.end())
+        self._buffer = "" if end < 0 else self._buffer[end + 1:]
+        self._at_line_start = True
+        # After a fence, bare text is commentary; a fence body or JSON string ends with it.
+        self._mode = "text" if self._prose else "done"
+        return True
+
+    def _search(self, pattern, final, accept, anywhere=False):
+        """The first match of ``pattern`` that ``accept`` takes and that ends a complete line.
+
+        Unless ``anywhere``, the match must also start a line.
+        """
+        pos = 0
+        if not self._at_line_start and not anywhere:
+            pos = self._buffer.find("\n") + 1
+            if pos == 0:
+                return None
+        for match in pattern.finditer(self._buffer, pos):
+            if match.end() == len(self._buffer) and not final:
+                return None
+            if accept(match):
+                return match
+        return None
+
+    def _safe_end(self, final: bool) -> int:
+        """How much of the buffer can be consumed without splitting a possible fence line."""
+        if final:
+            self._at_line_start = True
+            return len(self._buffer)
+        line_start = self._buffer.rfind("\n") + 1
+        if line_start == 0 and not self._at_line_start:
+            return len(self._buffer)
+        tail = self._buffer[line_start:].lstrip(" ")
+        if not tail or tail[0] == "`":
+            # Could still become a fence line; wait for the rest of it.
+            self._at_line_start = True
+            return line_start
+        self._at_line_start = False
+        return len(self._buffer)
+
+    def _on_json(self, emitted, final) -> bool:
+        match = _KEY.search(self._buffer)
+        if match is None:
+            # Keep what could be the start of the key.
+            start = self._buffer.rfind('"code_snippet"')
+            self._buffer = self._buffer[start:] if start >= 0 else self._buffer[-13:]
+            return False
+        self._buffer = self._buffer[match.end():]
+        self._child = CodeExtractor(prose=False, json_allowed=False)
+        self._mode, self._committed = "string", True
+        return True
+
+    def _on_string(self, emitted, final) -> bool:
+        # The longest prefix made of whole characters and escapes, then the quote if it is there.
+        body = _STRING_BODY.match(self._buffer)
+        end = body.end()
+        ended = self._buffer.startswith('"', end)
+        if not ended and not final and _HIGH_SURROGATE.search(self._buffer, 0, end):
+            end -= 6  # its low surrogate is still on its way
+        text = _decode(self._buffer[:end])
+        self._buffer = self._buffer[end + ended:]
+        emitted.append(self._child.feed(text))
+        if not ended:
+            return False
+        emitted.append(self._end_child())
+        self._mode, self._raw = "done", None
+        return True
+
+
+def _decode(body: str) -> str:
+    """Decode the inside of a JSON string, tolerating raw control characters and bad escapes."""
+    if "\\" not in body:
+        return body
+    try:
+        return json.decoder.scanstring('"' + body + '"', 1, False)[0]
+    except ValueError:
+        return _ESCAPE.sub(lambda m: _decode_escape(m.group()), body)
+
+
+def _decode_escape(sequence: str) -> str:
+    if sequence[1] != "u":
+        return _ESCAPES.get(sequence[1], sequence[1])
+    try:
+        return json.loads('"' + sequence + '"')
+    except ValueError:
+        return sequence
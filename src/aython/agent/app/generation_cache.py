@@ -0,0 +1,141 @@
+# agent/app/generation_cache.py
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy import Column, Float, String, Text, create_engine, delete, func, select
+from sqlalchemy.orm import Session, declarative_base
+
+CACHE_PATH = os.environ.get("GENERATION_CACHE_PATH", "aython_cache.db")
+CACHE_TTL = float(os.environ.get("GENERATION_CACHE_TTL", "86400"))
+CACHE_MEMORY_ENTRIES = int(os.environ.get("GENERATION_CACHE_MEMORY_ENTRIES", "256"))
+CACHE_DISK_ENTRIES = int(os.environ.get("GENERATION_CACHE_DISK_ENTRIES", "10000"))
+
+Base = declarative_base()
+
+
+class CachedGeneration(Base):
+    """A generated code snippet persisted in the on-disk tier."""
+    __tablename__ = "generations"
+
+    key = Column(String(64), primary_key=True)
+    model = Column(String(255), nullable=False)
+    code_snippet = Column(Text, nullable=False)
+    expires_at = Column(Float, nullable=False, index=True)
+    last_access = Column(Float, nullable=False, index=True)
+
+
+def normalize_requirements(requirements: str) -> str:
+    """Collapse whitespace so trivially different spellings share a key."""
+    return re.sub(r"\s+", " ", requirements or "").strip()
+
+
+def cache_key(model_id: str, requirements: str, context: str = "") -> str:
+    """Build the cache key for a (model, requirements, context) triple."""
+    payload = json.dumps([model_id, normalize_requirements(requirements), context or ""])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """Two-tier (in-memory LRU + SQLite) cache of generated code snippets."""
+
+    def __init__(
+        self,
+        path: Optional[str] = CACHE_PATH,
+        ttl: float = CACHE_TTL,
+        memory_entries: int = CACHE_MEMORY_ENTRIES,
+        disk_entries: int = CACHE_DISK_ENTRIES,
+    ):
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        self._engine = None
+        if path:
+            self._engine = create_engine(
+                f"sqlite:///{path}", connect_args={"check_same_thread": False}
+            )
+            Base.metadata.create_all(self._engine)
+
+    def get(self, model_id: str, requirements: str, context: str = "") -> Optional[str]:
+        """Return the cached snippet, or None on a miss or expired entry."""
+        key = cache_key(model_id, requirements, context)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                code_snippet, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return code_snippet
+                del self._memory[key]
+
+        if self._engine is not None:
+            with Session(self._engine) as session:
+                row = session.get(CachedGeneration, key)
+                if row is not None and row.expires_at > now:
+                    row.last_access = now
+                    session.commit()
+                    self._remember(key, row.code_snippet, row.expires_at)
+                    with self._lock:
+                        self.stats["disk_hits"] += 1
+                    return row.code_snippet
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, model_id: str, requirements: str, context: str, code_snippet: str):
+        """Store a validated snippet in both tiers."""
+        key = cache_key(model_id, requirements, context)
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, code_snippet, expires_at)
+
+        if self._engine is not None:
+            with Session(self._engine) as session:
+                session.merge(CachedGeneration(
+                    key=key,
+                    model=model_id,
+                    code_snippet=code_snippet,
+                    expires_at=expires_at,
+                    last_access=now,
+                ))
+                session.commit()
+                self._evict_disk(session, now)
+
+    def clear(self):
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+        if self._engine is not None:
+            with Session(self._engine) as session:
+                session.execute(delete(CachedGeneration))
+                session.commit()
+
+    def _remember(self, key: str, code_snippet: str, expires_at: float):
+        with self._lock:
+            self._memory[key] = (code_snippet, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self, session: Session, now: float):
+        session.execute(delete(CachedGeneration).where(CachedGeneration.expires_at <= now))
+        count = session.scalar(select(func.count()).select_from(CachedGeneration))
+        overflow = count - self.disk_entries
+        if overflow > 0:
+            oldest = select(CachedGeneration.key).order_by(
+                CachedGeneration.last_access
+            ).limit(overflow)
+            session.execute(delete(CachedGeneration).where(CachedGeneration.key.in_(oldest)))
+        session.commit()
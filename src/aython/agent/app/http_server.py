@@ -0,0 +1,145 @@
+# agent/app/http_server.py
+import asyncio
+import json
+from http import HTTPStatus
+from jsonrpcserver import async_dispatch
+import tracing
+
+MAX_HEADER_BYTES = 64 * 1024
+
+
+async def _read_request(reader: asyncio.StreamReader):
+    """Read one HTTP/1.x request, returning (method, path, headers, body) or None on EOF."""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise ValueError("Request headers too large")
+
+    lines = head.decode("latin-1").split("\r\n")
+    method, path, version = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    headers[":version"] = version
+
+    length = int(headers.get("content-length", "0") or "0")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path.split("?", 1)[0], headers, body
+
+
+def _keep_alive(headers: dict) -> bool:
+    connection = headers.get("connection", "").lower()
+    if headers[":version"] == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+async def _write_response(writer, status: int, body: bytes, content_type: str, keep_alive: bool):
+    reason = HTTPStatus(status).phrase
+    head = (
+        f"HTTP/1.1 {status} {reason}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    )
+    writer.write(head.encode("latin-1") + body)
+    await writer.drain()
+
+
+async def _write_event_stream(writer, events, keep_alive: bool):
+    """Send ``(event, data)`` pairs as server-sent events over a chunked response."""
+    head = (
+        "HTTP/1.1 200 OK\r\n"
+        "Content-Type: text/event-stream\r\n"
+        "Cache-Control: no-cache\r\n"
+        "Transfer-Encoding: chunked\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    )
+    writer.write(head.encode("latin-1"))
+    async for event, data in events:
+        chunk = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+        writer.write(f"{len(chunk):X}\r\n".encode("latin-1") + chunk + b"\r\n")
+        await writer.drain()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+class HttpServer:
+    """Minimal asyncio HTTP/1.1 server that dispatches POSTs as JSON-RPC.
+
+    ``routes`` maps GET paths to coroutines returning ``(status, content_type, body)``.
+    ``streams`` maps POST paths to callables that take the decoded JSON-RPC request
+    and return an async iterator of ``(event, data)`` pairs, sent as server-sent events.
+    Every connection is served concurrently, with keep-alive. Each request is traced
+    under the id in its ``X-Request-Id`` header.
+    """
+
+    def __init__(self, routes: dict = None, streams: dict = None):
+        self.routes = routes or {}
+        self.streams = streams or {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    await _write_response(writer, 400, b"Bad Request", "text/plain", False)
+                    break
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+                keep_alive = _keep_alive(headers)
+                with tracing.request(headers.get(tracing.REQUEST_ID_HEADER)), \
+                        tracing.span("http", method=method, path=path):
+                    if method == "POST" and path in self.streams:
+                        await self.stream(writer, path, body, keep_alive)
+                    else:
+                        status, content_type, payload = await self.respond(method, path, headers, body)
+                        await _write_response(writer, status, payload, content_type, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def stream(self, writer, path: str, body: bytes, keep_alive: bool):
+        try:
+            rpc_request = json.loads(body)
+        except ValueError:
+            await _write_response(writer, 400, b"Bad Request", "text/plain", keep_alive)
+            return
+        await _write_event_stream(writer, self.streams[path](rpc_request), keep_alive)
+
+    async def respond(self, method: str, path: str, headers: dict, body: bytes):
+        if method == "POST":
+            response = await async_dispatch(body.decode("utf-8"))
+            if not response:
+                return 204, "application/json", b""
+            return 200, "application/json", response.encode("utf-8")
+
+        if method == "GET" and path in self.routes:
+            status, content_type, payload = await self.routes[path]()
+            if isinstance(payload, str):
+                payload = payload.encode("utf-8")
+            return status, content_type, payload
+
+        return 404, "text/plain", b"Not Found"
+
+    async def start(self, host: str, port: int, reuse_port: bool = False) -> asyncio.AbstractServer:
+        """Listen on ``host:port``; with ``reuse_port`` other processes may listen there too."""
+        return await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES,
+                                          reuse_port=reuse_port or None)
+
+    async def serve_forever(self, host: str, port: int, reuse_port: bool = False):
+        server = await self.start(host, port, reuse_port)
+        async with server:
+            await server.serve_forever()
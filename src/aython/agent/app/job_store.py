@@ -0,0 +1,108 @@
+# agent/app/job_store.py
+import json
+import os
+import time
+import uuid
+from typing import Optional
+from sqlalchemy import Column, Float, String, Text, create_engine, delete, update
+from sqlalchemy.orm import Session, declarative_base
+
+JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", "aython_jobs.db")
+JOB_TTL = float(os.environ.get("JOB_TTL", "3600"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+Base = declarative_base()
+
+
+class Job(Base):
+    """A submitted generation and, once finished, its JSON-RPC response member."""
+    __tablename__ = "jobs"
+
+    id = Column(String(32), primary_key=True)
+    model = Column(String(255), nullable=False)
+    requirements = Column(Text, nullable=False)
+    execution = Column(String(32), nullable=False)
+    status = Column(String(16), nullable=False)
+    response = Column(Text)
+    created_at = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+    expires_at = Column(Float, nullable=False, index=True)
+
+
+class JobStore:
+    """SQLite-backed job records, kept for ``ttl`` seconds after their last update.
+
+    Status moves queued -> running -> done/failed, or to cancelled from either
+    unfinished state. Transitions are conditional updates, so a job cancelled
+    while running stays cancelled when its result arrives.
+    """
+
+    def __init__(self, path: str = JOB_STORE_PATH, ttl: float = JOB_TTL):
+        self.ttl = ttl
+        self._engine = create_engine(
+            f"sqlite:///{path}", connect_args={"check_same_thread": False}
+        )
+        Base.metadata.create_all(self._engine)
+
+    def create(self, model: str, requirements: str, execution: str) -> str:
+        """Record a queued job and return its id."""
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with Session(self._engine) as session:
+            session.execute(delete(Job).where(Job.expires_at <= now))
+            session.add(Job(
+                id=job_id,
+                model=model,
+                requirements=requirements,
+                execution=execution,
+                status=QUEUED,
+                created_at=now,
+                updated_at=now,
+                expires_at=now + self.ttl,
+            ))
+            session.commit()
+        return job_id
+
+    def start(self, job_id: str) -> bool:
+        """Mark a queued job running; False if it was cancelled in the meantime."""
+        return self._transition(job_id, (QUEUED,), RUNNING)
+
+    def finish(self, job_id: str, response: dict) -> bool:
+        """Store the response of a running job; False if it was cancelled."""
+        status = FAILED if "error" in response else DONE
+        return self._transition(job_id, (RUNNING,), status, json.dumps(response))
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """Cancel an unfinished job; returns the job's resulting status, or None if unknown."""
+        self._transition(job_id, (QUEUED, RUNNING), CANCELLED)
+        job = self.get(job_id)
+        return job["status"] if job else None
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Return the job as a dict, or None if it is unknown or expired."""
+        with Session(self._engine) as session:
+            job = session.get(Job, job_id)
+            if job is None or job.expires_at <= time.time():
+                return None
+            return {
+                "job_id": job.id,
+                "model": job.model,
+                "status": job.status,
+                "created_at": job.created_at,
+                "updated_at": job.updated_at,
+                "response": json.loads(job.response) if job.response else None,
+            }
+
+    def _transition(self, job_id: str, from_states, status: str, response: str = None) -> bool:
+        now = time.time()
+        values = {"status": status, "updated_at": now, "expires_at": now + self.ttl}
+        if response is not None:
+            values["response"] = response
+        with Session(self._engine) as session:
+            result = session.execute(
+                update(Job).where(Job.id == job_id, Job.status.in_(from_states)).values(**values)
+            )
+            session.commit()
+            return result.rowcount == 1
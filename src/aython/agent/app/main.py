@@ -1,45 +1,509 @@
 # agent/app/main.py
+import asyncio
+import functools
+import json
 import os
-from jsonrpcserver import method, serve, Success, Error
-from aython_agent import AythonAgent
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from jsonrpcserver import method, Success, Error, InvalidParams
+from agent_pool import AgentPool
+from aython_agent import AythonAgent, TokenUsage
+from generation_cache import GenerationCache, cache_key
+from http_server import HttpServer
+from job_store import CANCELLED, FINISHED, JobStore
+from metrics import COALESCED, CONTENT_TYPE, ERRORS, PHASE_SECONDS, REGISTRY, REQUEST_SECONDS
+import rate_limiter
+import tracing
+from single_flight import SingleFlight
+from worker_pool import get_default_pool
 
 AGENT_PORT = int(os.environ.get("AGENT_PORT", "4000"))
+MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", "32"))
+# Server processes sharing AGENT_PORT through SO_REUSEPORT, each with its own
+# agent pools and execution workers; 0 starts one per core.
+AGENT_WORKERS = int(os.environ.get("AGENT_WORKERS", "1")) or os.cpu_count() or 1
+# Set by the supervisor in each worker process.
+AGENT_WORKER_ID = os.environ.get("AGENT_WORKER_ID")
 _default_model = os.environ.get("MODEL", "gpt-4o-mini")
+# Run one stubbed generation per model before serving it, so the first real
+# request does not pay for SDK imports and connection setup.
+AGENT_WARM_UP = os.environ.get("AGENT_WARM_UP", "1") != "0"
+# A failed boot warm-up is retried this many times, waiting AGENT_WARM_UP_RETRY_DELAY
+# seconds before the first retry and twice as long before each next one.
+AGENT_WARM_UP_RETRIES = int(os.environ.get("AGENT_WARM_UP_RETRIES", "3"))
+AGENT_WARM_UP_RETRY_DELAY = float(os.environ.get("AGENT_WARM_UP_RETRY_DELAY", "1"))
+# Identical generations (same model, context and requirements up to whitespace) that
+# arrive while one is in flight wait for it instead of calling the model again.
+AGENT_COALESCE = os.environ.get("AGENT_COALESCE", "1") != "0"
+
+# Where generated code runs. The notebook decides whether it also execs locally;
+# the server only needs to know whether to run the snippet itself.
+EXECUTION_MODES = ("notebook-only", "agent-only", "both-sequential", "both-concurrent")
+AGENT_EXECUTES = ("agent-only", "both-sequential")
+
+# The SQLite-backed cache and job store are opened on first use, so importing
+# main creates no files.
+_cache = None
+_job_store = None
+_stores_lock = threading.Lock()
+_job_futures = {}
+_flights = SingleFlight()
+_worker_pool = get_default_pool()
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="aython")
+# Job-store reads and writes are quick; on their own threads, status polls and
+# cancels are not queued behind the generations filling _executor.
+_store_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="aython-store")
+_pools = {}
+_pools_lock = threading.Lock()
+_warm_ups = {}
+_warm_up_lock = threading.Lock()
+_readiness = {"status": "warming", "model": _default_model}
+_model = None
+
+
+async def _run_blocking(fn, *args):
+    """Run a blocking agent call on the executor so the event loop keeps serving."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, tracing.bind(fn), *args)
+
+
+def _get_cache() -> GenerationCache:
+    global _cache
+    with _stores_lock:
+        if _cache is None:
+            _cache = GenerationCache()
+        return _cache
+
+
+def _get_job_store() -> JobStore:
+    global _job_store
+    with _stores_lock:
+        if _job_store is None:
+            _job_store = JobStore()
+        return _job_store
+
+
+async def _run_store(name: str, *args):
+    """Call the JobStore method ``name`` on its own executor."""
+    def call():
+        return getattr(_get_job_store(), name)(*args)
+    return await asyncio.get_running_loop().run_in_executor(_store_executor, tracing.bind(call))
+
+
+def _get_pool(model: str) -> AgentPool:
+    with _pools_lock:
+        pool = _pools.get(model)
+        if pool is None:
+            pool = AgentPool(lambda: AythonAgent(model, cache=_get_cache(), worker_pool=_worker_pool))
+            _pools[model] = pool
+        return pool
+
+
+def _prepare(model: str):
+    """Build ``model``'s first agent and warm it up, once per model."""
+    pool = _get_pool(model)
+    pool.prime()
+    if not AGENT_WARM_UP:
+        return
+    with _warm_up_lock:
+        if model in _warm_ups:
+            return
+        with tracing.span("warm_up", model=model), pool.checkout() as agent:
+            seconds = agent.warm_up()
+        PHASE_SECONDS.observe(seconds, phase="warm_up", model=model, outcome="ok")
+        _warm_ups[model] = round(seconds, 3)
+
+
+def _warm_default_model(retries: int = AGENT_WARM_UP_RETRIES):
+    """Prepare the configured MODEL at boot; /ready turns green when this succeeds.
+
+    /ready stays "warming" while failed attempts are retried, and reports
+    "failed" with the last error once ``retries`` are used up.
+    """
+    delay = AGENT_WARM_UP_RETRY_DELAY
+    for attempt in range(retries + 1):
+        try:
+            _prepare(_default_model)
+        except Exception as e:
+            with _pools_lock:
+                _pools.pop(_default_model, None)
+            if attempt == retries:
+                _readiness.update(status="failed", error=str(e))
+                return
+            _readiness["error"] = str(e)
+            time.sleep(delay)
+            delay *= 2
+            continue
+        _readiness.pop("error", None)
+        _readiness.update(status="ready", warm_up_seconds=_warm_ups.get(_default_model))
+        return
+
+
+@contextmanager
+def _checkout(model: str, since: float):
+    """Borrow an agent for ``model``, recording the time since ``since`` as the queue phase."""
+    with _pools_lock:
+        pool = _pools.get(model)
+    if pool is None:
+        # A failed init_agent or warm-up dropped the model after the request resolved it.
+        raise RuntimeError(f"Model {model} is not initialized")
+    with tracing.span("checkout", model=model), pool.checkout() as agent:
+        PHASE_SECONDS.observe(time.perf_counter() - since, phase="queue", model=model, outcome="ok")
+        yield agent
+
+
+def _generate_response(result: dict) -> dict:
+    """Turn a generate_and_execute result into a JSON-RPC ``result`` or ``error`` member."""
+    if result["error"]:
+        return {"error": {"code": -32002, "message": result["error"],
+                          "data": {"debug_log": result["debug_log"], "usage": result.get("usage")}}}
+
+    execution_result = result["execution_result"]
+    return {"result": {
+        "code_snippet": result["code_snippet"],
+        "cache_hit": result["cache_hit"],
+        "coalesced": result.get("coalesced", False),
+        "timings": result["timings"],
+        "usage": result.get("usage"),
+        "execution_result": execution_result.model_dump() if execution_result else None
+    }}
+
+
+def _to_rpc(response: dict):
+    if "error" in response:
+        return Error(**response["error"])
+    return Success(response["result"])
+
+
+def _record_request(name: str, model: str, start: float, error_code=None):
+    outcome = "ok" if error_code is None else "error"
+    REQUEST_SECONDS.observe(time.perf_counter() - start, method=name, model=model or "", outcome=outcome)
+    if error_code is not None:
+        ERRORS.inc(method=name, code=error_code)
+
+
+def _instrumented(fn):
+    """Record latency, and error codes of ``Error`` results, for a JSON-RPC method."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        error_code = None
+        try:
+            with tracing.span(fn.__name__) as span:
+                result = await fn(*args, **kwargs)
+                span.status = "ok" if getattr(result, "_error", None) is None else "error"
+            # jsonrpcserver results are oslash Either values; only Left carries an error.
+            error = getattr(result, "_error", None)
+            if error is not None:
+                error_code = error.code
+            return result
+        except Exception:
+            error_code = "exception"
+            raise
+        finally:
+            _record_request(fn.__name__, kwargs.get("model") or _model, start, error_code)
+    return wrapper
+
+
+async def _resolve_model(model: str, execution: str):
+    """Return ``(model, None)`` for a usable request, or ``(None, error)``.
+
+    A model named in the request is prepared on first use: with several server
+    processes, init_agent only reached one of them.
+    """
+    if execution not in EXECUTION_MODES:
+        return None, InvalidParams(f"execution must be one of {', '.join(EXECUTION_MODES)}")
+    m = model or _model
+    if not m:
+        return None, Error(code=-32001, message="Agent not initialized")
+    if m not in _pools:
+        try:
+            await _run_blocking(_prepare, m)
+        except Exception as e:
+            with _pools_lock:
+                _pools.pop(m, None)
+            return None, Error(code=-32000, message=str(e))
+    return m, None
+
+
+def _generate_code(job_id: str, model: str, requirements: str, context: str, submitted: float):
+    """Generate a job's code on a checked-out agent.
+
+    Returns (agent, CodeResult, seconds generating), or None if the job was cancelled.
+    """
+    with _checkout(model, submitted) as agent:
+        # A job stays queued until it has an agent, so cancelling it while it waits skips the model call.
+        if not _get_job_store().start(job_id):
+            return None
+        start = time.perf_counter()
+        code_result = agent.code(requirements, context)
+        return agent, code_result, time.perf_counter() - start
+
+
+def _coalesced_code(job_id: str, model: str, requirements: str, context: str, submitted: float):
+    """Like _generate_code, but joins an identical generation already in flight.
+
+    A job that joins another stays queued until that generation finishes.
+    """
+    generate = functools.partial(_generate_code, job_id, model, requirements, context, submitted)
+    if not AGENT_COALESCE:
+        return generate(), False
+    outcome, shared = _flights.do(cache_key(model, requirements, context), generate)
+    if shared:
+        COALESCED.inc(model=model)
+        if outcome is None:
+            # The job we waited on was cancelled before it started.
+            return generate(), False
+        if not _get_job_store().start(job_id):
+            return None, True
+    return outcome, shared
+
+
+def _execute_job(job_id: str, model: str, requirements: str, context: str, execution: str,
+                 submitted: float):
+    """Run one job on an executor thread; returns its response, or None if it was cancelled."""
+    try:
+        start = time.perf_counter()
+        outcome, shared = _coalesced_code(job_id, model, requirements, context, submitted)
+        if outcome is None:
+            return None
+        agent, code_result, generate_seconds = outcome
+        if shared:
+            generate_seconds = time.perf_counter() - start
+            # With repair_execution the leader's result already holds its run; make ours run again.
+            code_result = code_result.model_copy(update={"execution": None})
+        # Every job runs the code itself, so a shared generation still gets its own execution result.
+        result = agent.execute_generated(code_result, execution in AGENT_EXECUTES, generate_seconds)
+        result["coalesced"] = shared
+        if shared:
+            # The leader's response already accounts for the tokens.
+            result["usage"] = TokenUsage().model_dump()
+        response = _generate_response(result)
+    except Exception as e:
+        _get_job_store().start(job_id)  # no-op unless checkout itself failed
+        response = {"error": {"code": -32003, "message": str(e)}}
+    return response if _get_job_store().finish(job_id, response) else None
+
+
+async def _submit(m: str, requirements: str, context: str, execution: str):
+    """Queue a generation job; returns its id and the future that runs it."""
+    submitted = time.perf_counter()
+    job_id = await _run_store("create", m, requirements, execution)
+    future = asyncio.get_running_loop().run_in_executor(
+        _executor, tracing.bind(_execute_job), job_id, m, requirements, context, execution, submitted
+    )
+    _job_futures[job_id] = future
+    future.add_done_callback(lambda _: _job_futures.pop(job_id, None))
+    return job_id, future
+
+
+async def _wait_job(job_id: str, future) -> dict:
+    await asyncio.wait([future])
+    response = None if future.cancelled() else future.result()
+    return response or {"error": {"code": -32006, "message": "Job cancelled", "data": {"job_id": job_id}}}
+
+
+def _unknown_job(job_id: str):
+    return Error(code=-32004, message="Unknown job", data={"job_id": job_id})
+
+
+async def stream_generate_and_run(request: dict):
+    """Stream a generate_and_run call as ``attempt``/``token``/``code`` events and a final ``result``.
+
+    The ``result`` event carries the same JSON-RPC response envelope as the plain method.
+    """
+    params = request.get("params") or {}
+    envelope = {"jsonrpc": "2.0", "id": request.get("id")}
+    m, error = await _resolve_model(params.get("model"), params.get("execution", "both-sequential"))
+    if error:
+        failure = error._error
+        ERRORS.inc(method="generate_and_run_stream", code=failure.code)
+        yield "result", {**envelope, "error": {"code": failure.code, "message": failure.message}}
+        return
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    start = time.perf_counter()
+
+    def produce():
+        try:
+            with _checkout(m, start) as agent:
+                execution = params.get("execution", "both-sequential")
+                for event, value in agent.generate_and_execute_stream(
+                    params.get("requirements", ""), params.get("context", ""),
+                    execute=execution in AGENT_EXECUTES,
+                ):
+                    if event == "result":
+                        value = _generate_response(value)
+                    loop.call_soon_threadsafe(events.put_nowait, (event, value))
+        except Exception as e:
+            loop.call_soon_threadsafe(
+                events.put_nowait, ("result", {"error": {"code": -32003, "message": str(e)}})
+            )
+
+    producer = loop.run_in_executor(_executor, tracing.bind(produce))
+    while True:
+        event, value = await events.get()
+        if event == "result":
+            _record_request("generate_and_run_stream", m, start, value.get("error", {}).get("code"))
+            yield "result", {**envelope, **value}
+            break
+        yield event, {"attempt": value} if event == "attempt" else {"text": value}
+    await producer
+
 
-_agent = None
 @method
-def init_agent(model: str = None):
-    global _agent
+@_instrumented
+async def init_agent(model: str = None):
+    global _model
     m = model or _default_model
     try:
-        _agent = AythonAgent(m)
+        await _run_blocking(_prepare, m)
+        _model = m
         return Success({"message": f"Aython initialized with model {m}"})
     except Exception as e:
+        with _pools_lock:
+            _pools.pop(m, None)
         return Error(code=-32000, message=str(e))
 
 @method
-def generate_and_run(requirements: str):
-    global _agent
-    if not _agent:
-        return Error(code=-32001, message="Agent not initialized")
+@_instrumented
+async def generate_and_run(requirements: str, model: str = None, execution: str = "both-sequential",
+                           context: str = ""):
+    """Submit a generation job and wait for its result."""
+    m, error = await _resolve_model(model, execution)
+    if error:
+        return error
+
+    try:
+        job_id, future = await _submit(m, requirements, context, execution)
+        return _to_rpc(await _wait_job(job_id, future))
+    except Exception as e:
+        return Error(code=-32003, message=str(e))
+
+@method
+@_instrumented
+async def submit_generation(requirements: str, model: str = None, execution: str = "both-sequential",
+                            context: str = ""):
+    """Queue a generation and return its job id without waiting for the model."""
+    m, error = await _resolve_model(model, execution)
+    if error:
+        return error
 
     try:
-        result = _agent.generate_and_execute(requirements)
-        
-        if result["error"]:
-            return Error(code=-32002, message=result["error"], data={"debug_log": result["debug_log"]})
-        
-        execution_result = result["execution_result"]
-        return Success({
-            "code_snippet": result["code_snippet"],
-            "execution_result": {
-                "exit_code": execution_result.exit_code,
-                "stdout": execution_result.stdout,
-                "stderr": execution_result.stderr
-            }
-        })
+        job_id, _ = await _submit(m, requirements, context, execution)
     except Exception as e:
         return Error(code=-32003, message=str(e))
+    return Success({"job_id": job_id, "status": "queued"})
+
+@method
+async def get_job_status(job_id: str):
+    job = await _run_store("get", job_id)
+    if job is None:
+        return _unknown_job(job_id)
+    job.pop("response")
+    return Success(job)
+
+@method
+async def get_job_result(job_id: str):
+    """Return a finished job's result exactly as generate_and_run would have."""
+    job = await _run_store("get", job_id)
+    if job is None:
+        return _unknown_job(job_id)
+    if job["status"] == CANCELLED:
+        return Error(code=-32006, message="Job cancelled", data={"job_id": job_id})
+    if job["status"] not in FINISHED:
+        return Error(code=-32005, message="Job not finished",
+                     data={"job_id": job_id, "status": job["status"]})
+    return _to_rpc(job["response"])
+
+@method
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job; a running generation finishes but its result is dropped."""
+    future = _job_futures.get(job_id)
+    status = await _run_store("cancel", job_id)
+    if status is None:
+        return _unknown_job(job_id)
+    if future is not None and status == CANCELLED:
+        future.cancel()
+    return Success({"job_id": job_id, "status": status})
+
+@method
+@_instrumented
+async def run_code(code: str, timeout: int = 10):
+    """Execute already generated code on the agent's worker pool."""
+    start = time.perf_counter()
+    exit_code, stdout, stderr = await _run_blocking(_worker_pool.run, code, timeout)
+    return Success({
+        "execution_result": {"exit_code": exit_code, "stdout": stdout, "stderr": stderr},
+        "timings": {"execute_ms": round((time.perf_counter() - start) * 1000, 1)},
+    })
+
+@method
+@_instrumented
+async def generate_and_run_batch(requirements: list, model: str = None, execution: str = "both-sequential",
+                                 context: str = ""):
+    """Run several generate_and_run calls concurrently; one result or error per item."""
+    m, error = await _resolve_model(model, execution)
+    if error:
+        return error
+
+    async def one(r: str) -> dict:
+        try:
+            response = await _wait_job(*await _submit(m, r, context, execution))
+        except Exception as e:
+            response = {"error": {"code": -32003, "message": str(e)}}
+        if "error" in response:
+            ERRORS.inc(method="generate_and_run_batch.item", code=response["error"]["code"])
+        return response
+
+    results = await asyncio.gather(*(one(r) for r in requirements))
+    return Success({"results": list(results)})
+
+@method
+async def pool_stats():
+    with _pools_lock:
+        return Success({model: pool.stats() for model, pool in _pools.items()})
+
+
+@method
+async def limiter_stats():
+    """Concurrency limit, throttles and wait time of each model's rate limiter."""
+    return Success(rate_limiter.stats())
+
+
+@method
+async def get_trace(request_id: str = None, limit: int = 200):
+    """Return recently recorded spans, optionally only those of one request."""
+    return Success({"spans": tracing.ring.recent(request_id, limit)})
+
+
+async def metrics():
+    """Prometheus text exposition of the request, phase, retry and error metrics."""
+    return 200, CONTENT_TYPE, REGISTRY.render()
+
+
+async def ready():
+    """200 once the configured model is warmed up; 503 while warming or if warm-up failed."""
+    status = 200 if _readiness["status"] == "ready" else 503
+    return status, "application/json", json.dumps(_readiness)
+
+
+ROUTES = {"/metrics": metrics, "/ready": ready}
+STREAMS = {"/stream": stream_generate_and_run}
 
 if __name__ == "__main__":
-    serve("0.0.0.0", AGENT_PORT)
+    if AGENT_WORKERS > 1 and AGENT_WORKER_ID is None:
+        from supervisor import Supervisor
+
+        # Create the SQLite tables once here; workers creating them at boot race each other.
+        _get_cache()
+        _get_job_store()
+        Supervisor([sys.executable, os.path.abspath(__file__)], AGENT_WORKERS).run()
+    else:
+        _worker_pool.warm()
+        _executor.submit(_warm_default_model)
+        server = HttpServer(routes=ROUTES, streams=STREAMS)
+        asyncio.run(server.serve_forever("0.0.0.0", AGENT_PORT, reuse_port=AGENT_WORKERS > 1))
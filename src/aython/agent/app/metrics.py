@@ -0,0 +1,199 @@
+# agent/app/metrics.py
+import threading
+import time
+from contextlib import contextmanager
+import tracing
+
+# Seconds; spans cache hits (milliseconds) up to slow multi-attempt LLM calls.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram, rendered like the Prometheus client's."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts, then sum and count.
+                series = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels) -> int:
+        series = self._values.get(tuple(str(labels[name]) for name in self.labelnames))
+        return series[-1] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        for key, series in items:
+            *buckets, total, count = series
+            for bound, cumulative in zip(self.buckets, buckets):
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+            inf = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, key, inf)} {count}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {count}"
+
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+REGISTRY = Registry()
+
+PHASE_SECONDS = REGISTRY.histogram(
+    "aython_phase_seconds",
+    "Latency of each phase of a generation: rate_limit, queue, llm, clean, check, execute, warm_up.",
+    ("phase", "model", "outcome"),
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "aython_request_seconds",
+    "End-to-end latency of JSON-RPC methods.",
+    ("method", "model", "outcome"),
+)
+ERRORS = REGISTRY.counter(
+    "aython_errors_total",
+    "JSON-RPC error responses by method and error code.",
+    ("method", "code"),
+)
+GENERATION_ATTEMPTS = REGISTRY.counter(
+    "aython_generation_attempts_total",
+    "LLM attempts at generating code, speculative candidates included.",
+    ("model",),
+)
+GENERATION_SUCCESSES = REGISTRY.counter(
+    "aython_generation_successes_total",
+    "Generations that produced code passing the checks; attempts / successes is the model's attempts per success.",
+    ("model",),
+)
+RETRIES = REGISTRY.counter(
+    "aython_generation_retries_total",
+    "LLM attempts beyond the first one of a request.",
+    ("model",),
+)
+THROTTLES = REGISTRY.counter(
+    "aython_llm_throttled_total",
+    "Model calls the provider rejected as rate limited (HTTP 429 or 503).",
+    ("model",),
+)
+LLM_TOKENS = REGISTRY.counter(
+    "aython_llm_tokens_total",
+    "Tokens sent to and received from the model, as the provider reported them or estimated.",
+    ("model", "kind"),
+)
+COALESCED = REGISTRY.counter(
+    "aython_coalesced_total",
+    "Generations that reused an identical one already in flight instead of calling the model.",
+    ("model",),
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "aython_cache_lookups_total",
+    "Generation cache lookups by result (hit, miss, or error when the cache failed).",
+    ("model", "result"),
+)
+
+
+class _Phase:
+    outcome = "ok"
+
+
+@contextmanager
+def phase(name: str, model: str, **attrs):
+    """Time a block into ``aython_phase_seconds`` and as a trace span.
+
+    The outcome is "error" if the block raises; the block can also set
+    ``outcome`` on the yielded object itself. ``attrs`` only go on the span.
+    """
+    timer = _Phase()
+    start = time.perf_counter()
+    with tracing.span(name, model=model, **attrs) as span:
+        try:
+            yield timer
+        except BaseException:
+            timer.outcome = "error"
+            raise
+        finally:
+            span.status = timer.outcome
+            PHASE_SECONDS.observe(time.perf_counter() - start, phase=name, model=model, outcome=timer.outcome)
@@ -0,0 +1,202 @@
+# agent/app/rate_limiter.py
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from metrics import THROTTLES, phase
+
+# Limits for each provider model, per server process. Any of them can be set for
+# one provider only with a suffix, e.g. LLM_MAX_RPS_GPT=5 or LLM_MAX_TPM_GEMINI=90000.
+# 0 turns a limit off; LLM_MAX_CONCURRENCY=0 also turns off the adaptive limit.
+LLM_MAX_RPS = float(os.environ.get("LLM_MAX_RPS", "0"))
+LLM_MAX_TPM = float(os.environ.get("LLM_MAX_TPM", "0"))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+LLM_MIN_CONCURRENCY = int(os.environ.get("LLM_MIN_CONCURRENCY", "1"))
+# Calls slower than this many seconds count as congestion, like a 429. 0 disables.
+LLM_LATENCY_TARGET = float(os.environ.get("LLM_LATENCY_TARGET", "0"))
+LLM_BACKOFF = float(os.environ.get("LLM_BACKOFF", "0.5"))
+LLM_MAX_BACKOFF = float(os.environ.get("LLM_MAX_BACKOFF", "30"))
+
+# Provider statuses meaning "slow down" rather than "this request is wrong".
+THROTTLE_STATUSES = (429, 503)
+# Room left for the answer when estimating a call's tokens before it is made.
+EXPECTED_OUTPUT_TOKENS = 512
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough token count of some text, about four characters per token."""
+    return sum(len(text) for text in texts) // 4
+
+
+def is_throttle(error: BaseException) -> bool:
+    """Whether a model call failed because the provider is rate limiting us."""
+    return getattr(error, "status_code", None) in THROTTLE_STATUSES
+
+
+class TokenBucket:
+    """``rate`` units per second, bursting up to ``capacity``; a rate of 0 never waits."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._level = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` now, going into debt if need be; returns the seconds to wait it off."""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self._level -= amount
+            return max(0.0, -self._level / self.rate)
+
+    def adjust(self, amount: float):
+        """Take ``amount`` more (or give back a negative amount) once the real cost is known."""
+        if not self.rate:
+            return
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level - amount)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class Permit:
+    """One admitted model call; set ``tokens`` to what it really used, if known."""
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+
+
+class RateLimiter:
+    """Admission control for one provider model: token buckets plus an AIMD concurrency limit.
+
+    ``slot`` waits until fewer than ``limit`` calls are in flight and the
+    requests/sec and tokens/min budgets allow one more, then times the call.
+    A throttled call halves ``limit`` (once per round trip: calls that started
+    before the last cut do not cut again) and backs its caller off with
+    jittered exponential delay; a successful one raises ``limit`` by 1/limit,
+    about one slot per round of calls. With a latency target, slower calls
+    count as congestion too.
+    """
+
+    def __init__(self, model: str, max_rps: float = 0, max_tpm: float = 0, max_concurrency: int = 16,
+                 min_concurrency: int = 1, latency_target: float = 0,
+                 backoff: float = LLM_BACKOFF, max_backoff: float = LLM_MAX_BACKOFF):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = max(1, min(min_concurrency, max_concurrency or min_concurrency))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limit = float(max_concurrency)
+        self._requests = TokenBucket(max_rps, max(1.0, max_rps))
+        self._tokens = TokenBucket(max_tpm / 60, max_tpm)
+        self._in_flight = 0
+        self._last_cut = 0.0
+        self._throttle_streak = 0
+        self._cond = threading.Condition()
+        self._stats = {"calls": 0, "throttled": 0, "cuts": 0, "waits": 0, "wait_seconds": 0.0}
+
+    @classmethod
+    def from_env(cls, provider: str, model: str) -> "RateLimiter":
+        def setting(name: str, default: float) -> float:
+            return float(os.environ.get(f"{name}_{provider.upper()}", default))
+
+        return cls(
+            model,
+            max_rps=setting("LLM_MAX_RPS", LLM_MAX_RPS),
+            max_tpm=setting("LLM_MAX_TPM", LLM_MAX_TPM),
+            max_concurrency=int(setting("LLM_MAX_CONCURRENCY", LLM_MAX_CONCURRENCY)),
+            min_concurrency=int(setting("LLM_MIN_CONCURRENCY", LLM_MIN_CONCURRENCY)),
+            latency_target=setting("LLM_LATENCY_TARGET", LLM_LATENCY_TARGET),
+        )
+
+    @contextmanager
+    def slot(self, tokens: int = 0):
+        """Admit one model call estimated at ``tokens``; the wait is timed as the rate_limit phase."""
+        start = time.perf_counter()
+        with phase("rate_limit", self.model):
+            self._enter()
+            delay = max(self._requests.reserve(1), self._tokens.reserve(tokens))
+            if delay:
+                time.sleep(delay)
+        waited = time.perf_counter() - start
+
+        permit = Permit(tokens)
+        started = time.monotonic()
+        try:
+            yield permit
+        except BaseException as e:
+            throttled = is_throttle(e)
+            backoff = self._exit(started, waited, throttled)
+            if throttled:
+                THROTTLES.inc(model=self.model)
+                time.sleep(backoff)
+            raise
+        else:
+            self._tokens.adjust(permit.tokens - tokens)
+            self._exit(started, waited, throttled=False)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"limit": round(self.limit, 2), "in_flight": self._in_flight, **self._stats}
+
+    def _enter(self):
+        with self._cond:
+            if self.max_concurrency:
+                while self._in_flight >= int(self.limit):
+                    self._cond.wait()
+            self._in_flight += 1
+
+    def _exit(self, started: float, waited: float, throttled: bool) -> float:
+        """Update the limit after a call; returns how long a throttled caller should back off."""
+        now = time.monotonic()
+        slow = bool(self.latency_target) and now - started > self.latency_target
+        with self._cond:
+            self._in_flight -= 1
+            self._stats["calls"] += 1
+            if waited > 0.001:
+                self._stats["waits"] += 1
+                self._stats["wait_seconds"] += waited
+            if (throttled or slow) and self.max_concurrency:
+                if started >= self._last_cut:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._last_cut = now
+                    self._stats["cuts"] += 1
+            elif self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            if throttled:
+                self._stats["throttled"] += 1
+                self._throttle_streak += 1
+            else:
+                self._throttle_streak = 0
+            streak = self._throttle_streak
+            self._cond.notify_all()
+        if not throttled:
+            return 0.0
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (streak - 1)))
+
+
+def get_limiter(provider: str, model: str) -> RateLimiter:
+    """Return the process-wide limiter for ``model``, configured from the LLM_* environment."""
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limiter = _limiters[model] = RateLimiter.from_env(provider, model)
+        return limiter
+
+
+def stats() -> dict:
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {model: limiter.stats() for model, limiter in limiters.items()}
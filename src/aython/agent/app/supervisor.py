@@ -0,0 +1,99 @@
+# agent/app/supervisor.py
+import os
+import signal
+import subprocess
+import sys
+import time
+
+RESTART_DELAY = float(os.environ.get("AGENT_RESTART_DELAY", "1"))
+MAX_RESTART_DELAY = 30.0
+# A worker that lived this long is considered healthy, so its backoff resets.
+STABLE_SECONDS = 60.0
+POLL_INTERVAL = 0.2
+
+
+class Supervisor:
+    """Keeps ``workers`` copies of ``command`` running, restarting any that exit.
+
+    Each worker gets its index in ``AGENT_WORKER_ID``. A worker that keeps
+    dying right after it starts is restarted with a doubling delay, so a
+    crash loop does not spin. ``run`` supervises until SIGTERM or SIGINT and
+    then stops every worker.
+    """
+
+    def __init__(self, command: list, workers: int, env: dict = None, restart_delay: float = RESTART_DELAY):
+        self.command = command
+        self.workers = max(1, workers)
+        self.env = dict(os.environ if env is None else env)
+        self.restart_delay = restart_delay
+        self.restarts = 0
+        self._processes = {}   # worker id -> Popen, or None while waiting to restart
+        self._started = {}
+        self._delays = {}
+        self._due = {}
+        self._stopping = False
+
+    def pids(self) -> dict:
+        """Worker id -> pid of every running worker."""
+        return {i: p.pid for i, p in self._processes.items() if p is not None and p.poll() is None}
+
+    def start(self):
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+
+    def check(self):
+        """Reap exited workers and start the ones whose restart is due."""
+        now = time.monotonic()
+        for worker_id, process in list(self._processes.items()):
+            if process is None:
+                if now >= self._due[worker_id]:
+                    self.restarts += 1
+                    self._spawn(worker_id)
+                continue
+            exit_code = process.poll()
+            if exit_code is None:
+                continue
+            if now - self._started[worker_id] < STABLE_SECONDS:
+                delay = min(self._delays.get(worker_id, self.restart_delay / 2) * 2, MAX_RESTART_DELAY)
+            else:
+                delay = self.restart_delay
+            self._delays[worker_id] = delay
+            self._due[worker_id] = now + delay
+            self._processes[worker_id] = None
+            print(f"⚠️ Worker {worker_id} (pid {process.pid}) exited with {exit_code}; "
+                  f"restarting in {delay:g}s", file=sys.stderr, flush=True)
+
+    def run(self):
+        """Start the workers and keep them running until SIGTERM or SIGINT."""
+        def request_stop(signum, frame):
+            self._stopping = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        self.start()
+        try:
+            while not self._stopping:
+                self.check()
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 10):
+        """Terminate every worker, killing those still running after ``timeout`` seconds."""
+        processes = [p for p in self._processes.values() if p is not None]
+        self._processes = {}
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in processes:
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def _spawn(self, worker_id: int):
+        env = dict(self.env, AGENT_WORKER_ID=str(worker_id))
+        self._processes[worker_id] = subprocess.Popen(self.command, env=env)
+        self._started[worker_id] = time.monotonic()
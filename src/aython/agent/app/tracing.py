@@ -0,0 +1,157 @@
+# agent/app/tracing.py
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+TRACE_RING_SIZE = int(os.environ.get("TRACE_RING_SIZE", "2048"))
+TRACE_PATH = os.environ.get("TRACE_PATH", "")
+TRACE_MAX_BYTES = int(os.environ.get("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.environ.get("TRACE_BACKUPS", "3"))
+
+REQUEST_ID_HEADER = "x-request-id"
+
+# (request_id, sampled) of the request being served, and the id of the innermost open span.
+_trace = contextvars.ContextVar("aython_trace", default=None)
+_parent = contextvars.ContextVar("aython_span", default=None)
+
+
+class RingBufferExporter:
+    """Keeps the most recent spans in memory."""
+
+    def __init__(self, size: int = TRACE_RING_SIZE):
+        self._spans = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def export(self, record: dict):
+        with self._lock:
+            self._spans.append(record)
+
+    def recent(self, request_id: str = None, limit: int = 200) -> list:
+        with self._lock:
+            spans = list(self._spans)
+        if request_id:
+            spans = [s for s in spans if s["request_id"] == request_id]
+        return spans[-limit:]
+
+
+class JsonlExporter:
+    """Appends spans as JSON lines to a size-rotated file."""
+
+    def __init__(self, path: str, max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS):
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, delay=True)
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def export(self, record: dict):
+        # handle() holds the handler lock, so concurrent spans never interleave or race a rollover.
+        self._handler.handle(logging.makeLogRecord({"msg": json.dumps(record, default=str)}))
+
+    def close(self):
+        self._handler.close()
+
+
+ring = RingBufferExporter()
+exporters = [ring] + ([JsonlExporter(TRACE_PATH)] if TRACE_PATH else [])
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+@contextmanager
+def request(request_id: str = None, sampled: bool = None):
+    """Start tracing one request; spans opened inside carry ``request_id``.
+
+    Whether the request is recorded is decided once, here, from TRACE_SAMPLE_RATE
+    unless ``sampled`` is given.
+    """
+    if sampled is None:
+        sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    trace_token = _trace.set((request_id or new_request_id(), sampled))
+    parent_token = _parent.set(None)
+    try:
+        yield
+    finally:
+        _parent.reset(parent_token)
+        _trace.reset(trace_token)
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "status", "request_id", "span_id", "parent_id", "start", "_token")
+
+    def __init__(self, name: str, request_id: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.status = "ok"
+        self.request_id = request_id
+        self.span_id = uuid.uuid4().hex[:16]
+
+    def __enter__(self):
+        self.parent_id = _parent.get()
+        self._token = _parent.set(self.span_id)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.time() - self.start
+        try:
+            _parent.reset(self._token)
+        except ValueError:
+            # Closed from another context, e.g. a generator finalized elsewhere.
+            pass
+        if exc_type is not None and self.status == "ok":
+            self.status = "error"
+        record = {
+            "request_id": self.request_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(duration * 1000, 3),
+            "status": self.status,
+            "attrs": self.attrs,
+        }
+        for exporter in exporters:
+            exporter.export(record)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+    # Shared by every unsampled block, so status writes are dropped.
+    status = property(lambda self: "ok", lambda self, value: None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """Time a block as a span of the current request.
+
+    Outside a sampled request this returns a shared no-op context manager. The
+    yielded span's ``status`` can be set by the block; it is "error" if it raises.
+    """
+    trace = _trace.get()
+    if trace is None or not trace[1]:
+        return _NOOP
+    return _Span(name, trace[0], attrs)
+
+
+def bind(fn):
+    """Wrap ``fn`` to run in a copy of the current context, for executor threads."""
+    return functools.partial(contextvars.copy_context().run, fn)
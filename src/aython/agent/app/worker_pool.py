@@ -0,0 +1,272 @@
+# agent/app/worker_pool.py
+import json
+import os
+import queue
+import select
+import subprocess
+import sys
+import threading
+import time
+from typing import Optional, Tuple
+
+EXEC_WORKERS = int(os.environ.get("EXEC_WORKERS", "2"))
+EXEC_PRELOAD = [m.strip() for m in os.environ.get("EXEC_PRELOAD", "").split(",") if m.strip()]
+EXEC_MAX_RUNS = int(os.environ.get("EXEC_MAX_RUNS", "50"))
+EXEC_STARTUP_TIMEOUT = float(os.environ.get("EXEC_STARTUP_TIMEOUT", "60"))
+
+# Runs inside each worker interpreter. The protocol pipe is a private dup of
+# stdin/stdout so that snippets writing to fd 0/1 directly cannot corrupt it, and
+# the loop only uses references taken before any snippet runs, so a snippet
+# rebinding json.dumps or sys.stdout cannot either. Output written straight to
+# fd 1/2 (C extensions, subprocesses) lands in unlinked temp files that are
+# read back into the reply.
+WORKER_SOURCE = r'''
+import builtins, io, json, linecache, os, sys, tempfile, traceback
+
+requests_in = os.fdopen(os.dup(0), "r")
+replies_out = os.fdopen(os.dup(1), "w")
+devnull = os.open(os.devnull, os.O_RDWR)
+os.dup2(devnull, 0)
+os.dup2(devnull, 1)
+captures = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+fd_out, fd_err = (capture.fileno() for capture in captures)
+
+for name in sys.argv[1:]:
+    try:
+        __import__(name)
+    except Exception:
+        pass
+
+_loads, _dumps, _write, _flush = json.loads, json.dumps, replies_out.write, replies_out.flush
+_stdin, _stdout, _stderr, _dup2 = sys.stdin, sys.stdout, sys.stderr, os.dup2
+_builtins, _modules, _environ, _path = vars(builtins), sys.modules, os.environ, sys.path
+saved_builtins = dict(_builtins)
+# os.environ decodes on every read; its encoded _data is cheap to compare.
+saved_environ, saved_environ_data, saved_path = dict(_environ), dict(_environ._data), list(_path)
+
+
+def restore(saved, current):
+    for key in [key for key in current if key not in saved]:
+        del current[key]
+    for key, value in saved.items():
+        if current.get(key) is not value:
+            current[key] = value
+
+
+def fd_output(fd):
+    """What the run wrote to capture file ``fd``, which is then emptied for the next run."""
+    size = os.lseek(fd, 0, os.SEEK_END)
+    if not size:
+        return ""
+    data = os.pread(fd, size, 0)
+    os.ftruncate(fd, 0)
+    os.lseek(fd, 0, os.SEEK_SET)
+    return data.decode("utf-8", "replace")
+
+
+_write("ready\n")
+_flush()
+
+for line in requests_in:
+    code = _loads(line)["code"]
+    linecache.cache["<snippet>"] = (len(code), None, code.splitlines(True), "<snippet>")
+    out, err = io.StringIO(), io.StringIO()
+    _dup2(fd_out, 1)
+    _dup2(fd_err, 2)
+    sys.stdin, sys.stdout, sys.stderr = io.StringIO(""), out, err
+    error, exit_code = None, 0
+    try:
+        exec(compile(code, "<snippet>", "exec"), {"__name__": "__main__"})
+    except BaseException as e:
+        error = e
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = _stdin, _stdout, _stderr
+        _dup2(devnull, 1)
+        _dup2(devnull, 2)
+        try:
+            changed = _builtins != saved_builtins
+        except Exception:  # a snippet's object with a broken __eq__
+            changed = True
+        if changed:
+            restore(saved_builtins, _builtins)
+        if _environ._data != saved_environ_data:
+            restore(saved_environ, _environ)
+        _path[:] = saved_path
+        os.environ, sys.modules, sys.path = _environ, _modules, _path
+    if isinstance(error, SystemExit):
+        if error.code is None:
+            exit_code = 0
+        elif isinstance(error.code, int):
+            exit_code = error.code
+        else:
+            print(error.code, file=err)
+            exit_code = 1
+    elif error is not None:
+        traceback.print_exception(type(error), error, error.__traceback__, file=err)
+        exit_code = 1
+    _write(_dumps({
+        "exit_code": exit_code,
+        "stdout": out.getvalue() + fd_output(fd_out),
+        "stderr": err.getvalue() + fd_output(fd_err),
+    }) + "\n")
+    _flush()
+'''
+
+
+class _Worker:
+    """A single warm interpreter talking line-delimited JSON over pipes."""
+
+    def __init__(self, preload):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-u", "-c", WORKER_SOURCE, *preload],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self.runs = 0
+        self.healthy = True
+        self.ready = False
+        self._buffer = b""
+
+    def run(self, code: str, timeout: float) -> Tuple[int, str, str]:
+        if not self.ready:
+            try:
+                started = self._readline(time.monotonic() + EXEC_STARTUP_TIMEOUT)
+            except EOFError:
+                started = None
+            if started is None:
+                return self._failed("worker did not start")
+            self.ready = True
+
+        self.runs += 1
+        try:
+            self.proc.stdin.write((json.dumps({"code": code}) + "\n").encode("utf-8"))
+            self.proc.stdin.flush()
+        except OSError as e:
+            return self._failed(e)
+
+        try:
+            line = self._readline(time.monotonic() + timeout)
+        except EOFError:
+            # The snippet took the interpreter down (os._exit, segfault, ...).
+            self.healthy = False
+            return self.proc.wait(), "", ""
+        if line is None:
+            self.kill()
+            return -1, "", "Execution timed out"
+
+        try:
+            reply = json.loads(line)
+            return reply["exit_code"], reply["stdout"], reply["stderr"]
+        except (ValueError, KeyError, TypeError) as e:
+            # Something in the worker wrote to the protocol pipe; it can't be trusted.
+            return self._failed(f"bad reply from worker: {e}")
+
+    def kill(self):
+        self.healthy = False
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+    def _failed(self, reason) -> Tuple[int, str, str]:
+        self.kill()
+        return -1, "", f"Execution failed: {reason}"
+
+    def _readline(self, deadline: float) -> Optional[bytes]:
+        """Read one reply line, or None when the deadline passes; EOFError if the worker exited."""
+        fd = self.proc.stdout.fileno()
+        while b"\n" not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                return None
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise EOFError
+            self._buffer += chunk
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line
+
+
+class WorkerPool:
+    """Pool of pre-warmed interpreters that execute snippets without temp files.
+
+    Workers are recycled after ``max_runs`` snippets, and replaced whenever one
+    crashes, times out or sends a malformed reply. Each snippet gets fresh
+    globals, and the worker's builtins, sys.path and os.environ are restored
+    after it; output written to fd 1/2 is captured after the snippet's
+    ``sys.stdout``/``sys.stderr`` text rather than interleaved. Isolation
+    stops there: imported modules stay loaded, so later snippets import them
+    for free but also see any state set on them, and threads a snippet starts
+    and the process's cwd survive too, until the worker is recycled. Snippets
+    that must not see each other need ``max_runs=1``.
+    """
+
+    def __init__(self, size: int = EXEC_WORKERS, preload=None, max_runs: int = EXEC_MAX_RUNS):
+        self.size = max(1, size)
+        self.preload = list(EXEC_PRELOAD if preload is None else preload)
+        self.max_runs = max_runs
+        self._idle = queue.Queue()
+        self._spawned = 0
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """Start every worker up front instead of on first use."""
+        with self._lock:
+            while self._spawned < self.size:
+                self._idle.put(_Worker(self.preload))
+                self._spawned += 1
+
+    def run(self, code: str, timeout: float = 10) -> Tuple[int, str, str]:
+        """Execute ``code`` on an idle worker and return (exit_code, stdout, stderr)."""
+        worker = self._checkout()
+        try:
+            return worker.run(code, timeout)
+        finally:
+            if worker.healthy and worker.runs < self.max_runs:
+                self._idle.put(worker)
+            else:
+                worker.kill()
+                self._idle.put(_Worker(self.preload))
+
+    def close(self):
+        """Terminate all idle workers."""
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.kill()
+        with self._lock:
+            self._spawned = 0
+
+    def _checkout(self) -> _Worker:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._spawned < self.size:
+                self._spawned += 1
+                return _Worker(self.preload)
+        return self._idle.get()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool() -> WorkerPool:
+    """Return the process-wide pool configured from the EXEC_* environment."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = WorkerPool()
+        return _default_pool
@@ -1,53 +1,328 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import itertools
 import json
 import os
-from IPython.core.magic import Magics, line_magic, magics_class
-from IPython.display import Code, display
-import requests
-import nbformat
-from nbformat.v4 import new_notebook, new_code_cell, new_output
+import threading
+import time
+import uuid
+from IPython.core.magic import Magics, line_cell_magic, line_magic, magics_class
+
+# The notebook loaders import this file as a top-level module from the app directory.
+try:
+    from .namespace_digest import NamespaceDigest
+    from .session_journal import JOURNAL_DIR, JOURNAL_PATH, SessionJournal
+except ImportError:
+    from namespace_digest import NamespaceDigest
+    from session_journal import JOURNAL_DIR, JOURNAL_PATH, SessionJournal
 
 AGENT_URL = os.environ.get("AGENT_URL", "http://aython-agent:4000")
 HEADERS = {"Content-Type": "application/json"}
+CONNECT_TIMEOUT = float(os.environ.get("AGENT_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("AGENT_READ_TIMEOUT", "300"))
+POOL_SIZE = int(os.environ.get("AGENT_POOL_CONNECTIONS", "10"))
 
 
 class JsonRpcClient:
-    """Minimal JSON-RPC client that returns only result or error message."""
-    def __init__(self, url: str = AGENT_URL):
+    """Minimal JSON-RPC client that returns only result or error message.
+
+    Requests go through one pooled keep-alive ``requests.Session`` with connect and
+    read timeouts, created on first use so loading the extension stays fast. Each
+    HTTP request carries a fresh ``X-Request-Id`` header, which the agent uses to
+    tag its trace spans. ``last_latency`` and ``last_request_id`` describe the
+    calling thread's most recent request.
+    """
+    def __init__(self, url: str = AGENT_URL, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, pool_size: int = POOL_SIZE):
         self.url = url
-        self.request_id = 1
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._ids_lock = threading.Lock()
+        self._local = threading.local()
 
-    def call(self, method: str, params: dict = None):
-        payload = {
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                session.headers.update(HEADERS)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    @property
+    def last_latency(self) -> float:
+        return getattr(self._local, "latency", None)
+
+    @property
+    def last_request_id(self) -> str:
+        return getattr(self._local, "request_id", None)
+
+    def _post(self, path: str, payload, **kwargs):
+        url = self.url.rstrip("/") + path if path else self.url
+        self._local.request_id = uuid.uuid4().hex
+        return self.session.post(url, data=json.dumps(payload), timeout=self.timeout,
+                                 headers={"X-Request-Id": self._local.request_id}, **kwargs)
+
+    def _request(self, method: str, params: dict = None) -> dict:
+        with self._ids_lock:
+            request_id = next(self._ids)
+        return {
             "jsonrpc": "2.0",
             "method": method,
             "params": params or {},
-            "id": self.request_id
+            "id": request_id
         }
-        self.request_id += 1
+
+    def call(self, method: str, params: dict = None):
+        payload = self._request(method, params)
+        start = time.perf_counter()
         try:
-            resp = requests.post(self.url, headers=HEADERS, data=json.dumps(payload))
+            resp = self._post("", payload)
             resp.raise_for_status()
             data = resp.json()
         except Exception as e:
             return {"error": f"Request failed: {e}"}
+        finally:
+            self._local.latency = time.perf_counter() - start
+
+        return _unwrap(data)
 
-        if "error" in data:
-            err = data["error"]
-            if isinstance(err, dict):
-                return {"error": err.get("message", str(err))}
-            return {"error": str(err)}
+    def call_batch(self, calls):
+        """Send ``[(method, params), ...]`` as one JSON-RPC batch array.
+
+        Returns one result per call, in order, each shaped like ``call``'s return value.
+        """
+        payloads = [self._request(method, params) for method, params in calls]
+        start = time.perf_counter()
+        try:
+            resp = self._post("", payloads)
+            resp.raise_for_status()
+            data = resp.json()
+        except Exception as e:
+            return [{"error": f"Request failed: {e}"} for _ in calls]
+        finally:
+            self._local.latency = time.perf_counter() - start
 
-        return data.get("result", {})
+        if isinstance(data, dict):
+            return [_unwrap(data) for _ in calls]
+        by_id = {item.get("id"): item for item in data}
+        return [_unwrap(by_id.get(p["id"], {"error": "Missing response"})) for p in payloads]
+
+    def stream(self, method: str, params: dict = None):
+        """Call a method on the agent's /stream endpoint.
+
+        Yields ``(event, data)`` progress events as they arrive and finally
+        ``("result", res)`` where ``res`` has the same shape ``call`` returns.
+        """
+        payload = self._request(method, params)
+        start = time.perf_counter()
+        try:
+            resp = self._post("/stream", payload, stream=True)
+            resp.raise_for_status()
+            event = "message"
+            for line in resp.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:"):])
+                    if event == "result":
+                        self._local.latency = time.perf_counter() - start
+                        yield "result", _unwrap(data)
+                        return
+                    yield event, data
+        except Exception as e:
+            self._local.latency = time.perf_counter() - start
+            yield "result", {"error": f"Request failed: {e}"}
+            return
+        self._local.latency = time.perf_counter() - start
+        yield "result", {"error": "Stream ended without a result"}
+
+
+def _unwrap(data: dict) -> dict:
+    """Reduce a JSON-RPC response to its result, or to ``{"error": message}``."""
+    if "error" in data:
+        err = data["error"]
+        if isinstance(err, dict):
+            # A failed generation still reports the tokens it spent.
+            data = err.get("data")
+            usage = data.get("usage") if isinstance(data, dict) else None
+            return {"error": err.get("message", str(err)), **({"usage": usage} if usage else {})}
+        return {"error": str(err)}
+
+    return data.get("result", {})
 
 
 client = JsonRpcClient()
 
 
+def _display_code(code_text: str):
+    from IPython.display import Code, display
+
+    display(Code(code_text, language="python"))
+
+
+EXECUTION_MODES = ("notebook-only", "agent-only", "both-sequential", "both-concurrent")
+
+# Session-wide defaults, changed with %aython_config.
+settings = {
+    "execution": os.environ.get("AYTHON_EXECUTION", "both-sequential"),
+    # Set by %init_aython and sent with every generation, so any server process can serve it.
+    "model": None,
+}
+_SETTING_CHOICES = {"execution": EXECUTION_MODES}
+
+# Tokens this session's generations used, as the agent reported them; see %aython_usage.
+session_usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+_usage_lock = threading.Lock()
+
+# Cells that only save or export the session are left out of it.
+_UNJOURNALED = ("%save_history", "%export_notebook")
+
+_background = ThreadPoolExecutor(max_workers=4, thread_name_prefix="aython")
+
+# Background %code --async jobs of this session, by id. Generated code from
+# overlapping jobs is exec'd one snippet at a time.
+_jobs = {}
+_job_ids = itertools.count(1)
+_exec_lock = threading.Lock()
+
+
+def _parse_options(line: str):
+    """Split leading ``--flag`` / ``--key=value`` options off a magic line."""
+    options = {}
+    words = line.strip().split(" ")
+    while words and words[0].startswith("--"):
+        name, _, value = words.pop(0)[2:].partition("=")
+        options[name] = value
+    return options, " ".join(words).strip()
+
+
+class _Job:
+    """Handle for a background ``%code --async`` generation."""
+
+    def __init__(self, job_id: int, requirements: str, mode: str, cell: int):
+        self.id = job_id
+        self.requirements = requirements
+        self.mode = mode
+        self.cell = cell
+        self.status = "running"
+        self.result = None
+        self.started = time.monotonic()
+        self.finished = None
+        self._done = threading.Event()
+
+    def finish(self, result):
+        self.result = result
+        self.status = "done" if result is not None else "failed"
+        self.finished = time.monotonic()
+        self._done.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until the job finishes; returns False if ``timeout`` passed first."""
+        return self._done.wait(timeout)
+
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def __repr__(self):
+        return f"<aython job {self.id}: {self.status}>"
+
+
+def _generation_params(requirements, mode: str, context: str = "") -> dict:
+    """Build generate_and_run(_batch) params; the agent runs the code only when asked to."""
+    params = {"requirements": requirements}
+    if settings["model"]:
+        params["model"] = settings["model"]
+    if context:
+        params["context"] = context
+    agent_mode = "notebook-only" if mode == "both-concurrent" else mode
+    if agent_mode != "both-sequential":
+        params["execution"] = agent_mode
+    return params
+
+
+def _record_usage(usage: dict):
+    """Add one generation's token usage to the session totals and print it."""
+    if not usage:
+        return
+    prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    with _usage_lock:
+        session_usage["requests"] += 1
+        session_usage["prompt_tokens"] += prompt
+        session_usage["completion_tokens"] += completion
+        total = session_usage["prompt_tokens"] + session_usage["completion_tokens"]
+    approx = "~" if usage.get("estimated") else ""
+    print(f"🔢 Tokens: {approx}{prompt} prompt + {approx}{completion} completion (session total {total})")
+
+
+def _open_journal(shell):
+    """This session's journal: AYTHON_JOURNAL if set, else a new file under the IPython profile."""
+    if JOURNAL_PATH == "":
+        return None
+    session = uuid.uuid4().hex[:12]
+    path = JOURNAL_PATH
+    if not path:
+        profile_dir = getattr(getattr(shell, "profile_dir", None), "location", None)
+        path = os.path.join(profile_dir or os.path.expanduser(os.path.join("~", ".ipython")), JOURNAL_DIR,
+                            f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{session}.jsonl")
+    return SessionJournal(path, session)
+
+
+def _print_timings(mode: str, timings: dict):
+    phases = [f"{name[:-3]} {value:.0f} ms" for name, value in timings.items()
+              if name.endswith("_ms") and isinstance(value, (int, float))]
+    if phases:
+        print(f"⏱️ {mode}: " + ", ".join(phases))
+
+
 @magics_class
 class AythonMagics(Magics):
     def __init__(self, shell):
         super().__init__(shell)
+        self._digest = NamespaceDigest()
+        self._journal = _open_journal(shell)
+        self._journaled_cells = set()
+        if self._journal is not None:
+            # Cells run before the extension was loaded, then each cell as it finishes.
+            for _, line_num, cell in shell.history_manager.get_range(raw=True):
+                self._journal_cell(line_num, cell)
+            events = getattr(shell, "events", None)
+            if events is not None:
+                events.register("post_run_cell", self._on_post_run_cell)
+
+    def _journal_write(self, kind: str, **fields):
+        if self._journal is None:
+            return
+        try:
+            self._journal.append(kind, **fields)
+        except OSError as e:
+            print(f"⚠️ Could not write the session journal: {e}")
+
+    def _journal_cell(self, cell: int, source: str, success: bool = None):
+        if cell in self._journaled_cells or not source.strip() or source.strip().startswith(_UNJOURNALED):
+            return
+        self._journaled_cells.add(cell)
+        self._journal_write("cell", cell=cell, input=source, success=success)
+
+    def _on_post_run_cell(self, result):
+        self._journal_cell(result.execution_count, result.info.raw_cell, result.success)
+
+    def _context(self) -> str:
+        """Digest of the user namespace, so the agent reuses what the session already defines."""
+        try:
+            return self._digest.render(self.shell.user_ns, getattr(self.shell, "user_ns_hidden", ()))
+        except Exception as e:
+            print(f"Namespace summary skipped: {e}")
+            return ""
 
     @line_magic
     def init_aython(self, line):
@@ -60,87 +335,312 @@ class AythonMagics(Magics):
             if "error" in res:
                 print("❌", res["error"])
             else:
+                settings["model"] = model
                 print(res.get("message"))
         except Exception as e:
             print("Failed to init agent:", e)
 
     @line_magic
-    def code(self, line):
-        """Request agent to generate code and run it."""
+    def aython_config(self, line):
+        """Show or change session settings, e.g. ``%aython_config execution=agent-only``."""
         if not line.strip():
-            print("Usage: %code <requirements>")
+            for key, value in settings.items():
+                print(f"{key} = {value}")
             return
+        for item in line.split():
+            key, _, value = item.partition("=")
+            if key not in settings:
+                print(f"❌ Unknown setting '{key}'. Known settings: {', '.join(settings)}")
+                continue
+            choices = _SETTING_CHOICES.get(key)
+            if choices and value not in choices:
+                print(f"❌ {key} must be one of: {', '.join(choices)}")
+                continue
+            settings[key] = value
+            print(f"{key} = {value}")
 
+    @line_magic
+    def aython_usage(self, line):
+        """Show the tokens this session's generations used; ``--reset`` starts counting again."""
+        options, _ = _parse_options(line)
+        with _usage_lock:
+            if "reset" in options:
+                session_usage.update(requests=0, prompt_tokens=0, completion_tokens=0)
+            totals = dict(session_usage)
+        print(f"{totals['requests']} generations: {totals['prompt_tokens']} prompt + "
+              f"{totals['completion_tokens']} completion tokens "
+              f"({totals['prompt_tokens'] + totals['completion_tokens']} total)")
+        return totals
+
+    @line_magic
+    def code(self, line):
+        """Request agent to generate code and run it.
+
+        ``%code --stream <requirements>`` shows the model output as it is generated.
+        ``%code --async <requirements>`` returns a job handle at once and runs the
+        code when it arrives; see ``%code_wait`` and ``%code_jobs``.
+        ``%code --exec=<mode> <requirements>`` picks where the code runs for this
+        request: notebook-only, agent-only, both-sequential or both-concurrent.
+        """
+        options, requirements = _parse_options(line)
+        mode = options.get("exec") or settings["execution"]
+        if not requirements or mode not in EXECUTION_MODES:
+            print(f"Usage: %code [--stream|--async] [--exec={'|'.join(EXECUTION_MODES)}] <requirements>")
+            return
+
+        if "async" in options:
+            return self._submit_job(requirements, mode)
+
+        out_entry = self._generate_and_apply(requirements, mode, stream="stream" in options)
+        if out_entry is not None:
+            self.shell.user_ns.setdefault("Out", {})
+            self.shell.user_ns["Out"][self.shell.execution_count] = out_entry
+
+    @line_magic
+    def code_wait(self, line):
+        """Block until background ``%code --async`` jobs finish.
+
+        ``%code_wait`` waits for every outstanding job, ``%code_wait 2 3`` for
+        specific ones; ``--timeout=<seconds>`` bounds the wait.
+        """
+        options, ids = _parse_options(line)
+        timeout = float(options["timeout"]) if options.get("timeout") else None
+        try:
+            jobs = [_jobs[int(i)] for i in ids.split()] if ids else list(_jobs.values())
+        except (KeyError, ValueError):
+            print(f"❌ Unknown job id in '{ids}'. See %code_jobs.")
+            return
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for job in jobs:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not job.wait(remaining):
+                print(f"⏳ Job {job.id} still running")
+        return jobs[0] if len(jobs) == 1 else None
+
+    @line_magic
+    def code_jobs(self, line):
+        """List background ``%code --async`` jobs of this session."""
+        if not _jobs:
+            print("No background jobs")
+            return
+        for job in _jobs.values():
+            print(f"[{job.id}] {job.status:<8} {job.elapsed():6.1f}s  {job.requirements}")
+
+    def _submit_job(self, requirements: str, mode: str) -> "_Job":
+        job = _Job(next(_job_ids), requirements, mode, self.shell.execution_count)
+        _jobs[job.id] = job
+
+        def run():
+            try:
+                out_entry = self._generate_and_apply(requirements, mode, cell=job.cell)
+            except Exception as e:
+                print("Agent call failed:", e)
+                out_entry = None
+            if out_entry is not None:
+                self.shell.user_ns.setdefault("Out", {})
+                self.shell.user_ns["Out"][job.cell] = out_entry
+            job.finish(out_entry)
+            print(f"🔔 Job {job.id} {job.status}: {requirements}")
+
+        threading.Thread(target=run, name=f"aython-job-{job.id}", daemon=True).start()
+        print(f"⏳ Job {job.id} started; use %code_wait {job.id} to block on it")
+        return job
+
+    def _generate_and_apply(self, requirements: str, mode: str, stream: bool = False, cell: int = None):
+        """Generate code for ``requirements`` and run it; returns the Out entry or None on failure.
+
+        The request and its outcome are journaled under ``cell``, the current one by default.
+        """
+        cell = self.shell.execution_count if cell is None else cell
+        params = _generation_params(requirements, mode, self._context())
         try:
-            res = client.call("generate_and_run", {"requirements": line.strip()})
+            if stream:
+                res = self._stream_generation(params)
+            else:
+                res = client.call("generate_and_run", params)
         except Exception as e:
             print("Agent call failed:", e)
-            return
+            self._journal_write("code", cell=cell, requirements=requirements, mode=mode, error=str(e))
+            return None
 
+        _record_usage(res.get("usage"))
         debug = None
         if "error" in res:
             print("❌", res["error"])
             debug = res.get("debug_log")
         if debug:
             print("📝 debug_log:\n", debug)
-            return
+            self._journal_write("code", cell=cell, requirements=requirements, mode=mode, error=res["error"],
+                                usage=res.get("usage"), latency=client.last_latency)
+            return None
 
         code_text = res.get("code_snippet", "")
-        execution = res.get("execution_result", {})
+        execution = res.get("execution_result")
+        timings = dict(res.get("timings") or {})
 
         if code_text:
-            # Display the generated code
-            display(Code(code_text, language="python"))
-            
-            # Execute the code directly in the notebook
-            print("🚀 Executing generated code in notebook...")
-            try:
-                # Execute the code in the current namespace
-                exec(code_text, self.shell.user_ns)
-                print("✅ Code executed successfully!")
-            except Exception as e:
-                print(f"❌ Error executing code: {e}")
-                # Also show the agent's execution results for comparison
-                stdout = execution.get("stdout") or ""
-                stderr = execution.get("stderr") or ""
-                if stdout:
-                    print(f"Agent execution stdout: {stdout}")
-                if stderr:
-                    print(f"Agent execution stderr: {stderr}")
+            ran = self._apply_generated(code_text, execution, mode, timings)
         else:
+            ran = "executed_in_notebook"
             print("❌ No code generated")
 
-        # Save to Out cache
-        out_entry = {
+        self._journal_write("code", cell=cell, requirements=requirements, mode=mode, code=code_text,
+                            error=res.get("error"), execution_result=execution, ran=ran,
+                            usage=res.get("usage"), latency=client.last_latency,
+                            request_id=client.last_request_id)
+        return {
             "generated code": code_text,
-            "execution_result": "executed_in_notebook",
+            "execution_result": ran,
+            "latency": client.last_latency,
+            "request_id": client.last_request_id,
+            "timings": timings,
+            "usage": res.get("usage"),
             "display": []
         }
-        self.shell.user_ns.setdefault("Out", {})
-        self.shell.user_ns["Out"][self.shell.execution_count] = out_entry
 
-    @line_magic
-    def save_history(self, line):
-        filename = line.strip() or f"ipython_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        ip = self.shell
-        out_cache = ip.user_ns.get("Out", {})
+    @line_cell_magic
+    def code_batch(self, line, cell=None):
+        """Generate several pieces of code in parallel and run the successful ones.
 
-        history = []
-        for session_id, line_num, cell in ip.history_manager.get_range(raw=True):
-            if not cell.strip() or cell.strip().startswith(("%save_history", "%export_notebook")):
+        As a cell magic each non-empty line of the cell is one requirement; as a
+        line magic requirements are separated by ``;;``.
+        """
+        if cell is None:
+            requirements = [r.strip() for r in line.split(";;")]
+        else:
+            requirements = [r.strip() for r in cell.splitlines()]
+        requirements = [r for r in requirements if r]
+        if not requirements:
+            print("Usage: %code_batch <requirement> ;; <requirement> ...")
+            return
+
+        mode = settings["execution"]
+        params = _generation_params(requirements, mode, self._context())
+        res = client.call("generate_and_run_batch", params)
+        if "error" in res:
+            print("❌", res["error"])
+            return
+
+        generated = []
+        for requirement, item in zip(requirements, res.get("results", [])):
+            item = _unwrap(item)
+            print(f"📦 {requirement}")
+            _record_usage(item.get("usage"))
+            code_text = item.get("code_snippet", "")
+            if "error" in item or not code_text:
+                error = item.get("error", "No code generated")
+                print("❌", error)
+                self._journal_write("code", cell=self.shell.execution_count, requirements=requirement,
+                                    mode=mode, error=error, usage=item.get("usage"))
                 continue
-            entry = {"session": session_id, "line": line_num, "input": cell}
-            if line_num in out_cache:
-                entry["output"] = out_cache[line_num]
-            history.append(entry)
+            ran = self._apply_generated(code_text, item.get("execution_result"), mode,
+                                        dict(item.get("timings") or {}))
+            self._journal_write("code", cell=self.shell.execution_count, requirements=requirement, mode=mode,
+                                code=code_text, execution_result=item.get("execution_result"), ran=ran,
+                                usage=item.get("usage"))
+            generated.append(code_text)
 
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(history, f, indent=2, ensure_ascii=False)
+        print(f"✅ {len(generated)}/{len(requirements)} snippets generated")
+        self.shell.user_ns.setdefault("Out", {})
+        self.shell.user_ns["Out"][self.shell.execution_count] = {
+            "generated code": "\n\n".join(generated),
+            "execution_result": "executed_on_agent" if mode == "agent-only" else "executed_in_notebook",
+            "latency": client.last_latency,
+            "display": []
+        }
 
-        print(f"✅ History saved to {os.path.abspath(filename)}")
+    def _apply_generated(self, code_text: str, execution: dict, mode: str, timings: dict) -> str:
+        """Run generated code according to the execution mode and report per-phase latency.
+
+        Returns the label stored as ``execution_result`` in the Out cache.
+        """
+        if mode == "agent-only":
+            _display_code(code_text)
+            execution = execution or {}
+            print(f"🤖 Agent exit code: {execution.get('exit_code')}")
+            if execution.get("stdout"):
+                print(execution["stdout"], end="")
+            if execution.get("stderr"):
+                print(f"Agent execution stderr: {execution['stderr']}")
+            _print_timings(mode, timings)
+            return "executed_on_agent"
+
+        # In both-concurrent mode the agent validates the code while we display and exec it.
+        agent_run = None
+        if mode == "both-concurrent":
+            agent_run = _background.submit(client.call, "run_code", {"code": code_text})
+
+        start = time.perf_counter()
+        self._run_generated(code_text, execution or {})
+        timings["notebook_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        if agent_run is not None:
+            validation = agent_run.result()
+            timings.update(validation.get("timings") or {})
+            agent_result = validation.get("execution_result") or {}
+            if "error" in validation:
+                print("⚠️ Agent validation failed:", validation["error"])
+            elif agent_result.get("exit_code"):
+                print(f"⚠️ Agent validation exited with code {agent_result['exit_code']}")
+                if agent_result.get("stderr"):
+                    print(f"Agent execution stderr: {agent_result['stderr']}")
+        _print_timings(mode, timings)
+        return "executed_in_notebook"
+
+    def _run_generated(self, code_text: str, execution: dict):
+        """Display generated code and exec it into the user namespace."""
+        # Display the generated code
+        _display_code(code_text)
+
+        # Execute the code directly in the notebook
+        print("🚀 Executing generated code in notebook...")
+        try:
+            # Execute the code in the current namespace
+            with _exec_lock:
+                exec(code_text, self.shell.user_ns)
+            print("✅ Code executed successfully!")
+        except Exception as e:
+            print(f"❌ Error executing code: {e}")
+            # Also show the agent's execution results for comparison
+            stdout = execution.get("stdout") or ""
+            stderr = execution.get("stderr") or ""
+            if stdout:
+                print(f"Agent execution stdout: {stdout}")
+            if stderr:
+                print(f"Agent execution stderr: {stderr}")
+
+    def _stream_generation(self, params: dict) -> dict:
+        res = {}
+        for event, data in client.stream("generate_and_run", params):
+            if event == "attempt" and data.get("attempt", 1) > 1:
+                print(f"\n🔁 Retrying (attempt {data['attempt']})...", flush=True)
+            elif event == "code":
+                print(data.get("text", ""), end="", flush=True)
+            elif event == "result":
+                res = data
+        print(flush=True)
+        return res
+
+    @line_magic
+    def save_history(self, line):
+        """Save this session's journal, its cells and %code generations, as JSON Lines.
+
+        The journal is written as the session runs, so this only flushes it and
+        copies this session's records.
+        """
+        filename = line.strip() or f"ipython_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+        if self._journal is None:
+            print("❌ The session journal is off; set AYTHON_JOURNAL to a file to turn it on")
+            return
+        count = self._journal.export(filename, self._journal.session)
+        print(f"✅ History saved to {os.path.abspath(filename)} ({count} records)")
 
     @line_magic
     def export_notebook(self, line):
+        import nbformat
+        from nbformat.v4 import new_notebook, new_code_cell, new_output
+
         filename = line.strip() or f"ipython_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ipynb"
         ip = self.shell
         out_cache = ip.user_ns.get("Out", {})
@@ -0,0 +1,148 @@
+import inspect
+import os
+import threading
+
+# Token budget of the namespace summary sent with each generation; 0 sends none.
+CONTEXT_TOKENS = int(os.environ.get("AYTHON_CONTEXT_TOKENS", "400"))
+# Values can be secrets, so the summary only shows types and sizes unless this
+# opts in to the literal values of numbers and short strings.
+CONTEXT_VALUES = os.environ.get("AYTHON_CONTEXT_VALUES", "0") == "1"
+# Names IPython binds in every user namespace.
+IPYTHON_NAMES = frozenset({"In", "Out", "exit", "quit", "get_ipython"})
+MAX_VALUE_CHARS = 40
+MAX_ITEMS = 8
+
+_FUNCTION, _CLASS, _DATA, _MODULE = range(4)
+
+
+def _size(value):
+    """What about ``value`` can change in place and show in its line: shape or length."""
+    shape = getattr(value, "shape", None)
+    if isinstance(shape, tuple):
+        return shape
+    if isinstance(value, (list, tuple, dict, set, frozenset, str, bytes)):
+        return len(value)
+    return None
+
+
+def _short(text: str, limit: int = MAX_VALUE_CHARS) -> str:
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def _signature(value) -> str:
+    try:
+        return str(inspect.signature(value))
+    except (TypeError, ValueError):
+        return "(...)"
+
+
+def _summary(value) -> str:
+    doc = inspect.getdoc(value) or ""
+    return _short(doc.strip().splitlines()[0], 60) if doc.strip() else ""
+
+
+def describe(name: str, value, values: bool = False):
+    """Return ``(kind, line)`` summarising one namespace entry; ``values`` adds literal values."""
+    if inspect.ismodule(value):
+        module = value.__name__
+        return _MODULE, f"import {module}" if module == name else f"import {module} as {name}"
+    if inspect.isclass(value):
+        bases = [b.__name__ for b in value.__bases__ if b is not object]
+        methods = [m for m, v in vars(value).items() if not m.startswith("_") and callable(v)]
+        notes = []
+        if bases:
+            notes.append(f"bases: {', '.join(bases)}")
+        if methods:
+            notes.append(f"methods: {', '.join(methods[:MAX_ITEMS])}")
+        line = f"class {name}{_signature(value)}"
+        return _CLASS, f"{line}  # {'; '.join(notes)}" if notes else line
+    if inspect.isroutine(value) or callable(value) and not hasattr(value, "shape"):
+        line = f"def {name}{_signature(value)}"
+        summary = _summary(value) if inspect.isroutine(value) else ""
+        return _FUNCTION, f"{line}  # {summary}" if summary else line
+
+    type_name = type(value).__name__
+    if values and (value is None or isinstance(value, (bool, int, float, complex))):
+        return _DATA, f"{name}: {type_name} = {_short(repr(value))}"
+    if values and isinstance(value, str) and len(value) <= MAX_VALUE_CHARS:
+        return _DATA, f"{name}: str = {value!r}"
+    details = []
+    size = _size(value)
+    if isinstance(size, tuple):
+        details.append(f"shape={size}")
+        dtype = getattr(value, "dtype", None)
+        if dtype is not None:
+            details.append(f"dtype={dtype}")
+        columns = getattr(value, "columns", None)
+        if columns is not None:
+            names = [str(c) for c in list(columns)[:MAX_ITEMS]]
+            details.append(f"columns=[{', '.join(names)}{', ...' if len(columns) > MAX_ITEMS else ''}]")
+    elif size is not None:
+        details.append(f"len={size}")
+        if isinstance(value, dict) and value:
+            keys = [_short(repr(k), 20) for k in list(value)[:MAX_ITEMS]]
+            details.append(f"keys=[{', '.join(keys)}{', ...' if size > MAX_ITEMS else ''}]")
+    line = f"{name}: {type_name}"
+    return _DATA, f"{line}  # {' '.join(details)}" if details else line
+
+
+class NamespaceDigest:
+    """Compact summary of a notebook namespace, sent to the agent as generation context.
+
+    One line per public name: signatures of functions and classes, type and
+    shape or length of data, imported modules. Literal values are left out,
+    as they may be secrets, unless ``values`` is set. Lines are cached by name
+    and only recomputed when the name is bound to another object or its shape
+    or length changed, so each render is one cheap pass over the namespace.
+    Functions and classes come first, newest first; lines past the token
+    budget (about four characters per token) are dropped and counted.
+    """
+
+    def __init__(self, max_tokens: int = CONTEXT_TOKENS, values: bool = CONTEXT_VALUES):
+        self.max_tokens = max_tokens
+        self.values = values
+        self.stats = {"computed": 0, "reused": 0}
+        self._lines = {}   # name -> (fingerprint, kind, line)
+        self._lock = threading.Lock()
+
+    def render(self, namespace: dict, hidden=()) -> str:
+        """Summarise ``namespace``, skipping private, IPython and ``hidden`` names."""
+        if self.max_tokens <= 0:
+            return ""
+        with self._lock:
+            lines = {}
+            for name, value in list(namespace.items()):
+                if name.startswith("_") or name in IPYTHON_NAMES or name in hidden:
+                    continue
+                try:
+                    fingerprint = (id(value), type(value), _size(value))
+                except Exception:
+                    # A broken __getattr__ or __len__: leave the name out rather than fail the request.
+                    continue
+                cached = self._lines.get(name)
+                if cached is not None and cached[0] == fingerprint:
+                    self.stats["reused"] += 1
+                    lines[name] = cached
+                    continue
+                self.stats["computed"] += 1
+                try:
+                    kind, line = describe(name, value, self.values)
+                except Exception:
+                    kind, line = _DATA, f"{name}: {type(value).__name__}"
+                lines[name] = (fingerprint, kind, line)
+            self._lines = lines
+            return self._fit(lines)
+
+    def _fit(self, lines: dict) -> str:
+        budget = self.max_tokens * 4
+        ordered = sorted(reversed(list(lines.values())), key=lambda entry: entry[1])
+        kept = []
+        for _, _, line in ordered:
+            if len(line) + 1 > budget:
+                break
+            kept.append(line)
+            budget -= len(line) + 1
+        omitted = len(ordered) - len(kept)
+        if omitted:
+            kept.append(f"# ... and {omitted} more names")
+        return "\n".join(kept)
@@ -0,0 +1,185 @@
+import atexit
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: kernels sharing one journal file are not serialised
+    fcntl = None
+
+# Append-only record of the session's cells and %code generations. Each session
+# gets its own file in JOURNAL_DIR under the IPython profile; AYTHON_JOURNAL names
+# one file for sessions to share instead, and an empty value turns it off.
+JOURNAL_PATH = os.environ.get("AYTHON_JOURNAL")
+JOURNAL_DIR = "aython_journal"
+# Records reach the OS as they are written; fsync runs after this many records
+# or once this many seconds have passed since the last one.
+FSYNC_EVERY = int(os.environ.get("AYTHON_JOURNAL_FSYNC_EVERY", "32"))
+FSYNC_INTERVAL = float(os.environ.get("AYTHON_JOURNAL_FSYNC_INTERVAL", "1"))
+
+
+class SessionJournal:
+    """Append-only JSON Lines journal of notebook sessions.
+
+    Every record is one line with a ``seq`` number, the ``session`` that wrote
+    it, a ``time`` and a ``kind``, plus that kind's fields. The file is opened
+    on the first append. Reopening a journal resumes it: every record's byte
+    range is indexed by seq and by session, a torn last line left by a crash
+    is cut off, and numbering continues where it stopped. Several kernels may
+    append to one file: each append holds an exclusive lock on it and first
+    indexes what the others wrote, so seqs stay unique. Lines are flushed
+    as they are appended, so a kernel crash loses nothing; fsync, which only
+    guards against OS crashes and power loss, runs in batches.
+    """
+
+    def __init__(self, path: str, session: str = None, fsync_every: int = FSYNC_EVERY,
+                 fsync_interval: float = FSYNC_INTERVAL):
+        self.path = os.path.abspath(path)
+        self.session = session or uuid.uuid4().hex[:12]
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        self.stats = {"records": 0, "fsyncs": 0}
+        self._file = None
+        self._index = {}      # seq -> (offset, length)
+        self._sessions = {}   # session -> [seq, ...]
+        self._next_seq = 0
+        self._end = 0         # bytes of the file read and indexed so far
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def append(self, kind: str, **fields) -> int:
+        """Write one record and return its seq."""
+        with self._lock:
+            self._open()
+            with self._file_lock():
+                self._catch_up()
+                seq = self._next_seq
+                record = {"seq": seq, "session": self.session, "time": round(time.time(), 3), "kind": kind, **fields}
+                line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+                self._file.write(line)
+                self._file.flush()
+                self._add(seq, self.session, self._end, len(line))
+                self._end += len(line)
+                self._next_seq += 1
+            self._unsynced += 1
+            self.stats["records"] += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._synced_at >= self.fsync_interval:
+                self._sync()
+            return seq
+
+    def read(self, seq: int) -> dict:
+        """Return record ``seq``, or None if the journal has no such record."""
+        with self._lock:
+            self._open()
+            entry = self._index.get(seq)
+        if entry is None:
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(entry[0])
+            return json.loads(f.read(entry[1]))
+
+    def records(self, session: str = None, after: int = -1):
+        """Yield records in order, only ``session``'s if given, starting after seq ``after``."""
+        ranges = [r for seq, r in self._ranges(session) if seq > after]
+        with open(self.path, "rb") as f:
+            for offset, length in ranges:
+                f.seek(offset)
+                yield json.loads(f.read(length))
+
+    def sessions(self) -> list:
+        """Sessions with records in the journal, oldest first."""
+        with self._lock:
+            self._open()
+            return list(self._sessions)
+
+    def flush(self):
+        """fsync everything appended so far."""
+        with self._lock:
+            if self._file is not None and self._unsynced:
+                self._sync()
+
+    def export(self, path: str, session: str = None) -> int:
+        """Copy the journal, or only ``session``'s records, to ``path``; returns the record count."""
+        self.flush()
+        ranges = self._ranges(session)
+        if session is None:
+            shutil.copyfile(self.path, path)
+            return len(ranges)
+        with open(self.path, "rb") as src, open(path, "wb") as dst:
+            for _, (offset, length) in ranges:
+                src.seek(offset)
+                dst.write(src.read(length))
+        return len(ranges)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            if self._unsynced:
+                self._sync()
+            self._file.close()
+            self._file = None
+            atexit.unregister(self.close)
+
+    def _open(self):
+        """Open the file on first use, indexing what earlier sessions wrote."""
+        if self._file is not None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "a+b")
+        with self._file_lock():
+            self._catch_up()
+        atexit.register(self.close)
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _catch_up(self):
+        """Index the records appended since the last look; call with the file lock held."""
+        self._file.seek(self._end)
+        while True:
+            line = self._file.readline()
+            if not line:
+                return
+            if not line.endswith(b"\n"):
+                # Writers hold the lock for a whole line, so this is a crashed writer's
+                # torn line: cut off exactly the bytes just read.
+                self._file.truncate(self._end)
+                return
+            try:
+                record = json.loads(line)
+                self._add(record["seq"], record.get("session"), self._end, len(line))
+                self._next_seq = max(self._next_seq, record["seq"] + 1)
+            except (ValueError, KeyError, TypeError):
+                pass
+            self._end += len(line)
+
+    def _ranges(self, session: str = None) -> list:
+        """``[(seq, (offset, length)), ...]`` of the journal's or ``session``'s records, in order."""
+        with self._lock:
+            self._open()
+            seqs = sorted(self._index) if session is None else list(self._sessions.get(session, ()))
+            return [(seq, self._index[seq]) for seq in seqs]
+
+    def _add(self, seq: int, session: str, offset: int, length: int):
+        self._index[seq] = (offset, length)
+        self._sessions.setdefault(session, []).append(seq)
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        self.stats["fsyncs"] += 1
@@ -1,9 +1,13 @@
 import pytest
+import sys
 import tempfile
 import os
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
+# The agent app runs as a flat script inside its container, so import it the same way.
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "aython" / "agent" / "app"))
+
 
 @pytest.fixture
 def temp_dir():
@@ -137,6 +141,14 @@ def mock_environment():
         yield
 
 
+@pytest.fixture(autouse=True)
+def journal_path(tmp_path, monkeypatch):
+    """Keep each test's session journal out of the working directory and profile."""
+    path = tmp_path / "journal.jsonl"
+    monkeypatch.setattr("aython.magics.app.aython_magics.JOURNAL_PATH", str(path))
+    return path
+
+
 @pytest.fixture
 def skip_if_no_api_key():
     """Skip test if no API key is available."""
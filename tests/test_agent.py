@@ -0,0 +1,615 @@
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from aython_agent import AythonAgent, clean_model_output
+from code_extractor import CodeExtractor
+from generation_cache import GenerationCache, cache_key
+from metrics import GENERATION_ATTEMPTS, GENERATION_SUCCESSES, PHASE_SECONDS, RETRIES, THROTTLES, Registry
+from rate_limiter import RateLimiter, TokenBucket, estimate_tokens
+import tracing
+from worker_pool import WorkerPool
+
+
+def _fake_response(content):
+    response = MagicMock()
+    response.content = content
+    return response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return GenerationCache(path=str(tmp_path / "cache.db"))
+
+
+class TestGenerationCache:
+    """Test the two-tier generation cache."""
+
+    def test_key_normalizes_whitespace(self):
+        assert cache_key("gpt-4o", "sum  a list\n") == cache_key("gpt-4o", "sum a list")
+        assert cache_key("gpt-4o", "sum a list") != cache_key("gpt-4o-mini", "sum a list")
+        assert cache_key("gpt-4o", "sum a list", "x = 1") != cache_key("gpt-4o", "sum a list")
+
+    def test_memory_hit(self, cache):
+        cache.put("gpt-4o", "say hi", "", "print('hi')")
+        assert cache.get("gpt-4o", "say hi") == "print('hi')"
+        assert cache.stats["memory_hits"] == 1
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        path = str(tmp_path / "cache.db")
+        GenerationCache(path=path).put("gpt-4o", "say hi", "", "print('hi')")
+
+        fresh = GenerationCache(path=path)
+        assert fresh.get("gpt-4o", "say hi") == "print('hi')"
+        assert fresh.stats["disk_hits"] == 1
+
+    def test_ttl_expiry(self, tmp_path):
+        cache = GenerationCache(path=str(tmp_path / "cache.db"), ttl=0.01)
+        cache.put("gpt-4o", "say hi", "", "print('hi')")
+        time.sleep(0.02)
+        assert cache.get("gpt-4o", "say hi") is None
+
+    def test_size_eviction(self, tmp_path):
+        cache = GenerationCache(path=str(tmp_path / "cache.db"), memory_entries=1, disk_entries=2)
+        for i in range(3):
+            cache.put("gpt-4o", f"req {i}", "", f"x = {i}")
+            time.sleep(0.001)
+
+        assert len(cache._memory) == 1
+        assert cache.get("gpt-4o", "req 0") is None
+        assert cache.get("gpt-4o", "req 2") == "x = 2"
+
+
+class TestAythonAgentCache:
+    """Test that AythonAgent.code consults the generation cache."""
+
+    def test_code_hit_skips_llm(self, cache):
+        agent = AythonAgent("gpt-4o-mini", cache=cache)
+        agent.agent = MagicMock()
+        agent.agent.run.return_value = _fake_response('{"code_snippet": "x = 1"}')
+
+        first = agent.code("set x to one")
+        second = agent.code("set   x to one")
+
+        assert first.code_snippet == "x = 1" and not first.cache_hit
+        assert second.code_snippet == "x = 1" and second.cache_hit
+        assert agent.agent.run.call_count == 1
+
+    def test_cache_failures_are_not_generation_failures(self):
+        broken = MagicMock()
+        broken.get.side_effect = OSError("database is locked")
+        broken.put.side_effect = OSError("disk full")
+        agent = AythonAgent("gpt-4o-mini", cache=broken)
+        agent.agent = MagicMock()
+        agent.agent.run.return_value = _fake_response('{"code_snippet": "x = 1"}')
+
+        result = agent.code("set x to one")
+
+        assert result.code_snippet == "x = 1" and not result.cache_hit
+        assert "[Cache] store failed: disk full" in result.debug_log
+
+
+class TestAythonAgentStream:
+    """Test the streaming code generation path."""
+
+    def test_code_stream_yields_tokens_then_result(self):
+        agent = AythonAgent("gpt-4o-mini")
+        agent.agent = MagicMock()
+        agent.agent.run.return_value = iter([
+            MagicMock(event="RunResponseContent", content='{"code_snippet": '),
+            MagicMock(event="ReasoningStep", content="thinking"),
+            MagicMock(event="RunResponseContent", content='"x = 1"}'),
+        ])
+
+        events = list(agent.code_stream("set x to one"))
+
+        assert events[0] == ("attempt", 1)
+        assert [v for e, v in events if e == "token"] == ['{"code_snippet": ', '"x = 1"}']
+        assert [v for e, v in events if e == "code"] == ["x = 1"]
+        assert events[-1][0] == "result"
+        assert events[-1][1].code_snippet == "x = 1"
+        assert agent.agent.run.call_args.kwargs["stream"] is True
+
+
+class TestCodeExtractor:
+    """Test incremental code extraction from model responses."""
+
+    RESPONSES = {
+        "bare": ("x = 1\nprint(x)\n", "x = 1\nprint(x)"),
+        "fenced": ("```python\nx = 1\n```", "x = 1"),
+        "prose": ("Here you go:\n\n```py\nx = 1\n```\nThat sets x.\n", "x = 1"),
+        "backticks_in_code": ('```python\nfence = "```"\nprint(f"{fence}py")\n```',
+                              'fence = "```"\nprint(f"{fence}py")'),
+        "nested": ("````markdown\n```python\nx = 1\n```\n````\nDone.", "x = 1"),
+        "json": (json.dumps({"code_snippet": "s = 'caf\u00e9 \U0001F600'\nprint(s)"}),
+                 "s = 'caf\u00e9 \U0001F600'\nprint(s)"),
+        "json_fenced": ("```json\n" + json.dumps({"explain": "a", "code_snippet": "```python\nx = 1\n```"}) + "\n```",
+                        "x = 1"),
+        "json_backticks": (json.dumps({"code_snippet": 'doc = """\n```\n"""'}), 'doc = """\n```\n"""'),
+        "json_without_snippet": ('{"code": "x = 1"}', '{"code": "x = 1"}'),
+        "truncated_json": ('{"code_snippet": "x = 1\\ny = ', '{"code_snippet": "x = 1\\ny ='),
+        "glued_close": ("```python\nx = 1\nprint(x)```", "x = 1\nprint(x)"),
+        "glued_close_then_prose": ("```python\nx = 1```\nThat sets x.", "x = 1"),
+        "one_line": ("```python x = 1```", "x = 1"),
+        "one_line_json": ('```json {"code_snippet": "x=1"} ```', "x=1"),
+    }
+
+    @pytest.mark.parametrize("name", list(RESPONSES))
+    def test_extracts_code_from_any_chunking(self, name):
+        response, expected = self.RESPONSES[name]
+
+        assert clean_model_output(response) == expected
+        for size in (1, 2, 5):
+            extractor = CodeExtractor()
+            for i in range(0, len(response), size):
+                extractor.feed(response[i:i + size])
+            assert extractor.close() == expected
+
+    def test_feed_returns_code_before_the_response_ends(self):
+        extractor = CodeExtractor()
+
+        assert extractor.feed('{"code_snippet": "```python\\nimport os\\n') == "import os\n"
+        assert extractor.feed('print(os.sep)\\n```\\n", "note": "x"') == "print(os.sep)\n"
+        assert extractor.snippet == "import os\nprint(os.sep)"
+        assert extractor.feed("}") == ""
+        assert extractor.close() == "import os\nprint(os.sep)"
+
+    def test_fence_body_starting_with_a_brace_arrives_when_the_fence_closes(self):
+        extractor = CodeExtractor()
+
+        assert extractor.feed('```python\n{"a": 1}\nprint(1)\n') == ""
+        assert extractor.feed("```\n") == '{"a": 1}\nprint(1)'
+        assert extractor.close() == '{"a": 1}\nprint(1)'
+
+    def test_glued_closing_fence_is_held_back_while_streaming(self):
+        extractor = CodeExtractor()
+
+        assert extractor.feed("```python\nx = 1\nprint(x)``") == "x = 1\nprint(x)"
+        assert extractor.feed("`\nDone.") == ""
+        assert extractor.close() == "x = 1\nprint(x)"
+
+    def test_bare_code_stays_tentative_until_the_end(self):
+        extractor = CodeExtractor()
+
+        assert extractor.feed("Sure thing.\n") == ""
+        assert extractor.snippet == "Sure thing."
+        assert extractor.feed("```python\nx = 1\n") == "x = 1\n"
+        assert extractor.snippet == "x = 1"
+
+
+class TestRepairLoop:
+    """Test that failed attempts feed their error into the next attempt."""
+
+    def test_compile_error_is_fed_back(self):
+        agent = AythonAgent("gpt-4o-mini")
+        agent.agent = MagicMock()
+        agent.agent.run.side_effect = [
+            _fake_response('{"code_snippet": "def f(:\\n    pass"}'),
+            _fake_response('{"code_snippet": "def f():\\n    pass"}'),
+        ]
+
+        result = agent.code("define f")
+
+        assert result.code_snippet == "def f():\n    pass"
+        retry_prompt = agent.agent.run.call_args_list[1].args[0]
+        assert "def f(:" in retry_prompt
+        assert "SyntaxError" in retry_prompt and "line 1" in retry_prompt
+        assert agent.attempts_per_success == 2.0
+
+    def test_attempts_per_success_covers_every_agent_of_the_model(self):
+        attempts = GENERATION_ATTEMPTS.value(model="gpt-4o")
+        successes = GENERATION_SUCCESSES.value(model="gpt-4o")
+        first, second = AythonAgent("gpt-4o"), AythonAgent("gpt-4o")
+        first.agent, second.agent = MagicMock(), MagicMock()
+        first.agent.run.side_effect = [_fake_response("def f(:"), _fake_response("x = 1")]
+        second.agent.run.return_value = _fake_response("y = 2")
+
+        first.code("set x")
+        result = second.code("set y")
+
+        assert GENERATION_ATTEMPTS.value(model="gpt-4o") - attempts == 3
+        assert GENERATION_SUCCESSES.value(model="gpt-4o") - successes == 2
+        assert second.attempts_per_success == 1.0
+        assert "attempts per success for gpt-4o" in result.debug_log
+
+    def test_repair_disabled_resends_original_prompt(self):
+        agent = AythonAgent("gpt-4o-mini", repair=False)
+        agent.agent = MagicMock()
+        agent.agent.run.side_effect = [_fake_response("def f(:"), _fake_response("x = 1")]
+
+        agent.code("set x")
+
+        first, second = (c.args[0] for c in agent.agent.run.call_args_list)
+        assert first == second
+
+    def test_session_context_is_in_every_prompt(self):
+        agent = AythonAgent("gpt-4o-mini")
+        agent.agent = MagicMock()
+        agent.agent.run.side_effect = [_fake_response("def f(:"), _fake_response("y = slugify('A B')")]
+
+        agent.code("slugify a title", "def slugify(title, sep='-')")
+
+        for c in agent.agent.run.call_args_list:
+            assert "already defines" in c.args[0] and "def slugify(title, sep='-')" in c.args[0]
+
+    def test_execution_failure_is_fed_back(self):
+        pool = WorkerPool(size=1)
+        try:
+            agent = AythonAgent("gpt-4o-mini", worker_pool=pool, repair_execution=True)
+            agent.agent = MagicMock()
+            agent.agent.run.side_effect = [
+                _fake_response('{"code_snippet": "print(undefined_name)"}'),
+                _fake_response('{"code_snippet": "print(42)"}'),
+            ]
+
+            result = agent.generate_and_execute("print the answer")
+
+            retry_prompt = agent.agent.run.call_args_list[1].args[0]
+            assert "exited with code 1" in retry_prompt and "NameError" in retry_prompt
+            assert result["execution_result"].stdout == "42\n"
+        finally:
+            pool.close()
+
+
+class _Throttled(Exception):
+    status_code = 429
+
+
+class TestRateLimiter:
+    """Test admission control in front of the model calls."""
+
+    def test_token_bucket_paces_after_a_burst(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+
+        assert bucket.reserve(1) == 0 and bucket.reserve(1) == 0
+        assert bucket.reserve(1) == pytest.approx(0.1, abs=0.02)
+        assert TokenBucket(rate=0, capacity=0).reserve(10 ** 6) == 0
+
+    def test_throttles_halve_the_limit_once_per_round_trip(self):
+        limiter = RateLimiter("gpt-4o-mini", max_concurrency=8, backoff=0)
+        first, second = limiter.slot(), limiter.slot()
+        first.__enter__()
+        second.__enter__()
+
+        # Both calls were in flight before the first cut, so only one cut happens.
+        for slot in (first, second):
+            assert not slot.__exit__(_Throttled, _Throttled(), None)
+        assert limiter.stats()["limit"] == 4
+        with limiter.slot():
+            pass
+
+        assert limiter.stats()["limit"] == 4.25
+        assert limiter.stats()["throttled"] == 2 and limiter.stats()["cuts"] == 1
+
+    def test_calls_wait_for_a_free_slot(self):
+        limiter = RateLimiter("gpt-4o-mini", max_concurrency=1)
+        released = threading.Event()
+
+        def hold():
+            with limiter.slot():
+                released.wait()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        while limiter.stats()["in_flight"] == 0:
+            time.sleep(0.01)
+        threading.Timer(0.1, released.set).start()
+        with limiter.slot():
+            pass
+        holder.join()
+
+        assert limiter.stats()["waits"] == 1
+        assert limiter.stats()["wait_seconds"] >= 0.05
+
+    def test_throttled_calls_back_off_without_using_attempts(self):
+        limiter = RateLimiter("gpt-4o-mini", backoff=0)
+        agent = AythonAgent("gpt-4o-mini", limiter=limiter)
+        agent.agent = MagicMock()
+        agent.agent.run.side_effect = [_Throttled(), _Throttled(), _fake_response('{"code_snippet": "x = 1"}')]
+        throttled = THROTTLES.value(model="gpt-4o-mini")
+
+        result = agent.code("set x")
+
+        assert result.code_snippet == "x = 1"
+        assert agent.stats["attempts"] == 1
+        assert limiter.stats()["throttled"] == 2
+        assert THROTTLES.value(model="gpt-4o-mini") == throttled + 2
+
+
+class TestMetrics:
+    """Test the per-phase histograms and counters the agent records."""
+
+    def test_phases_and_retries_are_recorded(self):
+        def count(phase, outcome):
+            return PHASE_SECONDS.count(phase=phase, model="gpt-4o-mini", outcome=outcome)
+
+        before = {key: count(*key) for key in [("llm", "ok"), ("check", "ok"), ("check", "error"), ("clean", "ok")]}
+        retries = RETRIES.value(model="gpt-4o-mini")
+        agent = AythonAgent("gpt-4o-mini")
+        agent.agent = MagicMock()
+        agent.agent.run.side_effect = [_fake_response("def f(:"), _fake_response("x = 1")]
+
+        agent.code("set x")
+
+        assert count("llm", "ok") - before[("llm", "ok")] == 2
+        assert count("clean", "ok") - before[("clean", "ok")] == 2
+        assert count("check", "error") - before[("check", "error")] == 1
+        assert count("check", "ok") - before[("check", "ok")] == 1
+        assert RETRIES.value(model="gpt-4o-mini") - retries == 1
+
+    def test_prometheus_text_format(self):
+        registry = Registry()
+        latency = registry.histogram("demo_seconds", "Demo latency.", ("phase",), buckets=(0.1, 1))
+        errors = registry.counter("demo_errors_total", "Demo errors.", ("code",))
+        latency.observe(0.5, phase='say "hi"')
+        errors.inc(code=-32001)
+
+        assert registry.render().splitlines() == [
+            "# HELP demo_seconds Demo latency.",
+            "# TYPE demo_seconds histogram",
+            'demo_seconds_bucket{phase="say \\"hi\\"",le="0.1"} 0',
+            'demo_seconds_bucket{phase="say \\"hi\\"",le="1"} 1',
+            'demo_seconds_bucket{phase="say \\"hi\\"",le="+Inf"} 1',
+            'demo_seconds_sum{phase="say \\"hi\\""} 0.5',
+            'demo_seconds_count{phase="say \\"hi\\""} 1',
+            "# HELP demo_errors_total Demo errors.",
+            "# TYPE demo_errors_total counter",
+            'demo_errors_total{code="-32001"} 1',
+        ]
+
+
+class TestTracing:
+    """Test span recording, sampling and export."""
+
+    def test_unsampled_requests_record_nothing(self, monkeypatch):
+        exporter = tracing.RingBufferExporter()
+        monkeypatch.setattr(tracing, "exporters", [exporter])
+        with tracing.request("r1", sampled=False):
+            span = tracing.span("llm")
+            with span:
+                pass
+        assert span is tracing._NOOP
+        assert exporter.recent() == []
+
+    def test_spans_nest_across_executor_threads(self, monkeypatch):
+        exporter = tracing.RingBufferExporter()
+        monkeypatch.setattr(tracing, "exporters", [exporter])
+
+        def work():
+            with tracing.span("execute", attempt=1):
+                pass
+
+        with tracing.request("r2", sampled=True), tracing.span("rpc") as parent:
+            thread = threading.Thread(target=tracing.bind(work))
+            thread.start()
+            thread.join()
+
+        child, root = exporter.recent("r2")
+        assert child["parent_id"] == parent.span_id and root["parent_id"] is None
+        assert child["attrs"] == {"attempt": 1} and child["duration_ms"] >= 0
+
+    def test_jsonl_exporter_rotates(self, tmp_path, monkeypatch):
+        exporter = tracing.JsonlExporter(str(tmp_path / "spans.jsonl"), max_bytes=300, backups=1)
+        monkeypatch.setattr(tracing, "exporters", [exporter])
+        try:
+            with tracing.request("r3", sampled=True):
+                for i in range(10):
+                    with tracing.span("check", i=i):
+                        pass
+        finally:
+            exporter.close()
+
+        lines = (tmp_path / "spans.jsonl").read_text().splitlines()
+        assert (tmp_path / "spans.jsonl.1").exists()
+        assert json.loads(lines[-1])["attrs"] == {"i": 9}
+
+    def test_concurrent_exports_keep_whole_lines(self, tmp_path):
+        exporter = tracing.JsonlExporter(str(tmp_path / "spans.jsonl"), max_bytes=2000, backups=100)
+        threads = [
+            threading.Thread(target=lambda t=t: [exporter.export({"thread": t, "i": i}) for i in range(50)])
+            for t in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        exporter.close()
+
+        lines = [line for f in tmp_path.glob("spans.jsonl*") for line in f.read_text().splitlines()]
+        assert sorted((r["thread"], r["i"]) for r in map(json.loads, lines)) == [
+            (t, i) for t in range(8) for i in range(50)
+        ]
+
+
+class TestSpeculativeGeneration:
+    """Test racing several candidate generations."""
+
+    @staticmethod
+    def _agent_factory(outputs):
+        """Build fake agno agents that answer with (delay, content) pairs in order."""
+        outputs = iter(outputs)
+        lock = threading.Lock()
+
+        def run(*args, **kwargs):
+            with lock:
+                delay, content = next(outputs)
+            time.sleep(delay)
+            return _fake_response(content)
+
+        def build(self):
+            fake = MagicMock()
+            fake.run.side_effect = run
+            return fake
+
+        return build
+
+    def test_first_valid_candidate_wins(self, monkeypatch):
+        monkeypatch.setattr(AythonAgent, "_build_agent", self._agent_factory([
+            (0, "unused primary agent"),
+            (0.0, "def broken(:"),
+            (0.1, '{"code_snippet": "x = 1"}'),
+            (2.0, '{"code_snippet": "x = 2"}'),
+        ]))
+        agent = AythonAgent("gpt-4o-mini", speculation=3)
+
+        start = time.monotonic()
+        result = agent.code("set x")
+
+        assert result.code_snippet == "x = 1"
+        assert time.monotonic() - start < 1.5
+        assert agent.stats["round_trips_saved"] == 1
+        assert "saving a round trip" in result.debug_log
+
+    def test_generation_budget_caps_candidates(self, monkeypatch):
+        monkeypatch.setattr(AythonAgent, "_build_agent", self._agent_factory(
+            [(0, "unused primary agent")] + [(0, "def broken(:")] * 10
+        ))
+        agent = AythonAgent("gpt-4o-mini", speculation=2, max_generations=3)
+
+        result = agent.code("set x")
+
+        assert result.code_snippet == ""
+        assert agent.stats["candidates"] == 3
+
+
+class TestWorkerPool:
+    """Test snippet execution on warm worker interpreters."""
+
+    @pytest.fixture
+    def pool(self):
+        pool = WorkerPool(size=1, max_runs=2)
+        yield pool
+        pool.close()
+
+    def test_captures_output_and_exit_code(self, pool):
+        assert pool.run("print('hi')") == (0, "hi\n", "")
+
+        exit_code, _, stderr = pool.run("raise ValueError('boom')")
+        assert exit_code == 1
+        assert "ValueError: boom" in stderr
+
+        assert pool.run("import sys; sys.exit(3)")[0] == 3
+
+    def test_runs_are_isolated(self, pool):
+        pool.run("leaked = 1")
+        exit_code, _, stderr = pool.run("print(leaked)")
+        assert exit_code == 1
+        assert "NameError" in stderr
+
+    def test_interpreter_state_is_reset_between_runs(self, pool):
+        pool.run("import builtins, os, sys; builtins.SECRET = 1; os.environ['AYTHON_SECRET'] = '1'; sys.path.append('/x')")
+        code = "import builtins, os, sys; print(hasattr(builtins, 'SECRET'), 'AYTHON_SECRET' in os.environ, '/x' in sys.path)"
+        assert pool.run(code) == (0, "False False False\n", "")
+
+    def test_imported_modules_stay_loaded(self, pool):
+        pool.run("import colorsys")
+        assert pool.run("import sys; print('colorsys' in sys.modules)") == (0, "True\n", "")
+
+    def test_captures_fd_level_output(self, pool):
+        assert pool.run("import os; os.write(1, b'out\\n'); os.write(2, b'err\\n')") == (0, "out\n", "err\n")
+
+    def test_rebinding_json_or_stdout_keeps_the_protocol(self, pool):
+        assert pool.run("import json, sys; json.dumps = None; sys.stdout = None")[0] == 0
+        assert pool.run("print('alive')") == (0, "alive\n", "")
+
+    def test_malformed_reply_replaces_worker(self, pool):
+        exit_code, _, stderr = pool.run("import __main__; __main__.replies_out.write('junk\\n'); __main__.replies_out.flush()")
+        assert exit_code == -1
+        assert "bad reply from worker" in stderr
+        assert pool.run("print('alive')") == (0, "alive\n", "")
+
+    def test_timeout_replaces_worker(self, pool):
+        assert pool.run("while True: pass", timeout=0.5) == (-1, "", "Execution timed out")
+        assert pool.run("print('alive')") == (0, "alive\n", "")
+
+    def test_crash_replaces_worker(self, pool):
+        assert pool.run("import os; os._exit(4)")[0] == 4
+        assert pool.run("print('alive')") == (0, "alive\n", "")
+
+    def test_recycles_after_max_runs(self, pool):
+        pool.run("pass")
+        first = pool._idle.queue[0]
+        pool.run("pass")
+        assert pool._idle.queue[0] is not first
+
+    def test_execute_code_keeps_result_shape(self, pool):
+        agent = AythonAgent("gpt-4o-mini", worker_pool=pool)
+        result = agent.execute_code("print(6 * 7)")
+        assert result.model_dump() == {"exit_code": 0, "stdout": "42\n", "stderr": ""}
+
+
+class TestWarmUp:
+    """Test warming agents up without a provider."""
+
+    @pytest.mark.parametrize("model", ["gpt-4o-mini", "gemini-1.5-flash"])
+    def test_warm_up_needs_no_network_or_key(self, model, monkeypatch):
+        monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+        monkeypatch.delenv("GOOGLE_API_KEY", raising=False)
+        monkeypatch.setenv("OPENAI_BASE_URL", "http://127.0.0.1:9/v1")  # nothing listens there
+        pool = WorkerPool(size=1)
+        try:
+            assert AythonAgent(model, worker_pool=pool).warm_up() > 0
+        finally:
+            pool.close()
+
+    def test_gpt_agents_share_one_http_client(self):
+        first, second = AythonAgent("gpt-4o-mini"), AythonAgent("gpt-4o")
+
+        assert first._build_agent().model.http_client is second._build_agent().model.http_client
+
+
+class TestTokenBudget:
+    """Test per-request token accounting and the prompt and output caps."""
+
+    def test_usage_sums_provider_counts_over_attempts(self):
+        agent = AythonAgent("gpt-4o-mini")
+        agent.agent = MagicMock()
+        first, second = _fake_response("def f(:"), _fake_response("x = 1")
+        first.metrics = {"input_tokens": [100, 20], "output_tokens": [30, 5]}
+        second.metrics = {"input_tokens": [150], "output_tokens": [10]}
+        agent.agent.run.side_effect = [first, second]
+
+        usage = agent.code("set x").usage
+
+        assert (usage.prompt_tokens, usage.completion_tokens, usage.calls) == (270, 45, 2)
+        assert not usage.estimated
+
+    def test_usage_is_estimated_without_provider_counts(self):
+        agent = AythonAgent("gpt-4o-mini")
+        agent.agent = MagicMock()
+        response = _fake_response("x = 1")
+        response.metrics = {}
+        agent.agent.run.return_value = response
+
+        result = agent.generate_and_execute("set x", execute=False)
+
+        assert result["usage"]["estimated"] and result["usage"]["calls"] == 1
+        assert result["usage"]["prompt_tokens"] > 0 and result["usage"]["completion_tokens"] == 1
+
+    def test_prompt_budget_trims_context_first(self):
+        agent = AythonAgent("gpt-4o-mini", max_prompt_tokens=200)
+        context = "\n".join(f"value_{i}: int = {i}" for i in range(500))
+
+        prompt = agent._instructions("sum the values", context, "def f(:", "SyntaxError: invalid syntax")
+
+        assert estimate_tokens(prompt) <= 200
+        assert "sum the values" in prompt and "value_0: int = 0" in prompt and "value_499" not in prompt
+        assert "def f(:" in prompt and "SyntaxError: invalid syntax" in prompt
+
+    def test_prompt_budget_keeps_end_of_long_errors(self):
+        agent = AythonAgent("gpt-4o-mini", max_prompt_tokens=200)
+        error = "Traceback:\n" + "  frame\n" * 500 + "NameError: name 'y' is not defined"
+
+        prompt = agent._instructions("print y", "x: int = 1", "print(y)", error)
+
+        assert estimate_tokens(prompt) <= 200
+        assert "NameError: name 'y' is not defined" in prompt and "x: int = 1" not in prompt
+
+    @pytest.mark.parametrize("model, param", [("gpt-4o-mini", "max_completion_tokens"),
+                                               ("gemini-1.5-flash", "max_output_tokens")])
+    def test_output_budget_caps_the_model(self, model, param):
+        assert getattr(AythonAgent(model, max_output_tokens=300).agent.model, param) == 300
+        assert getattr(AythonAgent(model, max_output_tokens=0).agent.model, param) is None
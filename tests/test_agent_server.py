@@ -0,0 +1,550 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from agent_pool import AgentPool
+from aython_agent import CodeResult, ExecutionResult, TokenUsage
+from generation_cache import GenerationCache
+from http_server import HttpServer
+from job_store import JobStore
+from supervisor import Supervisor
+
+APP_DIR = Path(__file__).parent.parent / "src" / "aython" / "agent" / "app"
+
+
+@pytest.fixture(scope="module")
+def main_module(tmp_path_factory):
+    """Import the agent server with its on-disk state kept out of the repo."""
+    import main
+
+    state = tmp_path_factory.mktemp("agent")
+    main._cache = GenerationCache(path=str(state / "aython_cache.db"))
+    main._job_store = JobStore(str(state / "aython_jobs.db"))
+    return main
+
+
+@pytest.fixture
+def server_url(main_module):
+    """Serve the JSON-RPC methods on an ephemeral port in a background loop."""
+    loop = asyncio.new_event_loop()
+    http = HttpServer(routes=main_module.ROUTES, streams=main_module.STREAMS)
+    server = loop.run_until_complete(http.start("127.0.0.1", 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+    async def shutdown():
+        server.close()
+        handlers = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def _rpc(url, method, params, request_id=1):
+    payload = {"jsonrpc": "2.0", "method": method, "params": params, "id": request_id}
+    return requests.post(url, json=payload, timeout=10).json()
+
+
+def _slow_agent(delay):
+    def code(requirements, current_context=""):
+        time.sleep(delay)
+        return CodeResult(code_snippet=f"# {requirements}",
+                          usage=TokenUsage(prompt_tokens=100, completion_tokens=20, calls=1))
+
+    def execute_generated(code_result, execute, generate_seconds):
+        return {
+            "code_snippet": code_result.code_snippet,
+            "execution_result": ExecutionResult(exit_code=0, stdout="", stderr="") if execute else None,
+            "debug_log": "",
+            "cache_hit": False,
+            "timings": {"generate_ms": generate_seconds * 1000, "execute_ms": 1.0 if execute else None},
+            "usage": code_result.usage.model_dump(),
+            "error": None,
+        }
+
+    def generate_and_execute(requirements, current_context="", execute=True):
+        return execute_generated(code(requirements), execute, delay)
+
+    def generate_and_execute_stream(requirements, current_context="", execute=True):
+        yield "attempt", 1
+        yield "token", "# "
+        yield "token", requirements
+        yield "result", generate_and_execute(requirements, execute=execute)
+
+    agent = MagicMock()
+    agent.warm_up.return_value = 0.25
+    agent.code.side_effect = code
+    agent.execute_generated.side_effect = execute_generated
+    agent.generate_and_execute.side_effect = generate_and_execute
+    agent.generate_and_execute_stream.side_effect = generate_and_execute_stream
+    return agent
+
+
+def _use_agents(main_module, monkeypatch, delay, size=4):
+    pool = AgentPool(lambda: _slow_agent(delay), size=size)
+    monkeypatch.setattr(main_module, "_pools", {"gpt-4o-mini": pool})
+    monkeypatch.setattr(main_module, "_model", "gpt-4o-mini")
+    return pool
+
+
+class TestAsyncServer:
+    """Test the asyncio JSON-RPC front end."""
+
+    def test_generate_and_run(self, main_module, server_url, monkeypatch):
+        _use_agents(main_module, monkeypatch, 0)
+
+        data = _rpc(server_url, "generate_and_run", {"requirements": "say hi"})
+
+        assert data["result"]["code_snippet"] == "# say hi"
+        assert data["result"]["execution_result"]["exit_code"] == 0
+        assert data["result"]["usage"]["prompt_tokens"] == 100
+
+    def test_session_context_reaches_the_agent(self, main_module, server_url, monkeypatch):
+        pool = _use_agents(main_module, monkeypatch, 0)
+        context = "def slugify(title)"
+
+        _rpc(server_url, "generate_and_run", {"requirements": "say hi", "context": context})
+
+        calls = [c.args for agent in pool._idle.queue for c in agent.code.call_args_list]
+        assert calls == [("say hi", context)]
+
+    def test_execution_mode_skips_agent_run(self, main_module, server_url, monkeypatch):
+        _use_agents(main_module, monkeypatch, 0)
+
+        data = _rpc(server_url, "generate_and_run", {"requirements": "say hi", "execution": "notebook-only"})
+
+        assert data["result"]["execution_result"] is None
+        assert data["result"]["timings"]["execute_ms"] is None
+
+    def test_invalid_execution_mode(self, main_module, server_url, monkeypatch):
+        _use_agents(main_module, monkeypatch, 0)
+
+        data = _rpc(server_url, "generate_and_run", {"requirements": "say hi", "execution": "sometimes"})
+
+        assert data["error"]["code"] == -32602
+
+    def test_requested_model_is_prepared_on_first_use(self, main_module, server_url, monkeypatch):
+        _use_agents(main_module, monkeypatch, 0)
+        monkeypatch.setattr(main_module, "_warm_ups", {})
+        monkeypatch.setattr(main_module, "_get_pool", lambda model: main_module._pools.setdefault(
+            model, AgentPool(lambda: _slow_agent(0))))
+
+        data = _rpc(server_url, "generate_and_run", {"requirements": "say hi", "model": "gpt-4o"})
+
+        assert data["result"]["code_snippet"] == "# say hi"
+        assert "gpt-4o" in main_module._pools
+
+    def test_run_code(self, main_module, server_url):
+        data = _rpc(server_url, "run_code", {"code": "print(1 + 1)"})
+
+        assert data["result"]["execution_result"] == {"exit_code": 0, "stdout": "2\n", "stderr": ""}
+        assert data["result"]["timings"]["execute_ms"] >= 0
+
+    def test_uninitialized_agent_error(self, main_module, server_url, monkeypatch):
+        monkeypatch.setattr(main_module, "_model", None)
+
+        data = _rpc(server_url, "generate_and_run", {"requirements": "say hi"})
+
+        assert data["error"]["code"] == -32001
+
+    def test_requests_run_concurrently(self, main_module, server_url, monkeypatch):
+        pool = _use_agents(main_module, monkeypatch, 0.5)
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=4) as clients:
+            results = list(clients.map(
+                lambda i: _rpc(server_url, "generate_and_run", {"requirements": f"r{i}"}, i),
+                range(4),
+            ))
+        elapsed = time.monotonic() - start
+
+        assert all("result" in r for r in results)
+        assert elapsed < 1.5
+        assert pool.stats()["created"] == 4
+        assert pool.stats()["waits"] == 0
+
+    def test_generate_and_run_batch(self, main_module, server_url, monkeypatch):
+        _use_agents(main_module, monkeypatch, 0.5)
+
+        start = time.monotonic()
+        data = _rpc(server_url, "generate_and_run_batch", {"requirements": ["a", "b", "c", "d"]})
+        elapsed = time.monotonic() - start
+
+        results = data["result"]["results"]
+        assert [r["result"]["code_snippet"] for r in results] == ["# a", "# b", "# c", "# d"]
+        assert elapsed < 1.5
+
+    def test_batch_array(self, main_module, server_url, monkeypatch):
+        _use_agents(main_module, monkeypatch, 0.5)
+        batch = [{"jsonrpc": "2.0", "method": "generate_and_run", "params": {"requirements": f"r{i}"}, "id": i}
+                 for i in range(4)]
+
+        start = time.monotonic()
+        data = requests.post(server_url, json=batch, timeout=10).json()
+        elapsed = time.monotonic() - start
+
+        assert sorted(r["id"] for r in data) == [0, 1, 2, 3]
+        assert elapsed < 1.5
+
+    def test_stream_endpoint(self, main_module, server_url, monkeypatch):
+        _use_agents(main_module, monkeypatch, 0)
+        payload = {"jsonrpc": "2.0", "method": "generate_and_run",
+                   "params": {"requirements": "say hi"}, "id": 7}
+
+        resp = requests.post(f"{server_url}/stream", json=payload, stream=True, timeout=10)
+        lines = [line for line in resp.iter_lines(decode_unicode=True) if line]
+
+        assert resp.headers["Content-Type"] == "text/event-stream"
+        assert lines[:4] == ["event: attempt", 'data: {"attempt": 1}', "event: token", 'data: {"text": "# "}']
+        assert lines[-2] == "event: result"
+        result = json.loads(lines[-1][len("data: "):])
+        assert result["id"] == 7
+        assert result["result"]["code_snippet"] == "# say hi"
+
+    def test_metrics_endpoint(self, main_module, server_url, monkeypatch):
+        _use_agents(main_module, monkeypatch, 0)
+        _rpc(server_url, "generate_and_run", {"requirements": "say hi"})
+        monkeypatch.setattr(main_module, "_model", None)
+        _rpc(server_url, "generate_and_run", {"requirements": "say hi"})
+
+        resp = requests.get(f"{server_url}/metrics", timeout=10)
+
+        assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert "# TYPE aython_phase_seconds histogram" in resp.text
+        assert 'aython_phase_seconds_count{phase="queue",model="gpt-4o-mini",outcome="ok"}' in resp.text
+        assert 'aython_request_seconds_count{method="generate_and_run",model="gpt-4o-mini",outcome="ok"}' in resp.text
+        assert 'aython_errors_total{method="generate_and_run",code="-32001"}' in resp.text
+
+    def test_spans_carry_client_request_id(self, main_module, server_url, monkeypatch):
+        import tracing
+
+        _use_agents(main_module, monkeypatch, 0)
+        monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+        payload = {"jsonrpc": "2.0", "method": "generate_and_run", "params": {"requirements": "say hi"}, "id": 1}
+        requests.post(server_url, json=payload, headers={"X-Request-Id": "req-42"}, timeout=10)
+
+        spans = {s["name"]: s for s in _rpc(server_url, "get_trace", {"request_id": "req-42"})["result"]["spans"]}
+
+        assert {"generate_and_run", "checkout"} <= set(spans)
+        assert spans["checkout"]["parent_id"] == spans["generate_and_run"]["span_id"]
+        assert spans["checkout"]["attrs"] == {"model": "gpt-4o-mini"}
+
+    def test_ready_after_warm_up(self, main_module, server_url, monkeypatch):
+        pool = _use_agents(main_module, monkeypatch, 0)
+        monkeypatch.setattr(main_module, "_warm_ups", {})
+        monkeypatch.setattr(main_module, "_readiness", {"status": "warming", "model": "gpt-4o-mini"})
+        monkeypatch.setattr(main_module, "_default_model", "gpt-4o-mini")
+
+        assert requests.get(f"{server_url}/ready", timeout=10).status_code == 503
+        main_module._warm_default_model()
+        resp = requests.get(f"{server_url}/ready", timeout=10)
+
+        assert resp.status_code == 200
+        assert resp.json() == {"status": "ready", "model": "gpt-4o-mini", "warm_up_seconds": 0.25}
+        assert pool.stats()["created"] == 1
+
+    def test_failed_warm_up_is_not_ready(self, main_module, server_url, monkeypatch):
+        pool = _use_agents(main_module, monkeypatch, 0)
+        pool.factory = lambda: MagicMock(**{"warm_up.side_effect": RuntimeError("no such model")})
+        monkeypatch.setattr(main_module, "_warm_ups", {})
+        monkeypatch.setattr(main_module, "_readiness", {"status": "warming", "model": "gpt-4o-mini"})
+        monkeypatch.setattr(main_module, "_default_model", "gpt-4o-mini")
+
+        main_module._warm_default_model(retries=0)
+        resp = requests.get(f"{server_url}/ready", timeout=10)
+
+        assert resp.status_code == 503
+        assert resp.json()["error"] == "no such model"
+        assert "gpt-4o-mini" not in main_module._pools
+
+    def test_failed_warm_up_is_retried(self, main_module, server_url, monkeypatch):
+        attempts = []
+
+        def flaky_prepare(model):
+            attempts.append(model)
+            if len(attempts) == 1:
+                raise RuntimeError("table generations already exists")
+
+        monkeypatch.setattr(main_module, "_prepare", flaky_prepare)
+        monkeypatch.setattr(main_module, "AGENT_WARM_UP_RETRY_DELAY", 0)
+        monkeypatch.setattr(main_module, "_readiness", {"status": "warming", "model": "gpt-4o-mini"})
+
+        main_module._warm_default_model(retries=1)
+
+        assert attempts == [main_module._default_model] * 2
+        assert requests.get(f"{server_url}/ready", timeout=10).json()["status"] == "ready"
+
+    def test_init_agent_warms_each_model_once(self, main_module, server_url, monkeypatch):
+        pool = _use_agents(main_module, monkeypatch, 0)
+        monkeypatch.setattr(main_module, "_warm_ups", {})
+
+        for _ in range(3):
+            assert "result" in _rpc(server_url, "init_agent", {"model": "gpt-4o-mini"})
+
+        assert pool.stats()["created"] == 1
+        with pool.checkout() as agent:
+            agent.warm_up.assert_called_once()
+
+    def test_unknown_get_path(self, server_url):
+        assert requests.get(f"{server_url}/nope", timeout=10).status_code == 404
+
+
+class TestJobApi:
+    """Test submitting, polling, cancelling and collecting generation jobs."""
+
+    def _wait_for(self, server_url, job_id, status):
+        for _ in range(200):
+            data = _rpc(server_url, "get_job_status", {"job_id": job_id})
+            if data["result"]["status"] == status:
+                return data["result"]
+            time.sleep(0.01)
+        raise AssertionError(f"job never reached {status}")
+
+    def test_submit_and_fetch_result(self, main_module, server_url, monkeypatch):
+        _use_agents(main_module, monkeypatch, 0.1)
+
+        submitted = _rpc(server_url, "submit_generation", {"requirements": "say hi"})
+        job_id = submitted["result"]["job_id"]
+        early = _rpc(server_url, "get_job_result", {"job_id": job_id})
+        status = self._wait_for(server_url, job_id, "done")
+        data = _rpc(server_url, "get_job_result", {"job_id": job_id})
+
+        assert submitted["result"]["status"] == "queued"
+        assert early["error"]["code"] == -32005
+        assert status["model"] == "gpt-4o-mini"
+        assert data["result"]["code_snippet"] == "# say hi"
+
+    def test_cancel_queued_job(self, main_module, server_url, monkeypatch):
+        generated = []
+
+        def recording_agent():
+            agent = _slow_agent(0.3)
+            code = agent.code.side_effect
+            agent.code.side_effect = lambda r, *args: generated.append(r) or code(r, *args)
+            return agent
+
+        pool = AgentPool(recording_agent, size=1)
+        monkeypatch.setattr(main_module, "_pools", {"gpt-4o-mini": pool})
+        monkeypatch.setattr(main_module, "_model", "gpt-4o-mini")
+        running = _rpc(server_url, "submit_generation", {"requirements": "first"})["result"]["job_id"]
+        while pool.stats()["in_use"] == 0:
+            time.sleep(0.01)
+        queued = _rpc(server_url, "submit_generation", {"requirements": "second"})["result"]["job_id"]
+        assert _rpc(server_url, "get_job_status", {"job_id": queued})["result"]["status"] == "queued"
+
+        cancelled = _rpc(server_url, "cancel_job", {"job_id": queued})
+        self._wait_for(server_url, running, "done")
+
+        assert cancelled["result"]["status"] == "cancelled"
+        assert _rpc(server_url, "get_job_result", {"job_id": queued})["error"]["code"] == -32006
+        time.sleep(0.1)
+        assert generated == ["first"]
+
+    def test_job_calls_answer_while_generations_fill_the_executor(self, main_module, server_url, monkeypatch):
+        _use_agents(main_module, monkeypatch, 0.1)
+        busy, release = ThreadPoolExecutor(max_workers=1), threading.Event()
+        monkeypatch.setattr(main_module, "_executor", busy)
+        busy.submit(release.wait)
+        try:
+            job_id = _rpc(server_url, "submit_generation", {"requirements": "say hi"})["result"]["job_id"]
+            assert _rpc(server_url, "get_job_status", {"job_id": job_id})["result"]["status"] == "queued"
+            assert _rpc(server_url, "cancel_job", {"job_id": job_id})["result"]["status"] == "cancelled"
+        finally:
+            release.set()
+            busy.shutdown()
+
+    def test_checkout_of_a_dropped_model_fails(self, main_module, monkeypatch):
+        monkeypatch.setattr(main_module, "_pools", {})
+
+        with pytest.raises(RuntimeError, match="not initialized"):
+            with main_module._checkout("gpt-4o-mini", time.perf_counter()):
+                pass
+
+    def test_identical_requests_share_one_generation(self, main_module, server_url, monkeypatch):
+        pool = _use_agents(main_module, monkeypatch, 0.3)
+        requirements = ["say hi", "say  hi ", "say hi", "say bye"]
+
+        with ThreadPoolExecutor(len(requirements)) as clients:
+            responses = list(clients.map(
+                lambda r: _rpc(server_url, "generate_and_run", {"requirements": r}), requirements
+            ))
+
+        results = [response["result"] for response in responses]
+        # Whichever spelling arrived first generated the code the other two share.
+        assert len({r["code_snippet"] for r in results[:3]}) == 1
+        assert sorted(r["coalesced"] for r in results) == [False, False, True, True]
+        # Only the two generations that called the model report tokens.
+        assert sum(r["usage"]["prompt_tokens"] for r in results) == 200
+        assert pool.stats()["checkouts"] == 2
+        # Each request still ran the code itself.
+        assert sum(agent.execute_generated.call_count for agent in pool._idle.queue) == 4
+
+    def test_followers_run_code_the_leader_already_ran(self, main_module, server_url, monkeypatch):
+        pool = _use_agents(main_module, monkeypatch, 0.3)
+        leader_run = ExecutionResult(exit_code=0, stdout="leader\n", stderr="")
+
+        def repaired_agent():
+            agent = _slow_agent(0.3)
+            code = agent.code.side_effect
+            agent.code.side_effect = lambda *args: code(*args).model_copy(update={"execution": leader_run})
+            return agent
+
+        pool.factory = repaired_agent
+        with ThreadPoolExecutor(3) as clients:
+            list(clients.map(lambda _: _rpc(server_url, "generate_and_run", {"requirements": "say hi"}), range(3)))
+
+        passed = [c.args[0].execution for a in pool._idle.queue for c in a.execute_generated.call_args_list]
+        assert sorted(e is None for e in passed) == [False, True, True]
+
+    def test_requests_with_different_context_are_not_shared(self, main_module, server_url, monkeypatch):
+        _use_agents(main_module, monkeypatch, 0.3)
+
+        with ThreadPoolExecutor(2) as clients:
+            responses = list(clients.map(
+                lambda context: _rpc(server_url, "generate_and_run", {"requirements": "say hi", "context": context}),
+                ["x: int = 1", "x: str = 'a'"],
+            ))
+
+        assert [r["result"]["coalesced"] for r in responses] == [False, False]
+
+    def test_unknown_job(self, server_url):
+        for name in ("get_job_status", "get_job_result", "cancel_job"):
+            assert _rpc(server_url, name, {"job_id": "missing"})["error"]["code"] == -32004
+
+    def test_results_survive_restart(self, tmp_path):
+        from job_store import JobStore
+
+        store = JobStore(str(tmp_path / "jobs.db"))
+        job_id = store.create("gpt-4o-mini", "say hi", "both-sequential")
+        store.start(job_id)
+        store.finish(job_id, {"result": {"code_snippet": "pass"}})
+
+        job = JobStore(str(tmp_path / "jobs.db")).get(job_id)
+        assert job["status"] == "done"
+        assert job["response"] == {"result": {"code_snippet": "pass"}}
+
+    def test_expired_jobs_are_dropped(self, tmp_path):
+        from job_store import JobStore
+
+        store = JobStore(str(tmp_path / "jobs.db"), ttl=0)
+        assert store.get(store.create("gpt-4o-mini", "say hi", "both-sequential")) is None
+
+
+class TestAgentPool:
+    """Test checkout/return semantics of the per-model agent pool."""
+
+    def test_checkouts_get_distinct_agents(self):
+        pool = AgentPool(MagicMock, size=2)
+        with pool.checkout() as first, pool.checkout() as second:
+            assert first is not second
+            assert pool.stats()["in_use"] == 2
+        assert pool.stats()["idle"] == 2
+
+    def test_waits_when_exhausted(self):
+        pool = AgentPool(MagicMock, size=1)
+        released = threading.Event()
+
+        def hold():
+            with pool.checkout():
+                released.wait()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        while pool.stats()["in_use"] == 0:
+            time.sleep(0.01)
+
+        with pytest.raises(TimeoutError):
+            with pool.checkout(timeout=0.05):
+                pass
+        released.set()
+        holder.join()
+
+        with pool.checkout(timeout=1):
+            pass
+        assert pool.stats()["waits"] == 1
+        assert pool.stats()["max_waiters"] == 1
+        assert pool.stats()["waiters"] == 0
+
+    def test_prime_surfaces_factory_errors(self):
+        pool = AgentPool(MagicMock(side_effect=ValueError("bad model")))
+        with pytest.raises(ValueError):
+            pool.prime()
+        assert pool.stats()["created"] == 0
+
+
+def _server_pid(url):
+    """The pid of the server process that answered, via the parent of its execution worker."""
+    payload = {"jsonrpc": "2.0", "method": "run_code", "params": {"code": "import os; print(os.getppid())"}, "id": 1}
+    response = requests.post(url, json=payload, headers={"Connection": "close"}, timeout=30).json()
+    return int(response["result"]["execution_result"]["stdout"])
+
+
+class TestPrefork:
+    """Test running the server as several supervised processes."""
+
+    def test_supervisor_restarts_dead_workers(self):
+        supervisor = Supervisor([sys.executable, "-c", "import time; time.sleep(60)"], 2, restart_delay=0)
+        supervisor.start()
+        try:
+            before = supervisor.pids()
+            os.kill(before[0], signal.SIGKILL)
+            deadline = time.monotonic() + 10
+            while supervisor.pids().get(0) in (None, before[0]) and time.monotonic() < deadline:
+                supervisor.check()
+                time.sleep(0.05)
+
+            after = supervisor.pids()
+            assert after[0] != before[0]
+            assert after[1] == before[1]
+            assert supervisor.restarts == 1
+        finally:
+            supervisor.stop()
+        assert supervisor.pids() == {}
+
+    def test_workers_share_the_port(self, tmp_path):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        env = dict(os.environ, AGENT_PORT=str(port), AGENT_WORKERS="2", AGENT_WARM_UP="0", OPENAI_API_KEY="fake")
+        process = subprocess.Popen([sys.executable, str(APP_DIR / "main.py")], cwd=tmp_path, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = f"http://127.0.0.1:{port}"
+        try:
+            deadline = time.monotonic() + 60
+            pids = set()
+            while len(pids) < 2 and time.monotonic() < deadline:
+                try:
+                    pids.add(_server_pid(url))
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+            assert len(pids) == 2
+
+            os.kill(pids.pop(), signal.SIGKILL)
+            while len(pids) < 2 and time.monotonic() < deadline:
+                try:
+                    pids.add(_server_pid(url))
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+            assert len(pids) == 2
+        finally:
+            process.terminate()
+            process.wait(timeout=20)
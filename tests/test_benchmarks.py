@@ -0,0 +1,112 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+BENCHMARKS_DIR = Path(__file__).parent.parent / "benchmarks"
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+import fake_llm  # noqa: E402
+import load_test  # noqa: E402
+
+spec = importlib.util.spec_from_file_location(
+    "bench_agent", BENCHMARKS_DIR / "bench_agent.py"
+)
+bench_agent = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bench_agent)
+
+
+class TestBenchmarkSuite:
+    """Test the benchmark runner itself, not the numbers it produces."""
+
+    def test_filtered_run_reports_speed_and_allocations(self):
+        results = bench_agent.run("extract_streamed[json]", min_time=0.001, repeat=1, execution=False)
+
+        assert list(results) == ["extract_streamed[json]"]
+        assert results["extract_streamed[json]"]["ops_per_sec"] > 0
+        assert results["extract_streamed[json]"]["relative"] > 0
+        assert results["extract_streamed[json]"]["peak_bytes"] > 0
+
+    def test_compare_flags_regressions_beyond_threshold(self):
+        baseline = {
+            "fast": {"ops_per_sec": 1000, "relative": 1.0, "peak_bytes": 10_000},
+            "lean": {"ops_per_sec": 1000, "relative": 1.0, "peak_bytes": 10_000},
+            "steady": {"ops_per_sec": 1000, "relative": 1.0, "peak_bytes": 10_000},
+        }
+        results = {
+            # Raw ops/sec halved but so did the machine: not a regression.
+            "steady": {"ops_per_sec": 500, "relative": 0.9, "peak_bytes": 10_500},
+            "fast": {"ops_per_sec": 1000, "relative": 0.5, "peak_bytes": 10_000},
+            "lean": {"ops_per_sec": 1000, "relative": 1.0, "peak_bytes": 40_000},
+            "new": {"ops_per_sec": 1, "relative": 0.001, "peak_bytes": 1},
+        }
+
+        regressions = bench_agent.compare(results, baseline, threshold=0.25)
+
+        assert len(regressions) == 2
+        assert regressions[0].startswith("fast: -50%")
+        assert regressions[1].startswith("lean: peak allocation")
+
+
+@pytest.fixture
+def llm():
+    server = fake_llm.FakeLLM(fake_llm.FakeLLMConfig(latency=0.01, seed=0)).start()
+    yield server
+    server.stop()
+
+
+class TestLoadHarness:
+    """Test the fake LLM provider and the load generator offline."""
+
+    def test_agent_generates_against_fake_llm(self, llm, monkeypatch):
+        from aython_agent import AythonAgent
+
+        monkeypatch.setenv("OPENAI_BASE_URL", llm.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "fake")
+        llm.config.invalid_rate = 1.0
+        agent = AythonAgent("gpt-4o-mini", speculation=1)
+        agent.retries = 2
+
+        result = agent.code("add two numbers")
+
+        # Every answer fails to compile, so both attempts reach the provider.
+        assert result.code_snippet == ""
+        assert llm.stats["requests"] == 2
+        assert llm.stats["invalid"] == 2
+
+        llm.config.invalid_rate = 0.0
+        events = list(agent.code_stream("add two numbers"))
+        assert any(kind == "token" for kind, _ in events)
+        assert events[-1][1].code_snippet.startswith("def add_two_numbers():")
+        usage = events[-1][1].usage
+        assert usage.prompt_tokens > 0 and usage.completion_tokens > 0 and not usage.estimated
+
+    def test_closed_loop_step_against_spawned_server(self, llm):
+        with load_test.spawned_server(llm, "gpt-4o-mini") as url:
+            load = load_test.LoadTest(url, params={"execution": "notebook-only"}, timeout=30)
+            assert load_test._classify(load.call("init_agent", {"model": "gpt-4o-mini"})) == "ok"
+            llm.config.error_rate = 1.0
+            llm.config.error_status = 400
+            failing = load_test.run(load, "closed", [1], duration=0.2)
+            llm.config.error_rate = 0.0
+            results = load_test.run(load, "closed", [2], duration=0.5)
+
+        assert failing[0]["ok"] == 0
+        assert list(failing[0]["errors"]) == ["rpc:-32002"]
+        step = results[0]
+        assert step["level"] == 2
+        assert step["ok"] == step["requests"] > 0
+        assert step["throughput"] > 0
+        assert 0 < step["p50_ms"] <= step["p95_ms"] <= step["p99_ms"]
+
+    def test_summary_percentiles_and_error_breakdown(self):
+        samples = [(i / 100, "ok") for i in range(1, 101)] + [(5.0, "timeout"), (0.1, "rpc:-32002")] * 2
+
+        summary = load_test.summarize(samples, elapsed=10.0)
+
+        assert summary["requests"] == 104
+        assert summary["ok"] == 100
+        assert summary["throughput"] == 10.0
+        assert (summary["p50_ms"], summary["p95_ms"], summary["p99_ms"]) == (500.0, 950.0, 990.0)
+        assert summary["errors"] == {"rpc:-32002": 2, "timeout": 2}
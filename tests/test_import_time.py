@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+APP_DIR = SRC_DIR / "aython" / "agent" / "app"
+
+# Cumulative import time budgets in seconds, well above what a laptop needs so
+# only a heavy new eager import trips them.
+MAGICS_BUDGET = 0.3
+SERVER_BUDGET = 1.5
+
+PROVIDER_SDKS = ("agno", "openai", "google.genai")
+
+
+def import_report(code: str, cwd: Path = SRC_DIR):
+    """Run ``code`` under ``-X importtime``; return ({module: cumulative seconds}, summary).
+
+    The summary lists the slowest imports, for assertion messages.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(SRC_DIR), str(APP_DIR)]))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=cwd, env=env,
+                          capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative) / 1e6
+    slowest = sorted(modules.items(), key=lambda item: -item[1])[:10]
+    summary = "\n".join(f"{seconds * 1000:9.1f} ms  {name}" for name, seconds in slowest)
+    return modules, summary
+
+
+def _loaded(modules: dict, packages) -> list:
+    return sorted(name for name in modules for package in packages
+                  if name == package or name.startswith(package + "."))
+
+
+class TestImportTime:
+    """Keep %load_ext aython and the agent server's cold start cheap."""
+
+    def test_magics_load_without_http_or_notebook_libraries(self):
+        # IPython is already loaded in a kernel, so only the extension itself is measured.
+        modules, summary = import_report(
+            "import IPython.core.interactiveshell\nimport aython.magics.app"
+        )
+
+        assert not _loaded(modules, ("requests", "nbformat")), summary
+        assert modules["aython.magics.app"] < MAGICS_BUDGET, summary
+
+    def test_server_starts_without_provider_sdks(self, tmp_path):
+        # APP_DIR is on the PYTHONPATH; running elsewhere shows the import writes no files.
+        modules, summary = import_report("import main", cwd=tmp_path)
+
+        assert not _loaded(modules, PROVIDER_SDKS), summary
+        assert modules["main"] < SERVER_BUDGET, summary
+        assert not list(tmp_path.iterdir())
+
+    def test_agent_imports_only_the_provider_it_uses(self):
+        modules, summary = import_report(
+            "from aython_agent import AythonAgent\n"
+            "from worker_pool import WorkerPool\n"
+            "AythonAgent('gpt-4o-mini', worker_pool=WorkerPool(size=1))",
+            cwd=APP_DIR,
+        )
+
+        assert _loaded(modules, ("openai",)), summary
+        assert not _loaded(modules, ("google.genai", "agno.models.google")), summary